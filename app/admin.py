@@ -1,10 +1,12 @@
-from django.contrib import admin
-from .models import Movie, Actor, Director, Review
+from django.contrib import admin, messages
+from .models import Movie, Actor, Director, Review, OutgoingEmail
+from .outbox import requeue
+from . import toplist
 
 
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-    list_display = ['title', 'year', 'director', 'is_top']
+    list_display = ['title', 'year', 'director', 'rating_avg', 'rating_count', 'is_top']
     list_filter = ['year', 'is_top', 'director']
     search_fields = ['title', 'description', 'director__name', 'actors__name']
     list_editable = ['is_top']
@@ -21,6 +23,24 @@ class MovieAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        # Флаг топа меняет только app.toplist: условный UPDATE соблюдает TOP_LIMIT
+        if 'is_top' not in form.changed_data:
+            return super().save_model(request, obj, form, change)
+        wanted = obj.is_top
+        obj.is_top = not wanted
+        super().save_model(request, obj, form, change)
+        if not wanted:
+            toplist.remove(obj.pk)
+            obj.is_top = False
+        elif toplist.add(obj.pk):
+            obj.is_top = True
+        else:
+            self.message_user(
+                request, f'«{obj.title}» не добавлен: в топе может быть не более {toplist.TOP_LIMIT} фильмов',
+                messages.ERROR,
+            )
+
 
 @admin.register(Actor)
 class ActorAdmin(admin.ModelAdmin):
@@ -36,8 +56,24 @@ class DirectorAdmin(admin.ModelAdmin):
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
-    list_display = ['author_name', 'movie', 'rating', 'created_at', 'is_active']
+    list_display = ['author_name', 'user', 'movie', 'rating', 'created_at', 'is_active']
     list_filter = ['rating', 'created_at', 'movie', 'is_active']
+    list_select_related = ['user', 'movie']
     search_fields = ['author_name', 'text', 'movie__title']
+    raw_id_fields = ['user']
     readonly_fields = ['created_at']
-    list_editable = ['is_active']
\ No newline at end of file
+    list_editable = ['is_active']
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = ['created_at', 'sent_at', 'last_error', 'attempts']
+    actions = ['requeue_emails']
+
+    @admin.action(description='Вернуть недоставленные письма в очередь')
+    def requeue_emails(self, request, queryset):
+        count = requeue(queryset)
+        self.message_user(request, f'Возвращено в очередь: {count}')
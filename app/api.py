@@ -0,0 +1,261 @@
+"""
+Read-only JSON API каталога: /api/v1/...
+
+Списки постранично отдаются по курсору (поле next/previous), ?fields= ограничивает
+набор полей. ETag и Last-Modified строятся из версий моделей в кэше (app/caching.py),
+поэтому ответ 304 на условный GET отдается без единого запроса к БД. Валидаторы
+вычисляются до чтения данных, а версии увеличиваются только после коммита изменения,
+так что новый ETag никогда не отдается со старыми данными. Время изменения - целые
+секунды, каждое изменение сдвигает его хотя бы на секунду: If-Modified-Since с точностью
+до секунды не подтвердит ответ, выданный до изменения. Версии верны, только если кэш
+общий для процессов: с кэшем locmem воркер, не видевший изменения, подтверждал бы
+старый ETag, поэтому тогда валидаторы не отдаются и 304 не бывает.
+Связанные объекты (режиссер, актеры, рейтинг) встраиваются за постоянное число запросов.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Prefetch
+from django.urls import reverse
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_GET
+
+from . import caching, facets, search, typeahead
+from .models import Actor, Director, Movie, Review
+from .pagination import paginate_keyset, paginate_ranked
+
+API_VERSION = 'v1'
+
+MOVIE_ORDERING = ('-year', '-id')
+PERSON_ORDERING = ('name', 'id')
+REVIEW_ORDERING = ('-created_at', '-id')
+
+# Модели, от которых зависит ответ каждого ресурса (рейтинг фильма меняют отзывы)
+DEPENDENCIES = {
+    'movie': ('movie', 'actor', 'director', 'review'),
+    'actor': ('actor',),
+    'director': ('director',),
+    'review': ('review',),
+}
+
+
+# ПРЕДСТАВЛЕНИЕ ОБЪЕКТОВ
+
+def _person(person):
+    return {'id': person.pk, 'name': person.name} if person else None
+
+
+def _image_url(fieldfile):
+    return fieldfile.url if fieldfile else None
+
+
+MOVIE_FIELDS = {
+    'id': lambda movie: movie.pk,
+    'title': lambda movie: movie.title,
+    'description': lambda movie: movie.description,
+    'year': lambda movie: movie.year,
+    'is_top': lambda movie: movie.is_top,
+    'created_at': lambda movie: movie.created_at,
+    'poster': lambda movie: _image_url(movie.poster),
+    'director': lambda movie: _person(movie.director),
+    'actors': lambda movie: [_person(actor) for actor in movie.actors.all()],
+    'rating': lambda movie: {'average': round(movie.rating_avg, 2), 'count': movie.rating_count},
+}
+
+PERSON_FIELDS = {
+    'id': lambda person: person.pk,
+    'name': lambda person: person.name,
+    'bio': lambda person: person.bio,
+    'photo': lambda person: _image_url(person.photo),
+}
+
+REVIEW_FIELDS = {
+    'id': lambda review: review.pk,
+    'movie': lambda review: review.movie_id,
+    'author_name': lambda review: review.author_name,
+    'user': lambda review: review.user_id,
+    'rating': lambda review: review.rating,
+    'text': lambda review: review.text,
+    'created_at': lambda review: review.created_at,
+}
+
+
+def selected_fields(request, available):
+    """Поля из ?fields=a,b (неизвестные игнорируются) или все поля ресурса."""
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(available)
+    fields = [field for field in (name.strip() for name in requested.split(',')) if field in available]
+    return fields or list(available)
+
+
+def serialize(obj, fields, available):
+    return {field: available[field](obj) for field in fields}
+
+
+def movie_queryset(fields):
+    movies = Movie.objects.all()
+    if 'director' in fields:
+        movies = movies.select_related('director')
+    if 'actors' in fields:
+        movies = movies.prefetch_related(Prefetch('actors', queryset=Actor.objects.order_by('name', 'id')))
+    return movies
+
+
+# УСЛОВНЫЙ GET
+
+def _resource_etag(resource):
+    def etag(request, *args, **kwargs):
+        if not caching.is_shared():
+            return None
+        versions = caching.get_versions(DEPENDENCIES[resource])
+        raw = ':'.join([API_VERSION, request.get_full_path(), *map(str, versions)])
+        return hashlib.sha1(raw.encode(), usedforsecurity=False).hexdigest()
+    return etag
+
+
+def _resource_last_modified(resource):
+    def last_modified(request, *args, **kwargs):
+        if not caching.is_shared():
+            return None
+        stamp = caching.get_last_modified(DEPENDENCIES[resource])
+        return datetime.fromtimestamp(stamp, tz=dt_timezone.utc)
+    return last_modified
+
+
+def api_view(resource):
+    """GET-only view с ETag/Last-Modified; 304 отдается до вызова view."""
+    def decorator(view_func):
+        view_func = condition(
+            etag_func=_resource_etag(resource),
+            last_modified_func=_resource_last_modified(resource),
+        )(view_func)
+        return require_GET(view_func)
+    return decorator
+
+
+# ОТВЕТЫ
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def _not_found():
+    return _json({'detail': 'Не найдено'}, status=404)
+
+
+def _page_response(request, page, fields, available):
+    def absolute(url):
+        return request.build_absolute_uri(request.path + url) if url else None
+
+    return _json({
+        'results': [serialize(obj, fields, available) for obj in page],
+        'next': absolute(page.next_url),
+        'previous': absolute(page.prev_url),
+    })
+
+
+def _int_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+# РЕСУРСЫ
+
+@api_view('movie')
+def movie_list(request):
+    fields = selected_fields(request, MOVIE_FIELDS)
+    filters = {}
+    for param in ('director', 'actor', 'year'):
+        value = _int_param(request, param)
+        if value is not None:
+            filters[param] = str(value)
+    if request.GET.get('top') in ('1', 'true'):
+        filters['top'] = facets.TOP_VALUE
+    movies = facets.filter_queryset(movie_queryset(fields), filters)
+
+    query = request.GET.get('q')
+    if query:
+        # Фильтры применяются к списку id до нарезки на страницы, иначе страницы были бы неполными
+        ranked_ids = facets.filter_ids(search.search_movie_ids(query), filters)
+        page = paginate_ranked(request, movies, ranked_ids)
+    else:
+        page = paginate_keyset(request, movies, MOVIE_ORDERING)
+    return _page_response(request, page, fields, MOVIE_FIELDS)
+
+
+@api_view('movie')
+def movie_detail(request, movie_id):
+    fields = selected_fields(request, MOVIE_FIELDS)
+    movie = movie_queryset(fields).filter(pk=movie_id).first()
+    if movie is None:
+        return _not_found()
+    return _json(serialize(movie, fields, MOVIE_FIELDS))
+
+
+def _person_views(model, resource):
+    @api_view(resource)
+    def person_list(request):
+        fields = selected_fields(request, PERSON_FIELDS)
+        page = paginate_keyset(request, model.objects.all(), PERSON_ORDERING)
+        return _page_response(request, page, fields, PERSON_FIELDS)
+
+    @api_view(resource)
+    def person_detail(request, person_id):
+        fields = selected_fields(request, PERSON_FIELDS)
+        person = model.objects.filter(pk=person_id).first()
+        if person is None:
+            return _not_found()
+        return _json(serialize(person, fields, PERSON_FIELDS))
+
+    return person_list, person_detail
+
+
+actor_list, actor_detail = _person_views(Actor, 'actor')
+director_list, director_detail = _person_views(Director, 'director')
+
+
+@api_view('review')
+def review_list(request):
+    fields = selected_fields(request, REVIEW_FIELDS)
+    reviews = Review.objects.filter(is_active=True)
+    movie_id = _int_param(request, 'movie')
+    if movie_id is not None:
+        reviews = reviews.filter(movie_id=movie_id)
+    page = paginate_keyset(request, reviews, REVIEW_ORDERING)
+    return _page_response(request, page, fields, REVIEW_FIELDS)
+
+
+@api_view('review')
+def review_detail(request, review_id):
+    fields = selected_fields(request, REVIEW_FIELDS)
+    review = Review.objects.filter(pk=review_id, is_active=True).first()
+    if review is None:
+        return _not_found()
+    return _json(serialize(review, fields, REVIEW_FIELDS))
+
+
+# ПОДСКАЗКИ ПОИСКА
+
+SUGGEST_URLS = {
+    'movie': 'movie_detail',
+    'director': 'director_detail',
+    'actor': 'actor_detail',
+}
+
+
+@require_GET
+def suggest(request):
+    """Подсказки для строки поиска из индекса в памяти, без запросов к БД."""
+    groups = typeahead.suggest(request.GET.get('q', ''))
+    results = [
+        {'type': kind, 'id': pk, 'name': name, 'url': reverse(SUGGEST_URLS[kind], args=[pk])}
+        for kind in typeahead.KINDS
+        for pk, name in groups.get(kind, ())
+    ]
+    response = _json({'results': results})
+    # Подсказки меняются редко, а запрос идет на каждое нажатие клавиши
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
@@ -0,0 +1,293 @@
+"""
+Сборка и раздача статики.
+
+Сборка (python manage.py build_static -> collectstatic с хранилищем StaticFilesStorage):
+    хэши в именах и манифест staticfiles.json - стандартный ManifestStaticFilesStorage;
+    бандлы CSS (STATIC_BUNDLES) - исходные файлы склеиваются и минифицируются
+        после того, как Django переписал в них url() на имена с хэшами;
+    сжатые копии - рядом с каждым файлом с хэшем лежат name.gz и name.br
+        (brotli - если установлен пакет brotli), если сжатие дает выигрыш.
+
+Раздача: StaticFilesMiddleware (WSGI) и ASGIStaticFilesMiddleware оборачивают приложение
+Django и отдают STATIC_ROOT сами. Каталог обходится один раз при старте воркера:
+размер, тип, ETag и сжатые варианты каждого файла известны заранее, запрос к статике
+не делает stat() и не доходит до Django. Файлы с хэшем в имени получают Cache-Control
+на год с immutable, остальные - STATIC_MAX_AGE секунд.
+"""
+import asyncio
+import gzip
+import json
+import mimetypes
+import os
+import re
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+from django.templatetags.static import static
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Что имеет смысл сжимать: шрифты woff2, картинки и архивы уже сжаты
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.xml', '.html', '.map', '.ico', '.ttf', '.eot')
+# Сжатая копия сохраняется, только если она меньше исходника хотя бы на 5%
+COMPRESSION_MIN_RATIO = 0.95
+
+# Кодировки в порядке предпочтения и расширения их файлов
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CHUNK_SIZE = 64 * 1024
+
+
+# МИНИФИКАЦИЯ CSS
+
+_CSS_STRING_OR_COMMENT = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/', re.S)
+_CSS_SPACES = re.compile(r'\s+')
+# Вокруг этих символов пробелы не значимы; у «:» пробел до нее значим в селекторах
+_CSS_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+_CSS_AFTER_COLON = re.compile(r': ')
+_CSS_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+
+
+def minify_css(source):
+    """Убирает комментарии и лишние пробелы; строки в кавычках не трогает."""
+    strings = []
+
+    def keep(match):
+        token = match.group()
+        if token.startswith('/*'):
+            return ' '
+        strings.append(token)
+        return f'\x00{len(strings) - 1}\x00'
+
+    text = _CSS_STRING_OR_COMMENT.sub(keep, source)
+    text = _CSS_SPACES.sub(' ', text)
+    text = _CSS_PUNCTUATION.sub(r'\1', text)
+    text = _CSS_AFTER_COLON.sub(':', text)
+    text = text.replace(';}', '}')
+    return _CSS_PLACEHOLDER.sub(lambda match: strings[int(match.group(1))], text).strip()
+
+
+# СБОРКА
+
+def compress(data):
+    """{'gzip': bytes, 'br': bytes} - варианты, которые заметно меньше исходника."""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {
+        encoding: compressed for encoding, compressed in variants.items()
+        if len(compressed) < len(data) * COMPRESSION_MIN_RATIO
+    }
+
+
+class StaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage с бандлами CSS и сжатыми копиями файлов."""
+
+    @property
+    def manifest_strict(self):
+        return settings.STATIC_MANIFEST_STRICT
+
+    def stored_name(self, name):
+        if self.manifest_strict:
+            # Файла нет в манифесте сборки - ошибка, а не молчаливая ссылка без хэша
+            return super().stored_name(name)
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Сборка не запускалась (разработка, тесты): файл отдается под исходным именем
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for bundle in settings.STATIC_BUNDLES:
+            yield bundle, self._build_bundle(bundle), True
+        self.save_manifest()
+        self.compressed = self._compress_all()
+
+    def _replace(self, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, content)
+
+    def _build_bundle(self, bundle):
+        parts = []
+        for source in settings.STATIC_BUNDLES[bundle]:
+            with self.open(self.stored_name(source)) as file:
+                parts.append(file.read().decode())
+        content = ContentFile(minify_css('\n'.join(parts)).encode())
+        hashed = self.hashed_name(bundle, content)
+        self._replace(hashed, content)
+        self.hashed_files[self.hash_key(bundle)] = hashed
+        return hashed
+
+    def _compress_all(self):
+        """Пишет .gz/.br для файлов с хэшем; возвращает {имя: {кодировка: размер}}."""
+        compressed = {}
+        for name in set(self.hashed_files.values()):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            with self.open(name) as file:
+                data = file.read()
+            sizes = compressed[name] = {'identity': len(data)}
+            variants = compress(data)
+            for encoding, extension in ENCODINGS:
+                if self.exists(name + extension):
+                    self.delete(name + extension)
+                if encoding in variants:
+                    self._save(name + extension, ContentFile(variants[encoding]))
+                    sizes[encoding] = len(variants[encoding])
+        return compressed
+
+
+def bundle_urls(bundle):
+    """Адреса для бандла: собранный файл или (без сборки и в DEBUG) исходные файлы."""
+    if not settings.DEBUG and bundle in getattr(staticfiles_storage, 'hashed_files', {}):
+        return [staticfiles_storage.url(bundle)]
+    return [static(source) for source in settings.STATIC_BUNDLES[bundle]]
+
+
+# РАЗДАЧА
+
+class _StaticFile:
+    __slots__ = ('path', 'headers', 'variants')
+
+    def __init__(self, path, immutable):
+        self.path = path
+        stat = os.stat(path)
+        content_type, _ = mimetypes.guess_type(path)
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        elif content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        max_age = settings.STATIC_IMMUTABLE_MAX_AGE if immutable else settings.STATIC_MAX_AGE
+        self.headers = [
+            ('Content-Type', content_type),
+            ('Cache-Control', f'public, max-age={max_age}' + (', immutable' if immutable else '')),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        etag = f'{stat.st_size:x}-{int(stat.st_mtime):x}'
+        # кодировка -> (путь, размер, ETag); identity - сам файл
+        self.variants = {'identity': (path, stat.st_size, f'"{etag}"')}
+        for encoding, extension in ENCODINGS:
+            if os.path.exists(path + extension):
+                size = os.path.getsize(path + extension)
+                self.variants[encoding] = (path + extension, size, f'"{etag}-{encoding}"')
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(encoding.strip().lower())
+    return accepted
+
+
+class StaticFiles:
+    """Индекс STATIC_ROOT в памяти: путь URL -> файл, его заголовки и сжатые варианты."""
+
+    def __init__(self, root=None, url=None):
+        root = str(root or settings.STATIC_ROOT)
+        url = settings.STATIC_URL if url is None else url
+        self.prefix = '/' + url.lstrip('/')
+        self.files = {}
+        # Абсолютный STATIC_URL (CDN) или выключенная раздача - отдавать нечего
+        if not settings.STATIC_SERVE or '://' in url or not os.path.isdir(root):
+            return
+        hashed = set()
+        manifest = os.path.join(root, staticfiles_storage.manifest_name)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as file:
+                hashed = set(json.load(file).get('paths', {}).values())
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(tuple(extension for _, extension in ENCODINGS)):
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                self.files[self.prefix + name] = _StaticFile(path, name in hashed)
+
+    def find(self, path, method, accept_encoding='', if_none_match=None):
+        """(статус, заголовки, путь к файлу или None для 304/HEAD) или None, если это не статика."""
+        static_file = self.files.get(path)
+        if static_file is None or method not in ('GET', 'HEAD'):
+            return None
+        accepted = _accepted_encodings(accept_encoding) if accept_encoding else set()
+        encoding = next(
+            (encoding for encoding, _ in ENCODINGS if encoding in accepted and encoding in static_file.variants),
+            'identity',
+        )
+        file_path, size, etag = static_file.variants[encoding]
+        headers = [*static_file.headers, ('ETag', etag)]
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        if if_none_match and etag in (tag.strip() for tag in if_none_match.split(',')):
+            return '304 Not Modified', headers, None
+        headers.append(('Content-Length', str(size)))
+        return '200 OK', headers, file_path if method == 'GET' else None
+
+
+class StaticFilesMiddleware:
+    """WSGI-обертка: отдает собранную статику, остальные запросы передает приложению."""
+
+    def __init__(self, application, root=None, url=None):
+        self.application = application
+        self.static_files = StaticFiles(root, url)
+
+    def __call__(self, environ, start_response):
+        found = self.static_files.find(
+            environ.get('PATH_INFO', ''), environ['REQUEST_METHOD'],
+            environ.get('HTTP_ACCEPT_ENCODING', ''), environ.get('HTTP_IF_NONE_MATCH'),
+        )
+        if found is None:
+            return self.application(environ, start_response)
+        status, headers, path = found
+        start_response(status, headers)
+        if path is None:
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(path, 'rb'), CHUNK_SIZE)
+
+
+class ASGIStaticFilesMiddleware:
+    """То же для ASGI: файл читается в потоке, цикл событий не блокируется."""
+
+    def __init__(self, application, root=None, url=None):
+        self.application = application
+        self.static_files = StaticFiles(root, url)
+
+    async def __call__(self, scope, receive, send):
+        found = None
+        if scope['type'] == 'http' and scope['path'] in self.static_files.files:
+            request_headers = {
+                name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']
+            }
+            found = self.static_files.find(
+                scope['path'], scope['method'],
+                request_headers.get('accept-encoding', ''), request_headers.get('if-none-match'),
+            )
+        if found is None:
+            return await self.application(scope, receive, send)
+        status, headers, path = found
+        await send({
+            'type': 'http.response.start',
+            'status': int(status[:3]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        if path is None:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        with open(path, 'rb') as file:
+            while True:
+                chunk = await asyncio.to_thread(file.read, CHUNK_SIZE)
+                more = len(chunk) == CHUNK_SIZE
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+                if not more:
+                    break
@@ -0,0 +1,35 @@
+"""
+Ленивый бэкенд входа через Яндекс.
+
+Django загружает все AUTHENTICATION_BACKENDS при каждом authenticate() (форма входа)
+и при проверке прав в админке, а модуль бэкенда social_core тянет за собой клиент
+OAuth. YandexOAuth2 отсюда стоит в AUTHENTICATION_BACKENDS вместо него и ничего
+не импортирует: настоящий бэкенд social_django загружает по
+SOCIAL_AUTH_AUTHENTICATION_BACKENDS только на маршрутах /oauth/ и сам передает его
+в authenticate(), вход по паролю проходит мимо.
+
+После входа через Яндекс social_django записывает в сессию путь настоящего бэкенда,
+который обработчик user_logged_in в app/signals.py заменяет на BACKEND_PATH.
+Сессии, выданные до появления этого бэкенда, хранят SOCIAL_BACKEND_PATH: на переходный
+период он тоже стоит в AUTHENTICATION_BACKENDS, чтобы такие пользователи не вылетали
+из аккаунта; social_core тогда импортируется при первой загрузке бэкендов в процессе
+(authenticate(), проверка прав), а не при старте.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import BaseBackend
+
+BACKEND_PATH = f'{__name__}.YandexOAuth2'
+SOCIAL_BACKEND_PATH = 'social_core.backends.yandex.YandexOAuth2'
+SOCIAL_BACKEND_NAME = 'yandex-oauth2'
+
+
+class YandexOAuth2(BaseBackend):
+    def authenticate(self, request, **credentials):
+        backend = credentials.get('backend')
+        if getattr(backend, 'name', None) != SOCIAL_BACKEND_NAME:
+            return None
+        return backend.authenticate(request, **credentials)
+
+    def get_user(self, user_id):
+        # Как у social_django: только активные пользователи
+        return get_user_model()._default_manager.filter(pk=user_id, is_active=True).first()
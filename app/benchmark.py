@@ -0,0 +1,526 @@
+"""
+Нагрузочные замеры страниц каталога.
+
+generate_catalog() строит синтетический каталог заданного размера,
+run_client() прогоняет сценарии через django.test.Client (задержки, запросы к БД, память),
+run_wsgi() и run_asgi() - через настоящий сервер (WSGI с потоком на запрос или
+ASGI на цикле событий) несколькими параллельными клиентами.
+run_sqlite_contention() - читатели и писатели на отдельном файле SQLite с заданными
+OPTIONS (профиль SQLITE_PROFILE против настроек по умолчанию).
+Результаты сохраняются в JSON и сравниваются с прошлым прогоном (compare()).
+"""
+import asyncio
+import http.client
+import platform
+import random
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import caching, facets, search, toplist, typeahead
+from .models import Actor, Director, Movie, Review
+
+WORDS = [
+    'звезда', 'ночь', 'город', 'дорога', 'тайна', 'море', 'война', 'любовь', 'зима', 'лето',
+    'последний', 'красный', 'тихий', 'далекий', 'темный', 'дом', 'сердце', 'время', 'река', 'небо',
+    'matrix', 'shadow', 'empire', 'legend', 'storm', 'dream', 'echo', 'ghost', 'signal', 'harbor',
+]
+FIRST_NAMES = ['Анна', 'Иван', 'Мария', 'Петр', 'Ольга', 'Сергей', 'Елена', 'Дмитрий', 'Нина', 'Алексей']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков']
+
+
+def _person_name(rng, index):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {index}'
+
+
+def _sample_count(rng, mean, maximum):
+    # Экспоненциальное распределение: много маленьких значений и длинный хвост
+    if mean <= 0:
+        return 0
+    return min(maximum, int(rng.expovariate(1 / mean)))
+
+
+def generate_catalog(movies=1000, actors=3000, directors=None, cast_mean=8, reviews_mean=5,
+                     top=5, seed=42, batch_size=2000):
+    """
+    Создает синтетический каталог через bulk_create и перестраивает агрегаты и индексы.
+    Топ заполняется через toplist.add() (лимит TOP_LIMIT), версии кэша каталога
+    поднимаются после загрузки: страницы, собранные до нее, не переживут генерацию.
+    """
+    rng = random.Random(seed)
+    directors = directors or max(1, movies // 5)
+
+    director_objs = Director.objects.bulk_create(
+        [Director(name=_person_name(rng, i)) for i in range(directors)], batch_size=batch_size,
+    )
+    actor_objs = Actor.objects.bulk_create(
+        [Actor(name=_person_name(rng, i)) for i in range(actors)], batch_size=batch_size,
+    )
+    # Популярность актеров по закону Ципфа: немногие снимаются очень часто
+    actor_weights = [1 / (rank + 1) for rank in range(len(actor_objs))]
+
+    Through = Movie.actors.through
+    top_ids = []
+    for start in range(0, movies, batch_size):
+        count = min(batch_size, movies - start)
+        movie_objs = Movie.objects.bulk_create([
+            Movie(
+                title=' '.join(rng.sample(WORDS, rng.randint(1, 3))).capitalize() + f' {start + i}',
+                description=' '.join(rng.choices(WORDS, k=30)),
+                year=rng.randint(1950, 2025),
+                director=rng.choice(director_objs),
+            )
+            for i in range(count)
+        ])
+        top_ids.extend(movie.pk for movie in movie_objs[:max(0, top - len(top_ids))])
+        through = []
+        reviews = []
+        for movie in movie_objs:
+            cast_size = max(1, _sample_count(rng, cast_mean, len(actor_objs)))
+            cast = {actor.pk for actor in rng.choices(actor_objs, weights=actor_weights, k=cast_size)}
+            through.extend(Through(movie_id=movie.pk, actor_id=actor_id) for actor_id in cast)
+            for j in range(_sample_count(rng, reviews_mean, 10000)):
+                reviews.append(Review(
+                    movie_id=movie.pk, author_name=f'user{rng.randint(1, 5000)}',
+                    rating=rng.randint(1, 10), text=' '.join(rng.choices(WORDS, k=20)),
+                ))
+        Through.objects.bulk_create(through, batch_size=batch_size, ignore_conflicts=True)
+        Review.objects.bulk_create(reviews, batch_size=batch_size)
+
+    # bulk_create обходит сигналы
+    Movie.rebuild_ratings()
+    search.rebuild_index()
+    facets.rebuild()
+    typeahead.reset()
+    for model in ('movie', 'actor', 'director', 'review'):
+        caching.bump_version(model)
+    for movie_id in top_ids:
+        toplist.add(movie_id)
+    transaction.on_commit(toplist.refresh)
+
+
+SCENARIOS = (
+    'index', 'index_search', 'movie_detail', 'actor_detail', 'director_detail',
+    'top_five', 'actors_list', 'directors_list',
+)
+
+
+def scenarios(seed=42):
+    """Имя сценария -> функция, возвращающая следующий URL."""
+    rng = random.Random(seed)
+    movie_ids = list(Movie.objects.values_list('pk', flat=True))
+    actor_ids = list(Actor.objects.values_list('pk', flat=True))
+    director_ids = list(Director.objects.values_list('pk', flat=True))
+    return {
+        'index': lambda: reverse('index'),
+        'index_search': lambda: reverse('index') + '?' + urlencode({'q': rng.choice(WORDS)}),
+        'movie_detail': lambda: reverse('movie_detail', args=[rng.choice(movie_ids)]),
+        'actor_detail': lambda: reverse('actor_detail', args=[rng.choice(actor_ids)]),
+        'director_detail': lambda: reverse('director_detail', args=[rng.choice(director_ids)]),
+        'top_five': lambda: reverse('top_five'),
+        'actors_list': lambda: reverse('actors_list'),
+        'directors_list': lambda: reverse('directors_list'),
+    }
+
+
+# Страницы команд explain и profile_templates: сценарии замеров и личный кабинет
+PAGE_SCENARIOS = (*SCENARIOS, 'profile')
+
+
+def unknown_scenarios(names, available=SCENARIOS):
+    """Имена из names, которых нет среди available, по алфавиту."""
+    return sorted(set(names or ()) - set(available))
+
+
+def page_clients(names, seed=42):
+    """
+    (имя, клиент, функция следующего URL) для сценариев из PAGE_SCENARIOS.
+    Для profile клиент входит первым пользователем; если пользователей нет, вместо
+    клиента и функции отдается None.
+    """
+    urls = scenarios(seed)
+    for name in names:
+        if name != 'profile':
+            yield name, Client(), urls[name]
+            continue
+        user = get_user_model().objects.order_by('pk').first()
+        if user is None:
+            yield name, None, None
+            continue
+        client = Client()
+        client.force_login(user)
+        yield name, client, lambda: reverse('profile')
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if len(samples) < 2:
+        value = samples[0] if samples else 0
+        return {'p50': value, 'p95': value, 'p99': value}
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98]}
+
+
+def _summary(latencies, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        **{key: round(value * 1000, 3) for key, value in percentiles(latencies).items()},
+        'mean': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0,
+    }
+
+
+def run_client(names=None, requests=200, warmup=10, seed=42):
+    """Прогон сценариев через тестовый клиент в текущем потоке."""
+    results = {}
+    for name, next_url in scenarios(seed).items():
+        if names and name not in names:
+            continue
+        client = Client()
+        for _ in range(warmup):
+            client.get(next_url())
+
+        latencies = []
+        queries = []
+        errors = 0
+        for _ in range(requests):
+            url = next_url()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            errors += response.status_code >= 400
+
+        # Пик выделенной памяти на одном запросе (отдельно, чтобы tracemalloc не искажал задержки)
+        tracemalloc.start()
+        client.get(next_url())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            **_summary(latencies, errors),
+            'queries': {'mean': round(statistics.fmean(queries), 2), 'max': max(queries)},
+            'peak_alloc_kb': round(peak / 1024, 1),
+        }
+    return results
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _load(host, port, names, requests, concurrency, seed):
+    """concurrency потоков-клиентов по HTTP/1.0; задержки и пропускная способность по сценариям."""
+    results = {}
+    for name, next_url in scenarios(seed).items():
+        if names and name not in names:
+            continue
+        urls = [next_url() for _ in range(requests)]
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker(chunk):
+            local = []
+            failed = 0
+            for url in chunk:
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', url, headers={'Host': 'localhost'})
+                    response = conn.getresponse()
+                    response.read()
+                    failed += response.status >= 400
+                except (OSError, http.client.HTTPException):
+                    failed += 1
+                finally:
+                    conn.close()
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+                errors[0] += failed
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(urls[i::concurrency],)) for i in range(concurrency)]
+        for item in workers:
+            item.start()
+        for item in workers:
+            item.join()
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            **_summary(latencies, errors[0]),
+            'concurrency': concurrency,
+            'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        }
+    return results
+
+
+def run_wsgi(application, names=None, requests=500, concurrency=8, seed=42):
+    """Прогон сценариев через WSGI-сервер с concurrency параллельными клиентами."""
+    server = make_server('127.0.0.1', 0, application,
+                         server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    try:
+        return _load(host, port, names, requests, concurrency, seed)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _ASGIServer:
+    """
+    Минимальный HTTP/1.0-сервер для ASGI-приложения (только GET без тела).
+
+    Нужен, чтобы сравнить ASGI и WSGI на одинаковом транспорте без внешних
+    зависимостей; для эксплуатации - uvicorn или daphne (DEPLOYMENT.md).
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.address = None
+        self._server = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.ready.wait()
+        return self.address
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _shutdown(self):
+        self._server.close()
+        await self._server.wait_closed()
+        # Даем обработчикам закрыть соединения, оставшиеся (зависшие) отменяем
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=5)
+            for task in pending:
+                task.cancel()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', 0))
+        self.address = self._server.sockets[0].getsockname()[:2]
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            method, target = request_line[0], request_line[1]
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.0',
+                'method': method, 'scheme': 'http', 'path': unquote(path), 'raw_path': path.encode(),
+                'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+                'client': writer.get_extra_info('peername')[:2], 'server': self.address,
+            }
+
+            body_sent = []
+
+            async def receive():
+                if not body_sent:
+                    body_sent.append(True)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Клиент не отключается: Django сам отменит ожидание после ответа
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    lines = [f'HTTP/1.0 {message["status"]} OK'.encode()]
+                    lines += [name + b': ' + value for name, value in message.get('headers', [])]
+                    writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+                elif message['type'] == 'http.response.body':
+                    writer.write(message.get('body', b''))
+
+            await self.application(scope, receive, send)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def run_asgi(application, names=None, requests=500, concurrency=8, seed=42):
+    """Прогон сценариев через ASGI-приложение на цикле событий с concurrency параллельными клиентами."""
+    server = _ASGIServer(application)
+    host, port = server.start()
+    try:
+        return _load(host, port, names, requests, concurrency, seed)
+    finally:
+        server.stop()
+
+
+# КОНКУРЕНТНЫЙ ДОСТУП К SQLITE
+
+def _sqlite_alias(path, options):
+    alias = f'contention_{threading.get_ident()}_{time.monotonic_ns()}'
+    # configure_settings() дополняет словарь значениями по умолчанию (TIME_ZONE, ATOMIC_REQUESTS, ...)
+    connections.settings[alias] = connections.configure_settings({
+        'default': {},
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path), 'OPTIONS': dict(options)},
+    })[alias]
+    return alias
+
+
+def _prepare_sqlite(alias, rows):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE bench_movie (id INTEGER PRIMARY KEY, title TEXT, rating_sum INTEGER, rating_count INTEGER)'
+        )
+        cursor.execute('CREATE TABLE bench_review (id INTEGER PRIMARY KEY, movie_id INTEGER, rating INTEGER, text TEXT)')
+        cursor.execute('CREATE INDEX bench_review_movie ON bench_review (movie_id)')
+        cursor.executemany(
+            'INSERT INTO bench_movie (id, title, rating_sum, rating_count) VALUES (%s, %s, 0, 0)',
+            [(pk, f'Фильм {pk}') for pk in range(1, rows + 1)],
+        )
+
+
+def run_sqlite_contention(path, options, readers=4, writers=2, seconds=3.0, rows=10000, seed=42):
+    """
+    Читатели (страница фильма: строка и последние отзывы) и писатели (отзыв и сдвиг
+    агрегата в одной транзакции) параллельно работают с новым файлом path.
+    """
+    setup_alias = _sqlite_alias(path, options)
+    _prepare_sqlite(setup_alias, rows)
+    pragmas = {}
+    with connections[setup_alias].cursor() as cursor:
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size'):
+            cursor.execute(f'PRAGMA {name}')
+            pragmas[name] = cursor.fetchone()[0]
+    connections[setup_alias].close()
+
+    deadline = time.monotonic() + seconds
+    stats = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+
+    def read(alias, rng):
+        movie_id = rng.randint(1, rows)
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT title, rating_sum, rating_count FROM bench_movie WHERE id = %s', [movie_id])
+            cursor.fetchone()
+            cursor.execute(
+                'SELECT rating, text FROM bench_review WHERE movie_id = %s ORDER BY id DESC LIMIT 10', [movie_id],
+            )
+            cursor.fetchall()
+
+    def write(alias, rng):
+        movie_id, rating = rng.randint(1, rows), rng.randint(1, 10)
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO bench_review (movie_id, rating, text) VALUES (%s, %s, %s)', [movie_id, rating, 'Отзыв'],
+            )
+            cursor.execute(
+                'UPDATE bench_movie SET rating_sum = rating_sum + %s, rating_count = rating_count + 1 WHERE id = %s',
+                [rating, movie_id],
+            )
+
+    def worker(kind, number):
+        alias = _sqlite_alias(path, options)
+        rng = random.Random(f'{seed}:{kind}:{number}')
+        operation = read if kind == 'read' else write
+        latencies = []
+        failed = 0
+        try:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    operation(alias, rng)
+                except DatabaseError:
+                    # «database is locked» после busy_timeout
+                    failed += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        with lock:
+            stats[kind].extend(latencies)
+            errors[kind] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=('read', i)) for i in range(readers)]
+    threads += [threading.Thread(target=worker, args=('write', i)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    del connections[setup_alias]
+    del connections.settings[setup_alias]
+
+    return {
+        'pragmas': pragmas,
+        'readers': readers,
+        'writers': writers,
+        **{
+            kind: {
+                **_summary(latencies, errors[kind]),
+                'throughput_ops': round(len(latencies) / elapsed, 1) if elapsed else 0,
+            }
+            for kind, latencies in stats.items()
+        },
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'cache_enabled': settings.CATALOG_CACHE_ENABLED,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Список регрессий p95 и числа запросов относительно baseline."""
+    regressions = []
+    for mode in ('client', 'wsgi', 'asgi'):
+        for name, result in current.get(mode, {}).items():
+            previous = baseline.get(mode, {}).get(name)
+            if not previous:
+                continue
+            if previous['p95'] and result['p95'] > previous['p95'] * (1 + threshold):
+                regressions.append(
+                    f'{mode}/{name}: p95 {previous["p95"]:.2f} -> {result["p95"]:.2f} мс'
+                )
+            if 'queries' in result and 'queries' in previous and result['queries']['max'] > previous['queries']['max']:
+                regressions.append(
+                    f'{mode}/{name}: запросов к БД {previous["queries"]["max"]} -> {result["queries"]["max"]}'
+                )
+    return regressions
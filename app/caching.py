@@ -0,0 +1,315 @@
+"""
+Кэш публичных страниц каталога и их фрагментов.
+
+Ключи версионируются по моделям: у Movie, Actor, Director и Review есть счетчик
+версии в кэше, сигналы (app/signals.py) увеличивают его после коммита каждого изменения.
+Ключ фрагмента включает версии моделей, от которых он зависит, поэтому
+после изменения данных старые записи просто перестают читаться и вытесняются по LRU.
+
+Пересчет промаха защищен от «стампеда»: ключ строит только процесс,
+захвативший блокировку через cache.add(), остальные ждут готовое значение.
+
+cache_public_page() подходит и для обычных, и для async view (ASGI).
+
+Версии моделей - общее состояние процессов: кэш CATALOG_CACHE_ALIAS должен быть
+общим (файловый кэш, Redis). В кэше процесса (locmem) изменения из другого воркера
+или из команды manage.py не видны, проверка app.E001 (check --deploy) это ловит.
+"""
+import asyncio
+import hashlib
+import math
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from django.utils.cache import patch_vary_headers
+
+from . import tracing
+
+_MISSING = object()
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def is_shared(alias=None):
+    """Видят ли записи в кэше другие процессы (в кэше locmem - нет)."""
+    return not isinstance(caches[alias or settings.CATALOG_CACHE_ALIAS], LocMemCache)
+
+
+@contextmanager
+def isolated_cache():
+    """Временный файловый кэш вместо CACHES (тесты, бенчмарк): общий кэш сайта не трогается."""
+    with tempfile.TemporaryDirectory(prefix='movie-catalog-cache-') as location:
+        isolated = {
+            alias: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': f'{location}/{alias}'}
+            for alias in settings.CACHES
+        }
+        with override_settings(CACHES=isolated):
+            yield
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    errors = []
+    for setting in ('CATALOG_CACHE_ALIAS', 'RATELIMIT_CACHE_ALIAS'):
+        alias = getattr(settings, setting)
+        if not is_shared(alias):
+            errors.append(checks.Error(
+                f'Кэш {alias!r} ({setting}) хранится в памяти процесса',
+                hint='Версии каталога, индексы и лимиты расходятся между воркерами. '
+                     'Задайте CACHE_BACKEND=file или redis; для единственного процесса '
+                     'добавьте app.E001 в SILENCED_SYSTEM_CHECKS.',
+                id='app.E001',
+            ))
+    return errors
+
+
+def _version_key(model):
+    return f'catalog:version:{model}'
+
+
+def get_versions(models):
+    cache = get_cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Счетчик вытеснен: начинаем с текущего времени, чтобы не совпасть со старыми ключами
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    """Увеличивает версию модели после коммита текущей транзакции (вне транзакции - сразу).
+
+    Если увеличить версию до коммита, параллельный запрос успеет собрать страницу
+    из старых строк и сохранить ее под новым ключом на CATALOG_CACHE_TIMEOUT.
+    """
+    transaction.on_commit(lambda: _bump_version(model))
+
+
+def _bump_version(model):
+    cache = get_cache()
+    try:
+        cache.incr(_version_key(model))
+    except ValueError:
+        cache.add(_version_key(model), time.time_ns(), None)
+    # Целые секунды (точность Last-Modified) и строго больше прежнего значения:
+    # изменение в ту же секунду, что и прошлый ответ, не даст 304 по If-Modified-Since
+    previous = cache.get(_modified_key(model)) or 0
+    cache.set(_modified_key(model), max(math.ceil(time.time()), int(previous) + 1), None)
+
+
+def _modified_key(model):
+    return f'catalog:modified:{model}'
+
+
+def get_last_modified(models):
+    """Время последнего изменения моделей (timestamp) без обращения к БД."""
+    cache = get_cache()
+    keys = [_modified_key(model) for model in models]
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            # Время изменения неизвестно (перезапуск, вытеснение) - считаем, что изменилось сейчас
+            cache.add(key, math.ceil(time.time()), None)
+            stamps[key] = cache.get(key)
+    return max(stamps.values())
+
+
+def make_key(prefix, name, models, vary_on=()):
+    parts = [str(part) for part in (*get_versions(models), *vary_on)]
+    digest = hashlib.md5(':'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'catalog:{prefix}:{name}:{digest}'
+
+
+def _timeout(value, timeout):
+    # None - «значение кэшировать нельзя»: запоминается ненадолго, чтобы не держать решение весь срок
+    if value is None:
+        return settings.CATALOG_CACHE_NONE_TIMEOUT
+    return settings.CATALOG_CACHE_TIMEOUT if timeout is None else timeout
+
+
+def get_or_build(key, builder, timeout=None):
+    """Значение из кэша; при промахе его строит только один процесс."""
+    cache = get_cache()
+
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        tracing.count('cache_hit')
+        return value
+    tracing.count('cache_miss')
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, settings.CATALOG_CACHE_LOCK_TIMEOUT):
+        try:
+            value = builder()
+            cache.set(key, value, _timeout(value, timeout))
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    # Ключ уже строит другой процесс - ждем его результат
+    deadline = time.monotonic() + settings.CATALOG_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            break
+    return builder()
+
+
+async def aget_or_build(key, builder, timeout=None):
+    """get_or_build() для async-кода: builder - корутинная функция, ожидание не блокирует цикл событий."""
+    cache = get_cache()
+
+    value = await cache.aget(key, _MISSING)
+    if value is not _MISSING:
+        tracing.count('cache_hit')
+        return value
+    tracing.count('cache_miss')
+
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, 1, settings.CATALOG_CACHE_LOCK_TIMEOUT):
+        try:
+            value = await builder()
+            await cache.aset(key, value, _timeout(value, timeout))
+        finally:
+            await cache.adelete(lock_key)
+        return value
+
+    deadline = time.monotonic() + settings.CATALOG_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+        value = await cache.aget(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if await cache.aget(lock_key) is None:
+            break
+    return await builder()
+
+
+def get_fragment(name, models, vary_on, builder, timeout=None):
+    return get_or_build(make_key('fragment', name, models, vary_on), builder, timeout)
+
+
+def _has_private_cookies(request):
+    return settings.SESSION_COOKIE_NAME in request.COOKIES or CookieStorage.cookie_name in request.COOKIES
+
+
+def is_cacheable_request(request):
+    """Запрос анонима без сессии и flash-сообщений: страница одинакова для всех."""
+    if request.method not in ('GET', 'HEAD') or _has_private_cookies(request):
+        return False
+    return not request.user.is_authenticated
+
+
+def _load_user(request):
+    # Первое обращение к атрибуту вычисляет ленивый request.user (сессия и запрос к БД)
+    request.user.is_authenticated
+    return request.user
+
+
+async def arequest_user(request):
+    """request.user для async-кода. request.auser() не подходит: у бэкенда Яндекс OAuth нет aget_user()."""
+    return await sync_to_async(_load_user)(request)
+
+
+async def ais_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or _has_private_cookies(request):
+        return False
+    user = await arequest_user(request)
+    return not user.is_authenticated
+
+
+def _cacheable_content(request, response):
+    """Содержимое ответа для кэша или None, если ответ кэшировать нельзя."""
+    if (response.status_code != 200 or response.cookies or getattr(response, 'streaming', False)
+            or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')):
+        return None
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+    }
+
+
+def _cached_response(cached):
+    response = HttpResponse(cached['content'], content_type=cached['content_type'])
+    response['X-Cache'] = 'HIT'
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def cache_public_page(*models, timeout=None):
+    """
+    Кэширует страницу целиком для анонимных посетителей.
+
+    models - модели, при изменении которых страница устаревает.
+    Ответы с cookie, с CSRF-токеном и с кодом, отличным от 200, не кэшируются.
+    """
+    def decorator(view_func):
+        def page_key(request):
+            return make_key('page', view_func.__name__, models, [request.get_full_path()])
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if not settings.CATALOG_CACHE_ENABLED or not await ais_cacheable_request(request):
+                    return await view_func(request, *args, **kwargs)
+
+                built = []
+
+                async def build():
+                    response = await view_func(request, *args, **kwargs)
+                    built.append(response)
+                    return _cacheable_content(request, response)
+
+                cached = await aget_or_build(page_key(request), build, timeout)
+                if built:
+                    built[0]['X-Cache'] = 'MISS'
+                    return built[0]
+                if cached is None:
+                    return await view_func(request, *args, **kwargs)
+                return _cached_response(cached)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not settings.CATALOG_CACHE_ENABLED or not is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            built = []
+
+            def build():
+                response = view_func(request, *args, **kwargs)
+                built.append(response)
+                return _cacheable_content(request, response)
+
+            cached = get_or_build(page_key(request), build, timeout)
+            if built:
+                response = built[0]
+                response['X-Cache'] = 'MISS'
+                return response
+            if cached is None:
+                # Страница не подлежит кэшированию, этот факт закэширован на CATALOG_CACHE_NONE_TIMEOUT
+                return view_func(request, *args, **kwargs)
+            return _cached_response(cached)
+        return wrapper
+    return decorator
@@ -0,0 +1,235 @@
+"""
+Потоковый импорт и экспорт каталога в CSV и JSON Lines.
+
+Одна запись - один фильм:
+    title, description, year, director, actors, is_top, poster
+
+В CSV актеры перечисляются через «|», в JSON Lines - списком.
+Файл читается построчно, поэтому память не зависит от его размера.
+Флаг is_top ставится через toplist.add(): записи сверх TOP_LIMIT импортируются
+без него и учитываются в CatalogImporter.top_skipped.
+"""
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.db import transaction
+
+from . import caching, facets, search, toplist
+from .models import Actor, Director, Movie
+
+FIELDS = ['title', 'description', 'year', 'director', 'actors', 'is_top', 'poster']
+ACTORS_SEPARATOR = '|'
+
+
+class CatalogFormatError(ValueError):
+    pass
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    suffix = Path(path).suffix.lower()
+    if suffix == '.csv':
+        return 'csv'
+    if suffix in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise CatalogFormatError(f'Не удалось определить формат файла {path}, укажите --format')
+
+
+@contextmanager
+def open_stream(path, mode):
+    if path == '-':
+        yield sys.stdin if 'r' in mode else sys.stdout
+    else:
+        with open(path, mode, encoding='utf-8', newline='') as stream:
+            yield stream
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', '1', 'yes', 't', 'да')
+
+
+def read_records(stream, fmt):
+    """Записи файла как словари с нормализованными полями."""
+    if fmt == 'csv':
+        rows = csv.DictReader(stream)
+    else:
+        rows = (line for line in stream if line.strip())
+
+    for line_number, row in enumerate(rows, start=1):
+        if fmt != 'csv':
+            try:
+                row = json.loads(row)
+            except json.JSONDecodeError as exc:
+                raise CatalogFormatError(f'Запись {line_number}: некорректный JSON ({exc.msg})') from exc
+            if not isinstance(row, dict):
+                raise CatalogFormatError(f'Запись {line_number}: ожидался объект JSON')
+        actors = row.get('actors') or []
+        if isinstance(actors, str):
+            actors = actors.split(ACTORS_SEPARATOR)
+        try:
+            year = int(row['year'])
+        except (KeyError, TypeError, ValueError):
+            raise CatalogFormatError(f'Запись {line_number}: некорректный год {row.get("year")!r}')
+        title = (row.get('title') or '').strip()
+        if not title:
+            raise CatalogFormatError(f'Запись {line_number}: пустое название')
+        yield {
+            'title': title,
+            'description': row.get('description') or '',
+            'year': year,
+            'director': (row.get('director') or '').strip(),
+            'actors': [name.strip() for name in actors if name and name.strip()],
+            'is_top': _parse_bool(row.get('is_top') or False),
+            'poster': row.get('poster') or '',
+        }
+
+
+class NameCache:
+    """Кэш «имя -> id» для Director/Actor, недостающие создаются через bulk_create."""
+
+    def __init__(self, model):
+        self.model = model
+        self.ids = {}
+        self.created = 0
+
+    def resolve(self, names):
+        missing = {name for name in names if name and name not in self.ids}
+        if missing:
+            # При дублях имени в БД берется самая ранняя запись
+            for pk, name in self.model.objects.filter(name__in=missing).order_by('-pk').values_list('pk', 'name'):
+                self.ids[name] = pk
+            new = [self.model(name=name) for name in sorted(missing - self.ids.keys())]
+            for obj in self.model.objects.bulk_create(new):
+                self.ids[obj.name] = obj.pk
+            self.created += len(new)
+        return self.ids
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=1000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.directors = NameCache(Director)
+        self.actors = NameCache(Actor)
+        self.imported = 0
+        self.top_skipped = 0
+
+    def run(self, records, skip=0, checkpoint=None):
+        """Импортирует записи пачками; после каждой пачки обновляет checkpoint."""
+        started = time.monotonic()
+        position = 0
+        batch = []
+        for record in records:
+            position += 1
+            if position <= skip:
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch, position, checkpoint, started)
+                batch = []
+        if batch:
+            self._write_batch(batch, position, checkpoint, started)
+        return self.imported
+
+    def _write_batch(self, batch, position, checkpoint, started):
+        Through = Movie.actors.through
+        with transaction.atomic():
+            director_ids = self.directors.resolve(record['director'] for record in batch)
+            actor_ids = self.actors.resolve(name for record in batch for name in record['actors'])
+
+            movies = Movie.objects.bulk_create([
+                Movie(
+                    title=record['title'],
+                    description=record['description'],
+                    year=record['year'],
+                    director_id=director_ids.get(record['director']),
+                    poster=record['poster'],
+                )
+                for record in batch
+            ])
+            Through.objects.bulk_create(
+                [
+                    Through(movie_id=movie.pk, actor_id=actor_ids[name])
+                    for movie, record in zip(movies, batch)
+                    for name in dict.fromkeys(record['actors'])
+                ],
+                ignore_conflicts=True,
+            )
+            # bulk_create не отправляет сигналы - индекс обновляем явно
+            search.index_movies([movie.pk for movie in movies])
+            # Лимит топа проверяет только toplist.add()
+            for movie, record in zip(movies, batch):
+                if record['is_top'] and not toplist.add(movie.pk):
+                    self.top_skipped += 1
+
+        if checkpoint:
+            checkpoint.write(position)
+        self.imported += len(movies)
+        if self.progress:
+            elapsed = time.monotonic() - started
+            self.progress(self.imported, position, self.imported / elapsed if elapsed else 0)
+
+    def finish(self):
+        for model in ('movie', 'actor', 'director'):
+            caching.bump_version(model)
+        # Фильмы и связи с актерами сохранялись через bulk_create, без сигналов
+        facets.rebuild()
+
+
+class Checkpoint:
+    """Номер последней записи, импорт которой закоммичен."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def read(self):
+        try:
+            return int(self.path.read_text().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write(self, position):
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp.write_text(str(position))
+        tmp.replace(self.path)
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+
+def export_records(chunk_size=2000):
+    """Фильмы каталога как записи импорта, без загрузки всей таблицы в память."""
+    movies = Movie.objects.select_related('director').prefetch_related('actors').order_by('pk')
+    for movie in movies.iterator(chunk_size=chunk_size):
+        yield {
+            'title': movie.title,
+            'description': movie.description,
+            'year': movie.year,
+            'director': movie.director.name if movie.director else '',
+            'actors': [actor.name for actor in movie.actors.all()],
+            'is_top': movie.is_top,
+            'poster': movie.poster.name if movie.poster else '',
+        }
+
+
+def write_records(stream, fmt, records):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow({**record, 'actors': ACTORS_SEPARATOR.join(record['actors'])})
+            count += 1
+    else:
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False))
+            stream.write('\n')
+            count += 1
+    return count
@@ -1,10 +1,26 @@
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Значения настроек не меняются во время работы: словарь собирается один раз на процесс
+_site_settings = None
+
 
 def site_settings(request):
-    return {
-        'SITE_NAME': settings.SITE_NAME,
-        'SITE_DOMAIN': settings.SITE_DOMAIN,
-        'DEBUG': settings.DEBUG,
-        'LANGUAGE_CODE': settings.LANGUAGE_CODE,
-        'TIME_ZONE': settings.TIME_ZONE,
-    }
\ No newline at end of file
+    global _site_settings
+    if _site_settings is None:
+        _site_settings = {
+            'SITE_NAME': settings.SITE_NAME,
+            'SITE_DOMAIN': settings.SITE_DOMAIN,
+            'DEBUG': settings.DEBUG,
+            'LANGUAGE_CODE': settings.LANGUAGE_CODE,
+            'TIME_ZONE': settings.TIME_ZONE,
+        }
+    return _site_settings
+
+
+@receiver(setting_changed)
+def _reset_site_settings(**kwargs):
+    # override_settings в тестах
+    global _site_settings
+    _site_settings = None
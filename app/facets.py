@@ -0,0 +1,592 @@
+"""
+Фасетная навигация по каталогу: десятилетие и год, режиссер, актер, топ, диапазон рейтинга.
+
+Счетчики хранятся в двух местах:
+    FacetCount - таблица «фасет, значение -> число фильмов», которую сигналы
+                 обновляют приращениями (F() + delta). Из нее берутся счетчики
+                 без фильтров и список самых частых режиссеров и актеров;
+    BitmapIndex - битовые карты фильмов (int, бит = id фильма) в памяти процесса.
+                 Счетчик при выбранных фильтрах - popcount(фильтр & значение),
+                 без GROUP BY по отфильтрованным фильмам.
+
+Карты десятилетий, лет, топа и рейтинга строятся одним проходом по таблице фильмов,
+карты режиссеров и актеров - по требованию (индексированный запрос) и хранятся
+в LRU из FACET_BITMAP_CACHE_SIZE записей. Как и индекс поиска в памяти, каждый
+процесс обновляет свою копию сигналами после коммита; изменения из других процессов
+он подхватывает перестроением не чаще раза в FACET_INDEX_TTL секунд (метка поколения
+в общем кэше; с кэшем locmem индекс перестраивается раз в FACET_INDEX_TTL всегда).
+Перестроение идет в фоновом потоке, запросы тем временем читают прежний индекс.
+
+Массовые операции в обход сигналов (импорт, генерация каталога, пересчет рейтингов)
+заканчиваются вызовом rebuild().
+"""
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Q
+from django.dispatch import Signal
+
+from . import caching
+from .models import Actor, Director, FacetCount, Movie
+
+logger = logging.getLogger(__name__)
+
+# Порядок групп на странице
+FACETS = ('decade', 'year', 'director', 'actor', 'top', 'rating')
+
+FACET_TITLES = {
+    'decade': 'Десятилетие',
+    'year': 'Год',
+    'director': 'Режиссер',
+    'actor': 'Актер',
+    'top': 'Топ',
+    'rating': 'Рейтинг',
+}
+
+# Ключ, подпись и границы [от, до) диапазонов рейтинга
+RATING_BANDS = (
+    ('8', 'от 8', 8, None),
+    ('6', '6–8', 6, 8),
+    ('4', '4–6', 4, 6),
+    ('0', 'до 4', 0, 4),
+)
+
+TOP_VALUE = 'yes'
+
+# Значения этих фасетов помещаются в памяти целиком
+_DENSE_FACETS = ('decade', 'year', 'top', 'rating')
+# Версии кэша, от которых зависят счетчики
+DEPENDENCIES = ('movie', 'actor', 'director', 'review')
+# Счетчики изменились: deltas={(фасет, значение): приращение} или None после rebuild()
+facet_counts_changed = Signal()
+
+# Метка последнего изменения счетчиков: по ней процессы замечают чужие изменения
+_GENERATION_KEY = 'facets:generation'
+
+
+def decade_of(year):
+    return year // 10 * 10
+
+
+def rating_band(rating_avg, rating_count):
+    if not rating_count:
+        return None
+    for key, _, low, _ in RATING_BANDS:
+        if rating_avg >= low:
+            return key
+    return None
+
+
+def movie_keys(year=None, director_id=None, is_top=None, rating_avg=None, rating_count=None):
+    """Пары (фасет, значение) фильма по тем полям, что переданы (без актеров)."""
+    keys = set()
+    if year is not None:
+        keys.add(('year', str(year)))
+        keys.add(('decade', str(decade_of(year))))
+    if director_id is not None:
+        keys.add(('director', str(director_id)))
+    if is_top:
+        keys.add(('top', TOP_VALUE))
+    band = rating_band(rating_avg, rating_count) if rating_count is not None else None
+    if band is not None:
+        keys.add(('rating', band))
+    return keys
+
+
+def _label(facet, value):
+    if facet == 'decade':
+        return f'{value}-е'
+    if facet == 'top':
+        return 'Только топ'
+    if facet == 'rating':
+        return next(label for key, label, _, _ in RATING_BANDS if key == value)
+    if facet in ('director', 'actor'):
+        model = Director if facet == 'director' else Actor
+        return model.objects.filter(pk=value).values_list('name', flat=True).first() or ''
+    return value
+
+
+# ТАБЛИЦА СЧЕТЧИКОВ
+
+def _apply_counts(deltas):
+    for (facet, value), delta in deltas.items():
+        if not delta:
+            continue
+        updated = FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+        if updated or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(facet=facet, value=value, label=_label(facet, value), count=delta)
+        except IntegrityError:
+            # Строку только что создал параллельный запрос
+            FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+    facet_counts_changed.send(sender=FacetCount, deltas=deltas)
+
+
+def lock_count(facet, value):
+    """
+    Блокирует строку счетчика до конца транзакции (SELECT ... FOR UPDATE) и возвращает
+    число фильмов в ней; отсутствующая строка создается с нулем. Только для СБД
+    с has_select_for_update.
+    """
+    FacetCount.objects.get_or_create(facet=facet, value=value, defaults={'label': _label(facet, value)})
+    locked = FacetCount.objects.select_for_update().filter(facet=facet, value=value)
+    return locked.values_list('count', flat=True).get()
+
+
+def movie_changed(movie_id, removed, added):
+    """Фильм movie_id потерял значения removed и получил added."""
+    removed, added = set(removed) - set(added), set(added) - set(removed)
+    if not removed and not added:
+        return
+    deltas = Counter()
+    for key in removed:
+        deltas[key] -= 1
+    for key in added:
+        deltas[key] += 1
+    _apply_counts(deltas)
+    _after_commit(lambda index: index.update(movie_id, removed, added))
+
+
+def actor_links_changed(pairs, sign):
+    """Связи (movie_id, actor_id) добавлены (sign=1) или удалены (sign=-1)."""
+    pairs = list(pairs)
+    if not pairs:
+        return
+    deltas = Counter()
+    for _, actor_id in pairs:
+        deltas[('actor', str(actor_id))] += sign
+    _apply_counts(deltas)
+
+    def apply(index):
+        for movie_id, actor_id in pairs:
+            key = ('actor', str(actor_id))
+            index.update(movie_id, [key] if sign < 0 else [], [key] if sign > 0 else [])
+    _after_commit(apply)
+
+
+_deleting = threading.local()
+
+
+def begin_delete(movie_id):
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    _deleting.ids.add(movie_id)
+
+
+def end_delete(movie_id):
+    getattr(_deleting, 'ids', set()).discard(movie_id)
+
+
+def rating_changed(movie_id, sum_delta, count_delta, aggregates):
+    """
+    Переносит фильм в другой диапазон рейтинга после Movie.adjust_rating().
+    aggregates - новые (rating_sum, rating_count), которые вернул adjust_rating(): отдельный
+    SELECT не нужен, а счетчики и метка поколения меняются, только если диапазон сменился.
+    """
+    if aggregates is None or movie_id in getattr(_deleting, 'ids', ()):
+        return
+    new_sum, new_count = aggregates
+    old_sum, old_count = new_sum - sum_delta, new_count - count_delta
+    old_band = rating_band(old_sum / old_count if old_count else 0, old_count)
+    new_band = rating_band(new_sum / new_count if new_count else 0, new_count)
+    if old_band != new_band:
+        movie_changed(
+            movie_id,
+            [('rating', old_band)] if old_band else [],
+            [('rating', new_band)] if new_band else [],
+        )
+
+
+def value_deleted(facet, value):
+    FacetCount.objects.filter(facet=facet, value=str(value)).delete()
+    _after_commit(lambda index: index.forget((facet, str(value))))
+
+
+def relabel(facet, value, label):
+    FacetCount.objects.filter(facet=facet, value=str(value)).exclude(label=label).update(label=label)
+
+
+def rebuild():
+    """Полный пересчет таблицы счетчиков (GROUP BY) и сброс индекса процесса."""
+    global _index
+    counts = Counter()
+    for year, total in Movie.objects.order_by().values_list('year').annotate(total=Count('pk')):
+        counts[('year', str(year))] += total
+        counts[('decade', str(decade_of(year)))] += total
+    for director_id, total in (
+        Movie.objects.filter(director__isnull=False).order_by().values_list('director').annotate(total=Count('pk'))
+    ):
+        counts[('director', str(director_id))] = total
+    for actor_id, total in (
+        Movie.actors.through.objects.order_by().values_list('actor').annotate(total=Count('pk'))
+    ):
+        counts[('actor', str(actor_id))] = total
+    counts[('top', TOP_VALUE)] = Movie.objects.filter(is_top=True).count()
+    for key, _, low, high in RATING_BANDS:
+        counts[('rating', key)] = Movie.objects.filter(_band_filter(key)).count()
+
+    names = {
+        'director': dict(Director.objects.values_list('pk', 'name')),
+        'actor': dict(Actor.objects.values_list('pk', 'name')),
+    }
+    rows = []
+    for (facet, value), total in counts.items():
+        if facet in names:
+            label = names[facet].get(int(value), '')
+        else:
+            label = _label(facet, value)
+        rows.append(FacetCount(facet=facet, value=value, label=label, count=total))
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(rows, batch_size=1000)
+    _index = None
+    transaction.on_commit(_changed)
+    facet_counts_changed.send(sender=FacetCount, deltas=None)
+
+
+def _changed():
+    generation = time.time_ns()
+    caching.get_cache().set(_GENERATION_KEY, generation, None)
+    index = _index
+    if index is not None:
+        # Изменение этого процесса индекс применяет сам, перестраивать его не нужно
+        index.generation = generation
+
+
+def _after_commit(apply):
+    """Применяет изменение к индексу процесса и сдвигает метку поколения после коммита.
+
+    Откаченная транзакция не оставляет в картах лишних битов, а другие процессы
+    не перестраивают индекс раньше, чем изменения станут им видны.
+    """
+    def callback():
+        index = _index
+        if index is not None:
+            apply(index)
+        _changed()
+    transaction.on_commit(callback)
+
+
+# БИТОВЫЙ ИНДЕКС
+
+
+def _to_bitmap(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        buffer[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class BitmapIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dense = {}
+        self._lazy = OrderedDict()
+        self.generation = caching.get_cache().get(_GENERATION_KEY)
+        self.built_at = time.monotonic()
+        self._build()
+
+    def _build(self):
+        buffers = {}
+        max_pk = Movie.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        size = max_pk // 8 + 1
+        rows = Movie.objects.order_by().values_list('pk', 'year', 'is_top', 'rating_avg', 'rating_count')
+        for pk, year, is_top, rating_avg, rating_count in rows.iterator(chunk_size=10000):
+            for key in movie_keys(year, None, is_top, rating_avg, rating_count):
+                buffer = buffers.get(key)
+                if buffer is None:
+                    buffer = buffers[key] = bytearray(size)
+                buffer[pk >> 3] |= 1 << (pk & 7)
+        self._dense = {key: int.from_bytes(buffer, 'little') for key, buffer in buffers.items()}
+
+    def bitmap(self, key):
+        return self.bitmaps([key])[key]
+
+    def bitmaps(self, keys):
+        """Карты для набора значений; недостающие карты режиссеров и актеров - по запросу на фасет."""
+        result, missing = {}, {}
+        with self._lock:
+            for key in keys:
+                facet, value = key
+                if facet in _DENSE_FACETS:
+                    result[key] = self._dense.get(key, 0)
+                elif key in self._lazy:
+                    self._lazy.move_to_end(key)
+                    result[key] = self._lazy[key]
+                else:
+                    missing.setdefault(facet, set()).add(value)
+        for facet, values in missing.items():
+            if facet == 'director':
+                rows = Movie.objects.filter(director_id__in=values).values_list('director_id', 'pk')
+            else:
+                rows = Movie.actors.through.objects.filter(actor_id__in=values).values_list('actor_id', 'movie_id')
+            ids = {value: [] for value in values}
+            for value, pk in rows:
+                ids[str(value)].append(pk)
+            for value, movie_ids in ids.items():
+                result[(facet, value)] = _to_bitmap(movie_ids)
+        if missing:
+            with self._lock:
+                for facet, values in missing.items():
+                    for value in values:
+                        self._lazy[(facet, value)] = result[(facet, value)]
+                while len(self._lazy) > settings.FACET_BITMAP_CACHE_SIZE:
+                    self._lazy.popitem(last=False)
+        return result
+
+    def update(self, movie_id, removed, added):
+        bit = 1 << movie_id
+        with self._lock:
+            for key in removed:
+                store = self._dense if key[0] in _DENSE_FACETS else self._lazy
+                if key in store:
+                    store[key] &= ~bit
+            for key in added:
+                if key[0] in _DENSE_FACETS:
+                    self._dense[key] = self._dense.get(key, 0) | bit
+                elif key in self._lazy:
+                    self._lazy[key] |= bit
+
+    def forget(self, key):
+        with self._lock:
+            self._dense.pop(key, None)
+            self._lazy.pop(key, None)
+
+    def is_stale(self, generation):
+        # В кэше процесса (locmem) чужих меток не видно: индекс просто живет не дольше FACET_INDEX_TTL
+        if generation == self.generation and caching.is_shared():
+            return False
+        # Пропавшая метка (кэш очищен) - перестраиваем сразу, иначе не чаще раза в FACET_INDEX_TTL
+        return generation is None or time.monotonic() - self.built_at >= settings.FACET_INDEX_TTL
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuild_thread = None
+
+
+def _rebuild(stale):
+    """Строит новый индекс и подменяет им stale, если индекс процесса за это время не сбросили."""
+    global _index
+    built = BitmapIndex()
+    if caching.get_cache().get(_GENERATION_KEY) != built.generation:
+        # Изменения, закоммиченные во время построения, могли не попасть в карты:
+        # следующий запрос перестроит индекс еще раз
+        built.built_at = float('-inf')
+    with _index_lock:
+        if _index is stale:
+            _index = built
+        return _index
+
+
+def _rebuild_in_thread(stale):
+    try:
+        _rebuild(stale)
+    except Exception:
+        logger.exception('Не удалось перестроить индекс фасетов')
+    finally:
+        connections.close_all()
+
+
+def get_index():
+    """
+    Индекс процесса. Первый строится сразу, устаревший - в фоновом потоке
+    (INDEX_REBUILD_IN_BACKGROUND): пока он строится, запросы читают прежний.
+    """
+    global _index, _rebuild_thread
+    generation = caching.get_cache().get(_GENERATION_KEY)
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = BitmapIndex()
+            return _index
+    if not index.is_stale(generation):
+        return index
+    if not settings.INDEX_REBUILD_IN_BACKGROUND:
+        return _rebuild(index)
+    with _index_lock:
+        if _index is index and (_rebuild_thread is None or not _rebuild_thread.is_alive()):
+            _rebuild_thread = threading.Thread(
+                target=_rebuild_in_thread, args=(index,), name='facets-rebuild', daemon=True,
+            )
+            _rebuild_thread.start()
+    return index
+
+
+# ФИЛЬТРЫ ЗАПРОСА
+
+def _band_filter(key):
+    _, _, low, high = next(band for band in RATING_BANDS if band[0] == key)
+    condition = Q(rating_count__gt=0, rating_avg__gte=low)
+    if high is not None:
+        condition &= Q(rating_avg__lt=high)
+    return condition
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_filters(params):
+    """Выбранные фасеты из GET-параметров: {фасет: значение}, некорректные отбрасываются."""
+    filters = {}
+    for facet in ('decade', 'year', 'director', 'actor'):
+        value = _int(params.get(facet))
+        if value is not None:
+            filters[facet] = str(value)
+    if params.get('top') in ('1', TOP_VALUE):
+        filters['top'] = TOP_VALUE
+    if params.get('rating') in {key for key, _, _, _ in RATING_BANDS}:
+        filters['rating'] = params['rating']
+    return filters
+
+
+def filter_queryset(queryset, filters):
+    lookups = {
+        'decade': lambda value: Q(year__gte=int(value), year__lt=int(value) + 10),
+        'year': lambda value: Q(year=int(value)),
+        'director': lambda value: Q(director_id=int(value)),
+        'actor': lambda value: Q(actors=int(value)),
+        'top': lambda value: Q(is_top=True),
+        'rating': _band_filter,
+    }
+    for facet, value in filters.items():
+        queryset = queryset.filter(lookups[facet](value))
+    return queryset
+
+
+def filter_ids(movie_ids, filters):
+    """Оставляет из ранжированного списка id (поиск) фильмы, прошедшие фильтры, сохраняя порядок."""
+    if not filters:
+        return movie_ids
+    index = get_index()
+    base = None
+    for facet, value in filters.items():
+        bitmap = index.bitmap((facet, value))
+        base = bitmap if base is None else base & bitmap
+    return [pk for pk in movie_ids if base >> pk & 1]
+
+
+# ГРУППЫ ДЛЯ ШАБЛОНА
+
+def _stored_counts(filters):
+    """Значения для показа с общими счетчиками из FacetCount (кэшируется по версиям моделей)."""
+    def build():
+        size = settings.FACET_VALUES_SHOWN
+        rows = list(FacetCount.objects.filter(facet__in=('decade', 'year', 'top', 'rating'), count__gt=0))
+        for facet in ('director', 'actor'):
+            rows.extend(FacetCount.objects.filter(facet=facet, count__gt=0).order_by('-count', 'value')[:size])
+        return {(row.facet, row.value): (row.label, row.count) for row in rows}
+
+    counts = caching.get_or_build(caching.make_key('facets', 'counts', DEPENDENCIES), build)
+    missing = [
+        (facet, value) for facet, value in filters.items()
+        if facet in ('director', 'actor') and (facet, value) not in counts
+    ]
+    if missing:
+        # Выбранный редкий режиссер или актер, не попавший в список частых
+        condition = Q()
+        for facet, value in missing:
+            condition |= Q(facet=facet, value=value)
+        counts = dict(counts)
+        for row in FacetCount.objects.filter(condition):
+            counts[(row.facet, row.value)] = (row.label, row.count)
+    return counts
+
+
+def _visible(facet, value, filters):
+    if facet == 'year':
+        # Годы показываются внутри выбранного десятилетия
+        decade = filters.get('decade')
+        return decade is not None and decade_of(int(value)) == int(decade)
+    return True
+
+
+def _sort_key(facet, value, count):
+    if facet in ('decade', 'year'):
+        return -int(value)
+    if facet == 'rating':
+        return [key for key, _, _, _ in RATING_BANDS].index(value)
+    return -count
+
+
+def _url(params, facet, value):
+    params = params.copy()
+    for name in ('after', 'before'):
+        params.pop(name, None)
+    if value is None:
+        params.pop(facet, None)
+        if facet == 'decade':
+            params.pop('year', None)
+    else:
+        params[facet] = value
+    query = params.urlencode()
+    return f'?{query}' if query else '?'
+
+
+def build_groups(params, filters, search_ids=None):
+    """
+    Группы фасетов со счетчиками.
+
+    Без фильтров и поиска счетчики берутся из FacetCount; иначе для каждого
+    значения это popcount(пересечение остальных фильтров & карта значения).
+    """
+    counts = _stored_counts(filters)
+    index = get_index() if filters or search_ids is not None else None
+    search_bitmap = _to_bitmap(search_ids) if search_ids is not None else None
+
+    bases = {}
+
+    def base_for(facet):
+        # Фильтры остальных фасетов: счетчик показывает, сколько станет фильмов при выборе значения
+        if facet not in bases:
+            base = search_bitmap
+            for other, value in filters.items():
+                if other == facet or (facet == 'decade' and other == 'year'):
+                    continue
+                bitmap = index.bitmap((other, value))
+                base = bitmap if base is None else base & bitmap
+            bases[facet] = base
+        return bases[facet]
+
+    if index is not None:
+        # Все нужные карты одним запросом на фасет
+        index.bitmaps(list(counts) + list(filters.items()))
+
+    groups = []
+    for facet in FACETS:
+        values = []
+        for (key_facet, value), (label, count) in counts.items():
+            if key_facet != facet or not _visible(facet, value, filters):
+                continue
+            if index is not None:
+                base = base_for(facet)
+                if base is not None:
+                    count = (base & index.bitmap((facet, value))).bit_count()
+            selected = filters.get(facet) == value
+            if not count and not selected:
+                continue
+            values.append({
+                'label': label,
+                'count': count,
+                'selected': selected,
+                'url': _url(params, facet, None if selected else value),
+                'sort': _sort_key(facet, value, count),
+            })
+        if values:
+            values.sort(key=lambda item: item['sort'])
+            groups.append({'name': facet, 'title': FACET_TITLES[facet], 'values': values})
+    return groups
@@ -0,0 +1,156 @@
+"""
+Уменьшенные копии постеров и фотографий.
+
+Для каждого загруженного изображения рядом с оригиналом сохраняются версии
+из IMAGE_RENDITIONS в исходном формате и в WebP:
+    posters/matrix.jpg -> posters/matrix.grid.jpg, posters/matrix.grid.webp, ...
+
+Версии строятся вне запроса: после коммита сохранения модели задача уходит
+в пул потоков, а существующие файлы обрабатывает команда generate_renditions
+(пул процессов). Шаблоны получают адреса через {% picture %} (templatetags/renditions.py);
+пока версии нет, показывается оригинал. Когда версии готовы, версия кэша модели-владельца
+увеличивается: закэшированные фрагменты с адресом оригинала перестраиваются.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+# Поля с изображениями: модель -> имя поля
+IMAGE_FIELDS = {
+    'movie': 'poster',
+    'director': 'photo',
+    'actor': 'photo',
+}
+
+FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.webp': 'WEBP',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_name(name, size, webp=False):
+    root, ext = posixpath.splitext(name)
+    ext = ext.lower()
+    if webp:
+        ext = '.webp'
+    elif ext not in FORMATS:
+        ext = '.jpg'
+    return f'{root}.{size}{ext}'
+
+
+def _availability_key(name):
+    digest = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+    return f'images:rendition:{digest}'
+
+
+def is_available(name):
+    """Готовы ли версии изображения (результат проверки кэшируется)."""
+    cache = caches[settings.CATALOG_CACHE_ALIAS]
+    key = _availability_key(name)
+    available = cache.get(key)
+    if available is None:
+        last_size = list(settings.IMAGE_RENDITIONS)[-1]
+        available = default_storage.exists(rendition_name(name, last_size, webp=True))
+        # Отсутствие перепроверяем чаще: версии могут появиться из другого процесса
+        cache.set(key, available, None if available else 60)
+    return available
+
+
+def _mark_available(name):
+    caches[settings.CATALOG_CACHE_ALIAS].set(_availability_key(name), True, None)
+
+
+def _save(image, name, fmt):
+    buffer = io.BytesIO()
+    options = {'quality': settings.IMAGE_RENDITION_QUALITY}
+    if fmt == 'JPEG':
+        options.update(optimize=True, progressive=True)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    elif fmt == 'PNG':
+        options = {'optimize': True}
+    elif fmt == 'WEBP':
+        options['method'] = 4
+    image.save(buffer, fmt, **options)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_renditions(name, force=False, models=()):
+    """Строит все версии изображения; возвращает число созданных файлов.
+
+    models - модели, в чьих закэшированных фрагментах стоит адрес изображения.
+    """
+    if not name:
+        return 0
+    if not force and is_available(name):
+        return 0
+
+    with default_storage.open(name, 'rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+
+    created = 0
+    for size, bounds in settings.IMAGE_RENDITIONS.items():
+        image = original.copy()
+        image.thumbnail(bounds, Image.Resampling.LANCZOS)
+        target = rendition_name(name, size)
+        _save(image, target, FORMATS.get(posixpath.splitext(target)[1], 'JPEG'))
+        _save(image, rendition_name(name, size, webp=True), 'WEBP')
+        created += 2
+
+    _mark_available(name)
+    for model in models:
+        caching.bump_version(model)
+    return created
+
+
+def _generate_in_thread(name, models):
+    try:
+        generate_renditions(name, models=models)
+    except Exception:
+        logger.exception('Не удалось построить версии изображения %s', name)
+
+
+def schedule(name, models=()):
+    """Отправляет построение версий в фоновый пул потоков."""
+    global _executor
+    if not name:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-renditions',
+            )
+    _executor.submit(_generate_in_thread, name, tuple(models))
+
+
+def rendition_urls(fieldfile, size):
+    """(url в исходном формате, url WebP или None) для шаблона."""
+    if not fieldfile:
+        return None, None
+    if size in settings.IMAGE_RENDITIONS and is_available(fieldfile.name):
+        return (
+            default_storage.url(rendition_name(fieldfile.name, size)),
+            default_storage.url(rendition_name(fieldfile.name, size, webp=True)),
+        )
+    return fieldfile.url, None
@@ -0,0 +1,126 @@
+"""
+Прием отзывов с сайта.
+
+Отзыв проходит два этапа:
+    ограничение частоты - не больше REVIEW_RATE_USER_LIMIT отзывов от пользователя
+        и REVIEW_RATE_IP_LIMIT с одного адреса за REVIEW_RATE_WINDOW секунд
+        (скользящее окно, app/ratelimit.py);
+    групповая запись - отзывы, пришедшие одновременно, пишутся одним bulk_create,
+        а агрегаты рейтинга каждого фильма сдвигаются одним UPDATE на пачку.
+
+Групповая запись устроена как group commit в СУБД: пока одна пачка пишется в БД,
+новые отзывы копятся в очереди процесса; первый, кто застал запись законченной,
+забирает всю очередь (не больше REVIEW_BATCH_SIZE) и пишет ее сам, остальные ждут.
+Без нагрузки отзыв пишется сразу, при всплеске размер пачки растет вместе с очередью.
+Ответ уходит только после коммита своей пачки, поэтому автор после редиректа видит
+свой отзыв на странице фильма (read-your-own-writes), а упавший процесс не теряет
+принятые отзывы. Если пачка не записалась, ее отзывы пишутся по одному: ошибку
+получает только отзыв, который ее вызвал.
+
+bulk_create не отправляет post_save: вместо него write_batch() отправляет сигнал
+reviews_created, обработчик в app/signals.py обновляет агрегаты, фасеты, подсказки,
+версию кэша и похожие фильмы так же, как для отдельного отзыва.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+
+from . import ratelimit
+from .models import Review
+
+# Созданы отзывы в обход Review.save(): reviews=[Review, ...]
+reviews_created = Signal()
+
+
+def check_rate_limit(request):
+    """0, если пользователь может оставить отзыв, иначе через сколько секунд."""
+    window = settings.REVIEW_RATE_WINDOW
+    retry_after = ratelimit.hit('review:user', request.user.pk, settings.REVIEW_RATE_USER_LIMIT, window)
+    if retry_after:
+        return retry_after
+    return ratelimit.hit('review:ip', ratelimit.client_ip(request), settings.REVIEW_RATE_IP_LIMIT, window)
+
+
+def write_batch(reviews):
+    """Сохраняет отзывы одним INSERT и обновляет зависящие от них данные."""
+    with transaction.atomic():
+        created = Review.objects.bulk_create(reviews, batch_size=settings.REVIEW_BATCH_SIZE)
+        reviews_created.send(sender=Review, reviews=created)
+    return created
+
+
+class _Ticket:
+    __slots__ = ('review', 'done', 'error')
+
+    def __init__(self, review):
+        self.review = review
+        self.done = False
+        self.error = None
+
+
+class BatchWriter:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue = []
+        self._writing = False
+
+    def submit(self, review):
+        """Ставит отзыв в очередь и возвращается после коммита пачки, в которую он попал."""
+        ticket = _Ticket(review)
+        with self._condition:
+            self._queue.append(ticket)
+            while not ticket.done:
+                if self._writing:
+                    self._condition.wait()
+                    continue
+                self._writing = True
+                batch = self._queue[:settings.REVIEW_BATCH_SIZE]
+                del self._queue[:settings.REVIEW_BATCH_SIZE]
+                self._condition.release()
+                try:
+                    self._write(batch)
+                finally:
+                    self._condition.acquire()
+                    self._writing = False
+                    self._condition.notify_all()
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.review
+
+    def _write(self, batch):
+        try:
+            write_batch([ticket.review for ticket in batch])
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].error = error
+            else:
+                # Пачка откатилась целиком: пишем отзывы по одному, чтобы ошибку
+                # получил только отзыв, который ее вызвал
+                for ticket in batch:
+                    self._write_one(ticket)
+        for ticket in batch:
+            ticket.done = True
+
+    def _write_one(self, ticket):
+        review = ticket.review
+        # bulk_create мог выдать отзыву pk до отката
+        review.pk = None
+        review._state.adding = True
+        try:
+            write_batch([review])
+        except Exception as error:
+            ticket.error = error
+
+
+_writer = BatchWriter()
+
+
+def submit(review):
+    """Сохраняет отзыв с сайта; внутри чужой транзакции - сразу и без очереди."""
+    if transaction.get_connection().in_atomic_block:
+        # Откат внешней транзакции не должен забирать с собой отзывы других запросов
+        write_batch([review])
+        return review
+    return _writer.submit(review)
@@ -0,0 +1,121 @@
+import json
+from pathlib import Path
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from app import benchmark, caching
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержки (p50/p95/p99), число запросов к БД и память страниц каталога. '
+        'По умолчанию работает на временной тестовой БД с синтетическим каталогом'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=1000, help='Фильмов в синтетическом каталоге')
+        parser.add_argument('--actors', type=int, default=3000, help='Актеров в синтетическом каталоге')
+        parser.add_argument('--cast-mean', type=float, default=8, help='Средний размер актерского состава')
+        parser.add_argument('--reviews-mean', type=float, default=5, help='Среднее число отзывов на фильм')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных и URL')
+        parser.add_argument('--use-current-db', action='store_true',
+                            help='Замерять на текущей БД без генерации данных')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Сценарий для замера (можно несколько раз; по умолчанию все)')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10, help='Прогревочных запросов на сценарий')
+        parser.add_argument('--mode', choices=['client', 'wsgi', 'asgi', 'both', 'servers'], default='both',
+                            help='Тестовый клиент, WSGI- или ASGI-сервер; both - клиент и WSGI, '
+                                 'servers - WSGI и ASGI для сравнения')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Параллельных клиентов в режимах wsgi и asgi')
+        parser.add_argument('--no-cache', action='store_true', help='Отключить кэш страниц каталога')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p95 относительно baseline (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['scenarios']:
+            unknown = benchmark.unknown_scenarios(options['scenarios'])
+            if unknown:
+                raise CommandError(f'Неизвестные сценарии: {", ".join(unknown)}')
+
+        setup_test_environment()
+        old_name = None
+        try:
+            # Синтетические страницы не должны попадать в общий кэш сайта
+            with caching.isolated_cache():
+                if not options['use_current_db']:
+                    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                    self.stdout.write(f'Генерация каталога: {options["movies"]} фильмов, {options["actors"]} актеров')
+                    benchmark.generate_catalog(
+                        movies=options['movies'], actors=options['actors'],
+                        cast_mean=options['cast_mean'], reviews_mean=options['reviews_mean'],
+                        seed=options['seed'],
+                    )
+                with override_settings(CATALOG_CACHE_ENABLED=not options['no_cache']):
+                    results = self._run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self._report(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, ensure_ascii=False, indent=2))
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())
+            regressions = benchmark.compare(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError('Регрессия относительно baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно baseline нет'))
+
+    def _run(self, options):
+        results = {}
+        names = options['scenarios']
+        if options['mode'] in ('client', 'both'):
+            results['client'] = benchmark.run_client(
+                names, requests=options['requests'], warmup=options['warmup'], seed=options['seed'],
+            )
+        if options['mode'] in ('wsgi', 'both', 'servers'):
+            results['wsgi'] = benchmark.run_wsgi(
+                WSGIHandler(), names, requests=options['requests'],
+                concurrency=options['concurrency'], seed=options['seed'],
+            )
+        if options['mode'] in ('asgi', 'servers'):
+            results['asgi'] = benchmark.run_asgi(
+                ASGIHandler(), names, requests=options['requests'],
+                concurrency=options['concurrency'], seed=options['seed'],
+            )
+        results['environment'] = benchmark.environment()
+        return results
+
+    def _report(self, results):
+        for mode in ('client', 'wsgi', 'asgi'):
+            if mode not in results:
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{mode}:'))
+            for name, result in results[mode].items():
+                line = (
+                    f'  {name:<16} p50 {result["p50"]:8.2f}  p95 {result["p95"]:8.2f}  '
+                    f'p99 {result["p99"]:8.2f} мс'
+                )
+                if 'queries' in result:
+                    line += f'  запросов {result["queries"]["mean"]:5.1f}  память {result["peak_alloc_kb"]:.0f} КБ'
+                if 'throughput_rps' in result:
+                    line += f'  {result["throughput_rps"]:.0f} запр/с'
+                if result['errors']:
+                    line += f'  ошибок {result["errors"]}'
+                self.stdout.write(line)
+        if 'wsgi' in results and 'asgi' in results:
+            self.stdout.write(self.style.MIGRATE_HEADING('asgi / wsgi, пропускная способность:'))
+            for name, result in results['asgi'].items():
+                wsgi_rps = results['wsgi'][name]['throughput_rps']
+                ratio = result['throughput_rps'] / wsgi_rps if wsgi_rps else 0
+                self.stdout.write(f'  {name:<16} x{ratio:.2f}')
@@ -0,0 +1,54 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app import benchmark
+
+PROFILES = {
+    'default': {},
+    'performance': settings.SQLITE_PERFORMANCE_OPTIONS,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность читателей и писателей SQLite с настройками '
+        'по умолчанию и с профилем performance (WAL, PRAGMA, IMMEDIATE-транзакции)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Потоков-читателей')
+        parser.add_argument('--writers', type=int, default=2, help='Потоков-писателей')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность прогона каждого профиля')
+        parser.add_argument('--rows', type=int, default=10000, help='Фильмов в тестовой таблице')
+        parser.add_argument('--profile', action='append', dest='profiles', choices=list(PROFILES),
+                            help='Профиль для замера (можно несколько раз; по умолчанию оба)')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name in options['profiles'] or list(PROFILES):
+                self.stdout.write(f'Профиль {name}: {options["readers"]} читателей, {options["writers"]} писателей')
+                results[name] = benchmark.run_sqlite_contention(
+                    Path(directory) / f'{name}.sqlite3', PROFILES[name],
+                    readers=options['readers'], writers=options['writers'],
+                    seconds=options['seconds'], rows=options['rows'],
+                )
+
+        for name, result in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name}: {result["pragmas"]}'))
+            for kind, title in (('read', 'чтение'), ('write', 'запись')):
+                line = (
+                    f'  {title:<8} {result[kind]["throughput_ops"]:9.0f} оп/с  p50 {result[kind]["p50"]:7.2f}  '
+                    f'p95 {result[kind]["p95"]:7.2f}  p99 {result[kind]["p99"]:7.2f} мс'
+                )
+                if result[kind]['errors']:
+                    line += f'  ошибок {result[kind]["errors"]}'
+                self.stdout.write(line)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, ensure_ascii=False, indent=2))
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
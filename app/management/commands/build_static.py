@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from app import assets
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает статику в STATIC_ROOT: имена с хэшем и манифест, минифицированные бандлы CSS, '
+        'сжатые копии gzip и brotli'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-clear', action='store_true', help='Не очищать STATIC_ROOT перед сборкой')
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=not options['no_clear'], verbosity=0)
+        if not hasattr(staticfiles_storage, 'compressed'):
+            self.stderr.write('Хранилище статики не app.assets.StaticFilesStorage: бандлы и сжатие пропущены')
+            return
+
+        for bundle, sources in settings.STATIC_BUNDLES.items():
+            hashed = staticfiles_storage.hashed_files[bundle]
+            self.stdout.write(f'{bundle} -> {hashed} ({len(sources)} файлов)')
+
+        totals = {'identity': 0, 'gzip': 0, 'br': 0}
+        for sizes in staticfiles_storage.compressed.values():
+            for encoding in totals:
+                # Файлу без выгодной сжатой копии отдается исходник
+                totals[encoding] += sizes.get(encoding, sizes['identity'])
+        self.stdout.write(
+            f'Сжимаемых файлов: {len(staticfiles_storage.compressed)}, '
+            f'{totals["identity"] // 1024} КБ; gzip {totals["gzip"] // 1024} КБ'
+            + (f', brotli {totals["br"] // 1024} КБ' if assets.brotli is not None else '')
+        )
+        if assets.brotli is None:
+            self.stdout.write(self.style.WARNING('Пакет brotli не установлен: копии .br не созданы'))
+        self.stdout.write(self.style.SUCCESS(f'Статика собрана в {settings.STATIC_ROOT}'))
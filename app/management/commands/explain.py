@@ -0,0 +1,70 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+
+from app.benchmark import PAGE_SCENARIOS, page_clients, unknown_scenarios
+from app.middleware import fingerprint
+
+# Полный просмотр таблицы в плане SQLite: «SCAN app_movie» без «USING ... INDEX»
+_FULL_SCAN = re.compile(r'^SCAN \w+$')
+
+
+class Command(BaseCommand):
+    help = 'Выполняет страницы каталога и печатает план каждого их SELECT-запроса (EXPLAIN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Страница (сценарий benchmark или profile); по умолчанию все')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or PAGE_SCENARIOS
+        unknown = unknown_scenarios(names, PAGE_SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(unknown)}')
+
+        setup_test_environment()
+        try:
+            # Кэш страниц и фрагментов отключен, иначе запросы к БД не выполнятся
+            with override_settings(CATALOG_CACHE_ENABLED=False):
+                for name, client, next_url in page_clients(names):
+                    if client is None:
+                        self.stdout.write(self.style.WARNING(f'{name}: нет пользователей, пропущено'))
+                        continue
+                    self._explain_page(name, client, next_url())
+        finally:
+            teardown_test_environment()
+
+    def _explain_page(self, name, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{name}: GET {url} -> {response.status_code}'))
+
+        seen = set()
+        for query in context.captured_queries:
+            sql = query['sql']
+            key = fingerprint(sql)
+            if not sql.lstrip().upper().startswith('SELECT') or key in seen:
+                continue
+            seen.add(key)
+            self.stdout.write(f'  {sql}')
+            for line in self._plan(sql):
+                style = self.style.WARNING if _FULL_SCAN.match(line.strip()) else str
+                self.stdout.write(style(f'    {line}'))
+
+    def _plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+            rows = cursor.fetchall()
+        if connection.vendor != 'sqlite':
+            return [' '.join(str(column) for column in row) for row in rows]
+        # Строки SQLite: (id, parent, notused, detail) - восстанавливаем вложенность
+        depth = {0: -1}
+        lines = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node_id] + detail)
+        return lines
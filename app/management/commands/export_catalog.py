@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.catalog_io import CatalogFormatError, detect_format, export_records, open_stream, write_records
+
+
+class Command(BaseCommand):
+    help = 'Экспортирует каталог фильмов в CSV или JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для экспорта или «-» для stdout')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Размер пачки при чтении из БД')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-' and not options['format']:
+            options['format'] = 'jsonl'
+        try:
+            fmt = detect_format(path, options['format'])
+        except CatalogFormatError as exc:
+            raise CommandError(exc)
+
+        started = time.monotonic()
+        with open_stream(path, 'w') as stream:
+            count = write_records(stream, fmt, export_records(options['chunk_size']))
+        elapsed = time.monotonic() - started
+
+        if path != '-':
+            rate = count / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(f'Экспортировано фильмов: {count} ({rate:.0f} фильмов/с)'))
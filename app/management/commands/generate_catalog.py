@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from app.benchmark import generate_catalog
+
+
+class Command(BaseCommand):
+    help = 'Заполняет БД синтетическим каталогом заданного размера (для нагрузочных замеров)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=1000, help='Число фильмов')
+        parser.add_argument('--actors', type=int, default=3000, help='Число актеров')
+        parser.add_argument('--directors', type=int, help='Число режиссеров (по умолчанию movies / 5)')
+        parser.add_argument('--cast-mean', type=float, default=8, help='Средний размер актерского состава')
+        parser.add_argument('--reviews-mean', type=float, default=5, help='Среднее число отзывов на фильм')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора')
+
+    def handle(self, *args, **options):
+        generate_catalog(
+            movies=options['movies'],
+            actors=options['actors'],
+            directors=options['directors'],
+            cast_mean=options['cast_mean'],
+            reviews_mean=options['reviews_mean'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано фильмов: {options["movies"]}, актеров: {options["actors"]}'
+        ))
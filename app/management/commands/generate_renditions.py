@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from app import images
+
+
+def _init_worker():
+    django.setup()
+
+
+def _generate(name, force, models):
+    try:
+        return name, images.generate_renditions(name, force=force, models=models), None
+    except Exception as exc:
+        return name, 0, f'{type(exc).__name__}: {exc}'
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии и WebP-версии для уже загруженных изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Число процессов (по умолчанию - число ядер)')
+        parser.add_argument('--force', action='store_true',
+                            help='Перестроить версии, даже если они уже есть')
+
+    def handle(self, *args, **options):
+        names = {}  # изображение -> модели, которые на него ссылаются
+        for model_name, field in images.IMAGE_FIELDS.items():
+            model = apps.get_model('app', model_name)
+            for name in (model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                         .values_list(field, flat=True)):
+                names.setdefault(name, set()).add(model_name)
+
+        started = time.monotonic()
+        created = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = [pool.submit(_generate, name, options['force'], sorted(names[name])) for name in sorted(names)]
+            for future in as_completed(futures):
+                name, count, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                created += count
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Изображений: {len(names)}, создано файлов: {created}, ошибок: {failed} ({elapsed:.1f} с)'
+        ))
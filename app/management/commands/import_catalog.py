@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import toplist
+from app.catalog_io import CatalogFormatError, CatalogImporter, Checkpoint, detect_format, open_stream, read_records
+
+
+class Command(BaseCommand):
+    help = 'Импортирует фильмы из CSV или JSON Lines (режиссеры и актеры ищутся по имени)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для импорта или «-» для stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей в одной транзакции')
+        parser.add_argument('--checkpoint', help='Файл контрольной точки (по умолчанию <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Игнорировать контрольную точку и начать сначала')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = detect_format(path, options['format'])
+        except CatalogFormatError as exc:
+            raise CommandError(exc)
+
+        checkpoint = None
+        skip = 0
+        if path != '-' or options['checkpoint']:
+            checkpoint = Checkpoint(options['checkpoint'] or f'{path}.checkpoint')
+            if options['restart']:
+                checkpoint.clear()
+            skip = checkpoint.read()
+            if skip:
+                self.stdout.write(f'Продолжаем с записи {skip + 1} (контрольная точка {checkpoint.path})')
+
+        def progress(imported, position, rate):
+            self.stdout.write(f'  импортировано {imported} (запись {position}), {rate:.0f} фильмов/с')
+
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=progress)
+        try:
+            with open_stream(path, 'r') as stream:
+                importer.run(read_records(stream, fmt), skip=skip, checkpoint=checkpoint)
+        except CatalogFormatError as exc:
+            raise CommandError(f'{exc}. Закоммиченные пачки сохранены, повторный запуск продолжит импорт')
+        finally:
+            importer.finish()
+
+        if checkpoint:
+            checkpoint.clear()
+        if importer.top_skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Топ заполнен ({toplist.TOP_LIMIT}): {importer.top_skipped} фильмов импортированы без отметки is_top'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано фильмов: {importer.imported}, '
+            f'новых режиссеров: {importer.directors.created}, новых актеров: {importer.actors.created}'
+        ))
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app import startup
+
+
+def _project_module(name):
+    return f'{settings.ROOT_URLCONF.rpartition(".")[0]}.{name}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает холодный старт в отдельном процессе под python -X importtime и печатает '
+        'дерево импортов: время с вложенными импортами и собственное, мс'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=('setup', 'wsgi', 'asgi'), default='wsgi',
+                            help='Что импортировать: только django.setup() или приложение воркера')
+        parser.add_argument('--min-ms', type=float, default=5.0, help='Не показывать модули быстрее')
+        parser.add_argument('--depth', type=int, default=4, help='Глубина дерева')
+        parser.add_argument('--limit', type=int, default=15, help='Модулей в списке по собственному времени')
+        parser.add_argument('--no-warm-up', action='store_true',
+                            help='Отключить прогрев при импорте модуля воркера (иначе его запросы '
+                                 'и разбор шаблонов входят в собственное время модуля)')
+
+    def handle(self, *args, **options):
+        target = options['target']
+        code = 'import django; django.setup()' if target == 'setup' else f'import {_project_module(target)}'
+        env = os.environ.copy()
+        if options['no_warm_up']:
+            env['WARM_UP_ON_START'] = 'False'
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f'Импорт завершился с ошибкой:\n{result.stderr[-2000:]}')
+        roots = startup.parse_importtime(result.stderr)
+        if not roots:
+            raise CommandError('В выводе нет строк import time')
+
+        total = sum(node.total_us for node in roots) / 1000
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{target}: импорт {total:.0f} мс, модулей {self._count(roots)}'))
+        self.stdout.write(f'  {"всего":>8} {"собств.":>8}  модуль')
+        self._tree(roots, 0, options['depth'], options['min_ms'] * 1000)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Больше всего собственного времени'))
+        for node in sorted(self._walk(roots), key=lambda node: node.self_us, reverse=True)[:options['limit']]:
+            self.stdout.write(f'  {node.self_us / 1000:8.1f}  {node.name}')
+
+    def _tree(self, nodes, depth, max_depth, min_us):
+        for node in sorted(nodes, key=lambda node: node.total_us, reverse=True):
+            if node.total_us < min_us:
+                break
+            self.stdout.write(f'  {node.total_us / 1000:8.1f} {node.self_us / 1000:8.1f}  {"  " * depth}{node.name}')
+            if depth + 1 < max_depth:
+                self._tree(node.children, depth + 1, max_depth, min_us)
+
+    def _walk(self, nodes):
+        for node in nodes:
+            yield node
+            yield from self._walk(node.children)
+
+    def _count(self, nodes):
+        return sum(1 for _ in self._walk(nodes))
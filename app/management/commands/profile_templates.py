@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from app import rendering
+from app.benchmark import PAGE_SCENARIOS, page_clients, unknown_scenarios
+
+
+class Command(BaseCommand):
+    help = (
+        'Рендерит страницы каталога и печатает время каждого шаблона и каждого цикла {% for %}: '
+        'полное и собственное (без вложенных шаблонов и циклов)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Страница (сценарий benchmark или profile); по умолчанию все')
+        parser.add_argument('--requests', type=int, default=20, help='Запросов на страницу')
+        parser.add_argument('--limit', type=int, default=15, help='Строк отчета на страницу')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or PAGE_SCENARIOS
+        unknown = unknown_scenarios(names, PAGE_SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(unknown)}')
+
+        rendering.precompile()
+        setup_test_environment()
+        try:
+            # Кэш страниц и фрагментов отключен, иначе циклы не будут рендериться
+            with override_settings(CATALOG_CACHE_ENABLED=False):
+                for name, client, next_url in page_clients(names):
+                    if client is None:
+                        self.stdout.write(self.style.WARNING(f'{name}: нет пользователей, пропущено'))
+                        continue
+                    with rendering.profile() as result:
+                        for _ in range(options['requests']):
+                            client.get(next_url())
+                    self._report(name, result, options['requests'], options['limit'])
+        finally:
+            teardown_test_environment()
+
+    def _report(self, name, result, requests, limit):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{name}: {requests} запросов, мс на запрос'))
+        self.stdout.write(f'  {"собств.":>8} {"полное":>8} {"вызовов":>8}  шаблон / цикл')
+        for kind, label, calls, total, own in result.rows()[:limit]:
+            self.stdout.write(
+                f'  {own / requests:8.2f} {total / requests:8.2f} {calls / requests:8.1f}  '
+                + (label if kind == 'template' else f'  {label}')
+            )
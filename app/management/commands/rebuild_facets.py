@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app import facets
+from app.models import FacetCount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу счетчиков фасетов (год, режиссер, актер, топ, рейтинг)'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Счетчики фасетов пересчитаны ({FacetCount.objects.count()} значений)'))
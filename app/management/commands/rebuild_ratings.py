@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from app import facets
+from app.models import Movie
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает rating_sum/rating_count/rating_avg фильмов по активным отзывам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько фильмов обновлять в одной транзакции')
+        parser.add_argument('--movie', type=int, action='append', dest='movie_ids',
+                            help='Пересчитать только указанные фильмы (можно несколько раз)')
+
+    def handle(self, *args, **options):
+        queryset = Movie.objects.all()
+        if options['movie_ids']:
+            queryset = queryset.filter(pk__in=options['movie_ids'])
+
+        updated = Movie.rebuild_ratings(queryset, batch_size=options['batch_size'])
+        # Диапазоны рейтинга в счетчиках фасетов зависят от пересчитанных агрегатов
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Рейтинг пересчитан для {updated} фильмов'))
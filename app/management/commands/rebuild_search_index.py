@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс фильмов'
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Поисковый индекс перестроен ({type(backend).__name__})'))
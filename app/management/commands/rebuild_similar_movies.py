@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import caching, recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих фильмов (полностью или для указанных фильмов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movie', type=int, action='append', dest='movies',
+                            help='Пересчитать только соседей этого фильма (можно несколько раз)')
+        parser.add_argument('--k', type=int, help='Соседей на фильм (по умолчанию RECOMMENDATIONS_K)')
+        parser.add_argument('--backend', choices=['auto', 'numpy', 'python'], default='auto',
+                            help='auto - NumPy/SciPy, если установлены')
+        parser.add_argument('--block-size', type=int, default=1000, help='Строк матрицы сходства в одном блоке')
+
+    def handle(self, *args, **options):
+        if options['backend'] == 'numpy' and not recommendations.numpy_available():
+            raise CommandError('NumPy и SciPy не установлены: pip install numpy scipy')
+
+        started = time.monotonic()
+        if options['movies']:
+            for movie_id in options['movies']:
+                recommendations.update_movie(movie_id, k=options['k'])
+            count = len(options['movies'])
+        else:
+            count = recommendations.rebuild(
+                k=options['k'], backend=options['backend'], block_size=options['block_size'],
+            )
+        caching.bump_version('movie')
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие фильмы пересчитаны: {count} фильмов за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,130 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('app.queries')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\s*(?:\?|%s),?)+\)', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """Декоратор view: собственный лимит запросов вместо QUERY_BUDGET."""
+    def decorator(view_func):
+        view_func.query_budget = limit
+        return view_func
+    return decorator
+
+
+def fingerprint(sql):
+    """SQL без литералов: одинаковые запросы с разными параметрами совпадают."""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """execute_wrapper, который записывает время и текст каждого запроса."""
+
+    def __init__(self, budget=None, raise_on_budget=False):
+        self.queries = []
+        self.budget = budget
+        self.raise_on_budget = raise_on_budget
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.raise_on_budget and self.budget is not None and len(self.queries) >= self.budget:
+            raise QueryBudgetExceeded(
+                f'Превышен лимит запросов к БД ({self.budget}), следующий запрос: {sql}'
+            )
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for sql, duration in self.queries)
+
+    def slowest(self, limit):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:limit]
+
+    def duplicates(self, threshold):
+        """Повторяющиеся отпечатки запросов - признак N+1."""
+        counts = Counter(fingerprint(sql) for sql, duration in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+
+class QueryProfilerMiddleware:
+    """
+    Профилирование запросов к БД на каждый HTTP-запрос.
+
+    Включается настройкой QUERY_PROFILER_ENABLED. Добавляет заголовок Server-Timing
+    и пишет строку в логгер app.queries; при QUERY_BUDGET_RAISE выбрасывает
+    QueryBudgetExceeded, как только view превышает QUERY_BUDGET (или свой @query_budget).
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(settings.QUERY_BUDGET, settings.QUERY_BUDGET_RAISE)
+        request.query_recorder = recorder
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        db_ms = recorder.total_time * 1000
+        response['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{recorder.count} queries", total;dur={elapsed * 1000:.1f}'
+        )
+        self.log(request, response, recorder, elapsed)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_name = getattr(request.resolver_match, 'view_name', None) or view_func.__name__
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is not None:
+            request.query_recorder.budget = budget
+
+    def log(self, request, response, recorder, elapsed):
+        duplicates = recorder.duplicates(settings.QUERY_PROFILER_DUPLICATE_THRESHOLD)
+        slowest = recorder.slowest(settings.QUERY_PROFILER_SLOWEST)
+        over_budget = recorder.budget is not None and recorder.count > recorder.budget
+        profile = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request, 'view_name', None),
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.total_time * 1000, 2),
+            'total_ms': round(elapsed * 1000, 2),
+            'budget': recorder.budget,
+            'slowest': [{'sql': sql, 'ms': round(duration * 1000, 2)} for sql, duration in slowest],
+            'duplicates': [{'sql': sql, 'count': count} for sql, count in duplicates],
+        }
+        level = logging.WARNING if duplicates or over_budget else logging.INFO
+        logger.log(
+            level,
+            'view=%s path=%s status=%s queries=%s db_ms=%.2f total_ms=%.2f duplicates=%s',
+            profile['view'], profile['path'], profile['status'], profile['queries'],
+            profile['db_ms'], profile['total_ms'], len(duplicates),
+            extra={'query_profile': profile},
+        )
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:48
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('app', 'Movie')
+    Review = apps.get_model('app', 'Review')
+    active = Review.objects.filter(movie=OuterRef('pk'), is_active=True).order_by().values('movie')
+    Movie.objects.update(
+        rating_sum=Coalesce(Subquery(active.annotate(total=Sum('rating')).values('total')), 0),
+        rating_count=Coalesce(Subquery(active.annotate(total=Count('pk')).values('total')), 0),
+    )
+    Movie.objects.update(
+        rating_avg=Case(
+            When(rating_count=0, then=Value(0.0)),
+            default=Cast(F('rating_sum'), FloatField()) / F('rating_count'),
+            output_field=FloatField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_alter_actor_options_alter_director_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.IntegerField(choices=[(1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5'), (6, '6'), (7, '7'), (8, '8'), (9, '9'), (10, '10')]),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,149 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:20
+
+import re
+
+from django.db import migrations
+
+FTS_TABLE = 'app_movie_search'
+
+
+# Копия стеммера и build_document из app/search.py на момент миграции:
+# миграция не должна зависеть от того, как модуль поиска изменится позже.
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(ся|сь)$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_DERIVATIONAL = re.compile(r'(ост|ость)$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_CYRILLIC = re.compile(r'[а-я]')
+_TOKEN = re.compile(r'\w+')
+
+
+def _region_start(word, start=0):
+    # Начало области после первой пары «гласная + согласная»
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem(word):
+    """Основа русского слова; нерусские слова возвращаются без изменений."""
+    if not _CYRILLIC.search(word):
+        return word
+
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv_start = i + 1
+            break
+    else:
+        return word
+
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    rv, found = _PERFECTIVE_GERUND.subn('', rv)
+    if not found:
+        rv = _REFLEXIVE.sub('', rv)
+        rv, found = _ADJECTIVE.subn('', rv)
+        if found:
+            rv = _PARTICIPLE.sub('', rv)
+        else:
+            rv, found = _VERB.subn('', rv)
+            if not found:
+                rv = _NOUN.sub('', rv)
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс только в области R2
+    match = _DERIVATIONAL.search(rv)
+    if match:
+        r2_start = _region_start(word, _region_start(word))
+        if rv_start + match.start() >= r2_start:
+            rv = rv[:match.start()]
+
+    # Шаг 4
+    rv, found = _SUPERLATIVE.subn('', rv)
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif not found and rv.endswith('ь'):
+        rv = rv[:-1]
+
+    return prefix + rv
+
+
+def tokenize(text):
+    """Список основ слов текста в нижнем регистре."""
+    if not text:
+        return []
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in _TOKEN.findall(text)]
+
+
+def build_document(title, description, director_name, actor_names):
+    """Поля индексируемого документа в виде строк основ через пробел."""
+    return (
+        ' '.join(tokenize(title)),
+        ' '.join(tokenize(description)),
+        ' '.join(tokenize(director_name)),
+        ' '.join(tokenize(' '.join(actor_names))),
+    )
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        # На других СУБД используется индекс в памяти процесса (app/search.py)
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            f"USING fts5(title, description, director, actors, tokenize='unicode61')"
+        )
+
+    Movie = apps.get_model('app', 'Movie')
+    rows = []
+    for movie in Movie.objects.select_related('director').prefetch_related('actors').iterator(chunk_size=500):
+        rows.append((movie.pk, *build_document(
+            movie.title,
+            movie.description,
+            movie.director.name if movie.director else '',
+            [actor.name for actor in movie.actors.all()],
+        )))
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, director, actors) VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
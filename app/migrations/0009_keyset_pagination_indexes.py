@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_movie_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='actor',
+            index=models.Index(fields=['name', 'id'], name='actor_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='director',
+            index=models.Index(fields=['name', 'id'], name='director_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-year', '-id'], name='movie_year_id_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:42
+
+from django.conf import settings
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 2000
+
+
+def backfill_review_user(apps, schema_editor):
+    Review = apps.get_model('app', 'Review')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    user_id = Subquery(User.objects.filter(username=OuterRef('author_name')).values('pk')[:1])
+    last_pk = 0
+    while True:
+        chunk = list(
+            Review.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1]
+        # Каждая пачка в своей транзакции, чтобы не держать блокировку на всю таблицу
+        with transaction.atomic():
+            Review.objects.filter(pk__in=chunk, user__isnull=True).update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('app', '0012_review_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_review_user, migrations.RunPython.noop),
+    ]
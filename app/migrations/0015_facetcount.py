@@ -0,0 +1,94 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:05
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Копия правил app.facets на момент миграции: миграция не должна меняться вместе с модулем
+RATING_BANDS = (
+    ('8', 'от 8', 8, None),
+    ('6', '6–8', 6, 8),
+    ('4', '4–6', 4, 6),
+    ('0', 'до 4', 0, 4),
+)
+TOP_VALUE = 'yes'
+
+
+def decade_of(year):
+    return year // 10 * 10
+
+
+def rating_band(rating_avg, rating_count):
+    if not rating_count:
+        return None
+    for key, _, low, _ in RATING_BANDS:
+        if rating_avg >= low:
+            return key
+    return None
+
+
+def fill_facet_counts(apps, schema_editor):
+    # Те же правила, что в app.facets.rebuild()
+    Movie = apps.get_model('app', 'Movie')
+    FacetCount = apps.get_model('app', 'FacetCount')
+    counts = Counter()
+    labels = {}
+    rows = Movie.objects.values_list('year', 'director_id', 'director__name', 'is_top', 'rating_avg', 'rating_count')
+    for year, director_id, director_name, is_top, rating_avg, rating_count in rows.iterator():
+        counts[('year', str(year))] += 1
+        counts[('decade', str(decade_of(year)))] += 1
+        if director_id is not None:
+            counts[('director', str(director_id))] += 1
+            labels[('director', str(director_id))] = director_name
+        if is_top:
+            counts[('top', TOP_VALUE)] += 1
+        band = rating_band(rating_avg, rating_count)
+        if band is not None:
+            counts[('rating', band)] += 1
+    Through = Movie.actors.through
+    for actor_id, name, total in Through.objects.values_list('actor_id', 'actor__name').annotate(total=Count('pk')):
+        counts[('actor', str(actor_id))] = total
+        labels[('actor', str(actor_id))] = name
+
+    band_labels = {key: label for key, label, _, _ in RATING_BANDS}
+    for (facet, value) in counts:
+        if facet == 'decade':
+            labels[(facet, value)] = f'{value}-е'
+        elif facet == 'year':
+            labels[(facet, value)] = value
+        elif facet == 'top':
+            labels[(facet, value)] = 'Только топ'
+        elif facet == 'rating':
+            labels[(facet, value)] = band_labels[value]
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, label=labels[(facet, value)], count=total)
+         for (facet, value), total in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_similarmovie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=20)),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['facet', '-count'], name='facet_count_idx')],
+                'constraints': [models.UniqueConstraint(fields=('facet', 'value'), name='facet_value_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_facetcount'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='movie',
+            name='movie_top_year_idx',
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='director',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.director'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(('is_top', True)), fields=['-year', '-id'], name='movie_top_year_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.sql import UpdateQuery
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -7,21 +10,129 @@ class Movie(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     year = models.IntegerField()
-    director = models.ForeignKey('Director', on_delete=models.SET_NULL, null=True)
+    # Индекс по director - составной movie_director_year_idx ниже
+    director = models.ForeignKey('Director', on_delete=models.SET_NULL, null=True, db_index=False)
     actors = models.ManyToManyField('Actor')
     poster = models.ImageField(upload_to='posters/', blank=True, null=True)
     is_top = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Денормализованный рейтинг по активным отзывам (обновляется сигналами Review;
+    # после Review.objects.update()/bulk_update() - командой rebuild_ratings)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset-пагинация главной страницы
+            models.Index(fields=['-year', '-id'], name='movie_year_id_idx'),
+            # top_five и счетчик топа: в частичный индекс попадают только is_top=True
+            models.Index(fields=['-year', '-id'], condition=models.Q(is_top=True), name='movie_top_year_idx'),
+            # Фильмография режиссера, отсортированная по году
+            models.Index(fields=['director', '-year'], name='movie_director_year_idx'),
+        ]
+
+    # Меняются только UPDATE из adjust_rating() и rebuild_ratings(), но не save()
+    RATING_FIELDS = ('rating_sum', 'rating_count', 'rating_avg')
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Экземпляр мог быть загружен до новых отзывов: обычное сохранение существующего
+        # фильма не переписывает агрегаты рейтинга его устаревшими значениями
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in self.RATING_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_facet_state()
+        return instance
+
+    def remember_facet_state(self):
+        # Загруженные значения полей фасетов: сигналы по ним находят, какие счетчики сдвинуть
+        self._facet_state = {
+            field: self.__dict__[field]
+            for field in ('year', 'director_id', 'is_top')
+            if field in self.__dict__
+        }
+
     def average_rating(self):
-        reviews = self.reviews.filter(is_active=True)
-        if reviews.exists():
-            total = sum([review.rating for review in reviews])
-            return round(total / reviews.count(), 1)
-        return 0
+        return round(self.rating_avg, 1)
+
+    @classmethod
+    def adjust_rating(cls, movie_id, sum_delta, count_delta):
+        """
+        Атомарно сдвигает агрегаты рейтинга фильма одним UPDATE.
+        Возвращает новые (rating_sum, rating_count) или None, если фильма нет: на SQLite
+        и PostgreSQL их отдает тот же UPDATE ... RETURNING, на остальных СБД - SELECT.
+        """
+        if not movie_id or (not sum_delta and not count_delta):
+            return None
+        new_sum = F('rating_sum') + sum_delta
+        new_count = F('rating_count') + count_delta
+        values = {
+            'rating_sum': new_sum,
+            'rating_count': new_count,
+            # Правая часть UPDATE вычисляется по старым значениям строки
+            'rating_avg': Case(
+                When(rating_count__lte=-count_delta, then=Value(0.0)),
+                default=Cast(new_sum, FloatField()) / new_count,
+                output_field=FloatField(),
+            ),
+        }
+        queryset = cls.objects.filter(pk=movie_id)
+        connection = connections[queryset.db]
+        # UPDATE ... RETURNING: SQLite с 3.35 (тот же признак, что и для INSERT) и PostgreSQL
+        returning = connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert
+        if not returning:
+            queryset.update(**values)
+            return queryset.values_list('rating_sum', 'rating_count').first()
+        query = queryset.query.chain(UpdateQuery)
+        query.add_update_values(values)
+        statement, params = query.get_compiler(queryset.db).as_sql()
+        columns = ', '.join(connection.ops.quote_name(column) for column in ('rating_sum', 'rating_count'))
+        with connection.cursor() as cursor:
+            cursor.execute(f'{statement} RETURNING {columns}', params)
+            return cursor.fetchone()
+
+    @classmethod
+    def rebuild_ratings(cls, queryset=None, batch_size=1000):
+        """Пересчитывает агрегаты рейтинга пачками по диапазонам id."""
+        queryset = queryset if queryset is not None else cls.objects.all()
+        active = Review.objects.filter(movie=OuterRef('pk'), is_active=True).order_by().values('movie')
+        updated = 0
+        last_pk = 0
+        while True:
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1]
+            with transaction.atomic():
+                cls.objects.filter(pk__in=chunk).update(
+                    rating_sum=Coalesce(Subquery(active.annotate(total=Sum('rating')).values('total')), 0),
+                    rating_count=Coalesce(Subquery(active.annotate(total=Count('pk')).values('total')), 0),
+                )
+                cls.objects.filter(pk__in=chunk).update(
+                    rating_avg=Case(
+                        When(rating_count=0, then=Value(0.0)),
+                        default=Cast(F('rating_sum'), FloatField()) / F('rating_count'),
+                        output_field=FloatField(),
+                    ),
+                )
+            updated += len(chunk)
+        return updated
 
 
 class Director(models.Model):
@@ -29,6 +140,11 @@ class Director(models.Model):
     bio = models.TextField(blank=True)
     photo = models.ImageField(upload_to='directors/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='director_name_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -38,17 +154,144 @@ class Actor(models.Model):
     bio = models.TextField(blank=True)
     photo = models.ImageField(upload_to='actors/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='actor_name_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class Review(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='reviews')
+    # Индекс по user - составной review_user_created_idx ниже
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviews', db_index=False,
+    )
+    # Имя автора на момент публикации (для отображения)
     author_name = models.CharField(max_length=100)
     rating = models.IntegerField(choices=[(i, str(i)) for i in range(1, 11)])
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Активные отзывы фильма по дате: условие is_active вынесено в частичный индекс
+            models.Index(
+                fields=['movie', '-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='review_active_movie_idx',
+            ),
+            # Счетчик и список «мои отзывы» в профиле
+            models.Index(fields=['user', '-created_at', '-id'], name='review_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.author_name} - {self.movie.title}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_rating_state()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.remember_rating_state()
+
+    def remember_rating_state(self):
+        # Значения из БД нужны сигналам, чтобы вычислить разницу для агрегатов Movie
+        self._rating_state = (
+            self.__dict__.get('movie_id'),
+            self.__dict__.get('rating'),
+            self.__dict__.get('is_active'),
+        )
+
+    def rating_contribution(self, stored=False):
+        """(movie_id, сумма, количество), которые отзыв вносит в рейтинг фильма."""
+        if stored:
+            movie_id, rating, is_active = getattr(self, '_rating_state', (None, None, None))
+        else:
+            movie_id, rating, is_active = self.movie_id, self.rating, self.is_active
+        if not movie_id or not is_active or rating is None:
+            return movie_id, 0, 0
+        return movie_id, rating, 1
+
+
+class OutgoingEmail(models.Model):
+    """Письмо в очереди на отправку (см. app/outbox.py)."""
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (SENDING, 'Отправляется'),
+        (SENT, 'Отправлено'),
+        (DEAD, 'Не доставлено'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Выборка писем, которые пора отправлять
+            models.Index(fields=['status', 'next_attempt_at'], name='email_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)}"
+
+
+class SimilarMovie(models.Model):
+    """Сосед фильма в предрасчитанной таблице рекомендаций (см. app/recommendations.py)."""
+
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='similar_movies', db_index=False)
+    similar = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # Заодно индекс для выборки соседей фильма по порядку
+            models.UniqueConstraint(fields=['movie', 'rank'], name='similar_movie_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.movie_id} -> {self.similar_id} ({self.score:.3f})"
+
+
+class FacetCount(models.Model):
+    """Число фильмов со значением фасета (см. app/facets.py)."""
+
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=20)
+    label = models.CharField(max_length=100, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='facet_value_uniq'),
+        ]
+        indexes = [
+            # Самые частые значения фасета
+            models.Index(fields=['facet', '-count'], name='facet_count_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.author_name} - {self.movie.title}"
\ No newline at end of file
+        return f"{self.facet}={self.value}: {self.count}"
@@ -0,0 +1,213 @@
+"""
+Очередь исходящих писем.
+
+View только сохраняет письмо в таблицу OutgoingEmail и сразу отвечает пользователю.
+Отправкой занимается process_outbox(): она забирает пачку писем, отправляет их через
+одно SMTP-соединение, неудачные откладывает с экспоненциальной задержкой, а после
+EMAIL_OUTBOX_MAX_ATTEMPTS попыток помечает как недоставленные (dead letter).
+
+process_outbox() вызывается либо фоновым потоком после коммита (EMAIL_OUTBOX_WORKER = 'thread'),
+либо отдельным процессом: python manage.py send_queued_mail --loop
+Фоновый поток, разобрав очередь, заводит таймер на ближайшее отложенное письмо,
+поэтому повтор с задержкой не ждет следующего enqueue(). Срок повтора хранится
+в OutgoingEmail.next_attempt_at, а не в памяти: после перезапуска resume() (ее вызывает
+startup.warm_up_on_start()) отправляет накопившиеся письма и заново заводит таймер по БД.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import tracing
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Таймер повтора отложенных писем и время, на которое он заведен
+_retry_timer = None
+_retry_due = None
+
+
+def enqueue(subject, body, from_email, recipients, html_message=None):
+    """Ставит письмо в очередь; отправка начнется после коммита транзакции."""
+    with tracing.span('email_enqueue'):
+        email = OutgoingEmail.objects.create(
+            subject=subject,
+            body=body,
+            html_body=html_message or '',
+            from_email=from_email,
+            recipients=list(recipients),
+        )
+    if settings.EMAIL_OUTBOX_WORKER == 'thread':
+        transaction.on_commit(_schedule_drain)
+    return email
+
+
+def resume():
+    """Разбирает очередь при старте процесса: письма, оставшиеся с прошлого запуска, не ждут enqueue()."""
+    if settings.EMAIL_OUTBOX_WORKER == 'thread':
+        _schedule_drain()
+
+
+def _reset_after_fork():
+    # Потоки пула и таймер не переживают fork (gunicorn --preload): дочерний процесс заводит свои
+    global _executor, _executor_lock, _retry_timer, _retry_due
+    _executor = _retry_timer = _retry_due = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _schedule_drain():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EMAIL_OUTBOX_THREADS, thread_name_prefix='email-outbox',
+            )
+    _executor.submit(_drain_in_thread)
+
+
+def _drain_in_thread():
+    try:
+        while process_outbox():
+            pass
+        _schedule_retry()
+    except Exception:
+        logger.exception('Ошибка фоновой отправки писем')
+    finally:
+        close_old_connections()
+
+
+def _schedule_retry():
+    """Заводит таймер фоновой отправки на ближайшее отложенное письмо."""
+    global _retry_timer, _retry_due
+    due = (
+        OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING)
+        .order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+    )
+    if due is None:
+        return
+    with _executor_lock:
+        if _retry_timer is not None and _retry_timer.is_alive():
+            if _retry_due <= due:
+                return
+            _retry_timer.cancel()
+        delay = max((due - timezone.now()).total_seconds(), 0)
+        _retry_timer = threading.Timer(delay, _schedule_drain)
+        _retry_timer.daemon = True
+        _retry_due = due
+        _retry_timer.start()
+
+
+def retry_delay(attempts):
+    delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY))
+
+
+def _release_stale_claims(now):
+    # Письма, захваченные упавшим обработчиком, возвращаются в очередь
+    OutgoingEmail.objects.filter(status=OutgoingEmail.SENDING, locked_until__lt=now).update(
+        status=OutgoingEmail.PENDING, claim_token='',
+    )
+
+
+def _claim_batch(batch_size, now):
+    due = list(
+        OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'pk')
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    if not due:
+        return []
+    token = uuid.uuid4().hex
+    # Условие status=PENDING гарантирует, что параллельный обработчик не заберет те же письма
+    OutgoingEmail.objects.filter(pk__in=due, status=OutgoingEmail.PENDING).update(
+        status=OutgoingEmail.SENDING,
+        claim_token=token,
+        locked_until=now + timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT),
+    )
+    return list(OutgoingEmail.objects.filter(claim_token=token).order_by('pk'))
+
+
+def _build_message(email, connection):
+    message = EmailMultiAlternatives(
+        email.subject, email.body, email.from_email, email.recipients, connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def process_outbox(batch_size=None):
+    """Отправляет одну пачку писем; возвращает число обработанных писем."""
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    _release_stale_claims(now)
+    emails = _claim_batch(batch_size, now)
+    if not emails:
+        return 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        # Сервер недоступен: вся пачка уходит на повтор
+        for email in emails:
+            _mark_failed(email, exc)
+        return len(emails)
+
+    try:
+        for email in emails:
+            try:
+                connection.send_messages([_build_message(email, connection)])
+            except Exception as exc:
+                _mark_failed(email, exc)
+            else:
+                _mark_sent(email)
+    finally:
+        connection.close()
+    return len(emails)
+
+
+def _mark_sent(email):
+    email.status = OutgoingEmail.SENT
+    email.attempts += 1
+    email.sent_at = timezone.now()
+    email.claim_token = ''
+    email.locked_until = None
+    email.last_error = ''
+    email.save(update_fields=['status', 'attempts', 'sent_at', 'claim_token', 'locked_until', 'last_error'])
+    logger.info('Письмо #%s отправлено: %s', email.pk, ', '.join(email.recipients))
+
+
+def _mark_failed(email, exc):
+    email.attempts += 1
+    email.last_error = f'{type(exc).__name__}: {exc}'
+    email.claim_token = ''
+    email.locked_until = None
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutgoingEmail.DEAD
+        logger.error('Письмо #%s не доставлено после %s попыток: %s', email.pk, email.attempts, email.last_error)
+    else:
+        email.status = OutgoingEmail.PENDING
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        logger.warning('Письмо #%s: ошибка отправки (попытка %s): %s', email.pk, email.attempts, email.last_error)
+    email.save(update_fields=['status', 'attempts', 'last_error', 'claim_token', 'locked_until', 'next_attempt_at'])
+
+
+def requeue(queryset):
+    """Возвращает недоставленные письма в очередь."""
+    return queryset.filter(status=OutgoingEmail.DEAD).update(
+        status=OutgoingEmail.PENDING, attempts=0, next_attempt_at=timezone.now(), last_error='',
+    )
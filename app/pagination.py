@@ -0,0 +1,206 @@
+"""
+Keyset-пагинация (по курсору) для списков каталога.
+
+Вместо OFFSET страница выбирается условием «после/до последней показанной строки»
+по составному ключу сортировки, например (year, id) или (name, id). Такой запрос
+идет по составному индексу и не замедляется на дальних страницах.
+"""
+import base64
+import json
+from functools import reduce
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class Page:
+    def __init__(self, items, next_cursor=None, prev_cursor=None, query_params=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self._query_params = query_params
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    @property
+    def next_url(self):
+        return self._url('after', self.next_cursor)
+
+    @property
+    def prev_url(self):
+        return self._url('before', self.prev_cursor)
+
+    def _url(self, param, cursor):
+        if cursor is None:
+            return None
+        params = self._query_params.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params[param] = cursor
+        return '?' + params.urlencode()
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Значения ключа из курсора или None, если курсор поврежден."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def get_page_size(request, default=None):
+    default = default or settings.PAGE_SIZE
+    try:
+        size = int(request.GET.get('per_page', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, settings.MAX_PAGE_SIZE))
+
+
+def _field_value(obj, field):
+    value = getattr(obj, field)
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _seek_filter(ordering, values, forward):
+    """Условие «строго после values» для ключа сортировки ordering."""
+    conditions = []
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        equal = {ordering[i].lstrip('-'): values[i] for i in range(position)}
+        conditions.append(Q(**equal, **{f'{name}__{lookup}': values[position]}))
+    return reduce(lambda left, right: left | right, conditions)
+
+
+def _cursor_values(model, ordering, values):
+    """Значения курсора, приведенные к типам полей ordering, или None для чужого курсора."""
+    if not values or len(values) != len(ordering):
+        return None
+    converted = []
+    for field, value in zip(ordering, values):
+        if value is None or isinstance(value, (list, dict)):
+            return None
+        try:
+            converted.append(model._meta.get_field(field.lstrip('-')).to_python(value))
+        except (ValueError, TypeError, ValidationError):
+            return None
+    return converted
+
+
+def _reverse(ordering):
+    return [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+
+
+def _keyset_query(request, queryset, ordering, page_size):
+    """Запрос страницы (page_size + 1 строк) и признак движения назад."""
+    # Поврежденный или подделанный курсор - первая страница, а не ошибка запроса
+    after = _cursor_values(queryset.model, ordering, decode_cursor(request.GET.get('after')))
+    before = _cursor_values(queryset.model, ordering, decode_cursor(request.GET.get('before')))
+    if before:
+        # Идем назад: обратная сортировка, затем разворачиваем результат
+        queryset = queryset.filter(_seek_filter(ordering, before, forward=False)).order_by(*_reverse(ordering))
+        return queryset[:page_size + 1], True, False
+    if after:
+        queryset = queryset.filter(_seek_filter(ordering, after, forward=True))
+    return queryset.order_by(*ordering)[:page_size + 1], False, bool(after)
+
+
+def _keyset_page(request, rows, ordering, page_size, backward, after):
+    fields = [field.lstrip('-') for field in ordering]
+    if backward:
+        has_previous = len(rows) > page_size
+        items = rows[:page_size][::-1]
+        has_next = True
+    else:
+        items = rows[:page_size]
+        has_next = len(rows) > page_size
+        has_previous = after
+
+    next_cursor = prev_cursor = None
+    if items and has_next:
+        next_cursor = encode_cursor([_field_value(items[-1], field) for field in fields])
+    if items and has_previous:
+        prev_cursor = encode_cursor([_field_value(items[0], field) for field in fields])
+    return Page(items, next_cursor, prev_cursor, request.GET)
+
+
+def paginate_keyset(request, queryset, ordering, page_size=None):
+    """
+    Страница queryset, отсортированного по ordering (последнее поле должно быть уникальным).
+
+    Курсоры передаются в GET-параметрах after (следующая страница) и before (предыдущая).
+    """
+    page_size = page_size or get_page_size(request)
+    query, backward, after = _keyset_query(request, queryset, ordering, page_size)
+    return _keyset_page(request, list(query), ordering, page_size, backward, after)
+
+
+async def apaginate_keyset(request, queryset, ordering, page_size=None):
+    """paginate_keyset() для async view: строки читаются через асинхронный ORM."""
+    page_size = page_size or get_page_size(request)
+    query, backward, after = _keyset_query(request, queryset, ordering, page_size)
+    rows = [row async for row in query]
+    return _keyset_page(request, rows, ordering, page_size, backward, after)
+
+
+def _ranked_window(request, ranked_ids, page_size):
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+
+    if before and len(before) == 1 and isinstance(before[0], int):
+        end = max(0, min(before[0], len(ranked_ids)))
+        start = max(0, end - page_size)
+    else:
+        start = after[0] if after and len(after) == 1 and isinstance(after[0], int) else 0
+        start = max(0, min(start, len(ranked_ids)))
+        end = start + page_size
+    return start, end
+
+
+def _ranked_page(request, ranked_ids, objects, start, end):
+    items = [objects[pk] for pk in ranked_ids[start:end] if pk in objects]
+    next_cursor = encode_cursor([end]) if end < len(ranked_ids) else None
+    prev_cursor = encode_cursor([start]) if start > 0 else None
+    return Page(items, next_cursor, prev_cursor, request.GET)
+
+
+def paginate_ranked(request, queryset, ranked_ids, page_size=None):
+    """
+    Страница результатов поиска, упорядоченных по релевантности.
+
+    Ранжированный список id уже ограничен SEARCH_RESULTS_LIMIT, поэтому курсор -
+    позиция в этом списке, а из БД выбираются только строки текущей страницы.
+    """
+    start, end = _ranked_window(request, ranked_ids, page_size or get_page_size(request))
+    objects = queryset.in_bulk(ranked_ids[start:end])
+    return _ranked_page(request, ranked_ids, objects, start, end)
+
+
+async def apaginate_ranked(request, queryset, ranked_ids, page_size=None):
+    start, end = _ranked_window(request, ranked_ids, page_size or get_page_size(request))
+    objects = await queryset.ain_bulk(ranked_ids[start:end])
+    return _ranked_page(request, ranked_ids, objects, start, end)
@@ -0,0 +1,68 @@
+"""
+Ограничение частоты действий пользователя (rate limiting).
+
+Счетчики - скользящее окно, приближенное двумя фиксированными окнами
+(sliding window counter): число действий за последние window секунд оценивается как
+
+    текущее окно + предыдущее окно * доля предыдущего окна, еще попадающая в скользящее.
+
+На ключ хранятся только два целых числа в кэше RATELIMIT_CACHE_ALIAS, счетчик
+увеличивается атомарным cache.incr(). Чтобы лимиты действовали для всех процессов,
+кэш должен быть общим (Redis, Memcached), как и кэш каталога.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_cache():
+    return caches[settings.RATELIMIT_CACHE_ALIAS]
+
+
+def _key(scope, ident, window, number):
+    return f'ratelimit:{scope}:{ident}:{window}:{number}'
+
+
+def hit(scope, ident, limit, window, now=None):
+    """
+    Засчитывает действие; возвращает 0, если оно разрешено, иначе через сколько
+    секунд (целое, не меньше 1) станет можно. Отклоненное действие не засчитывается.
+    """
+    cache = get_cache()
+    now = time.time() if now is None else now
+    number, elapsed = divmod(now, window)
+    current_key = _key(scope, ident, window, int(number))
+    previous_key = _key(scope, ident, window, int(number) - 1)
+
+    # Счетчик живет два окна: в следующем окне он станет предыдущим
+    cache.add(current_key, 0, window * 2)
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # Ключ вытеснен между add() и incr()
+        cache.set(current_key, 1, window * 2)
+        current = 1
+    previous = cache.get(previous_key, 0)
+
+    weight = 1 - elapsed / window
+    if current + previous * weight <= limit:
+        return 0
+
+    cache.decr(current_key)
+    current -= 1
+    if current >= limit:
+        # Лимит выбран одним текущим окном: ждем следующего
+        wait = window - elapsed + window * (1 - (limit - 1) / max(current, 1))
+    else:
+        # Ждем, пока вклад предыдущего окна уменьшится настолько, чтобы поместилось действие
+        wait = window * (1 - (limit - 1 - current) / previous) - elapsed
+    return max(1, math.ceil(wait))
+
+
+def client_ip(request):
+    """Адрес клиента: RATELIMIT_IP_HEADER (за прокси) или REMOTE_ADDR."""
+    value = request.META.get(settings.RATELIMIT_IP_HEADER) or request.META.get('REMOTE_ADDR', '')
+    # X-Forwarded-For: первым идет адрес клиента
+    return value.split(',')[0].strip()
@@ -0,0 +1,349 @@
+"""
+Похожие фильмы.
+
+Сходство двух фильмов - взвешенная сумма (RECOMMENDATION_WEIGHTS) трех косинусных мер:
+    actors   - по общим актерам (бинарная матрица фильм x актер);
+    director - общий режиссер (1 или 0);
+    ratings  - по оценкам одних и тех же зрителей (матрица фильм x зритель, оценка сдвинута
+               к середине шкалы: совпадение вкусов дает плюс, расхождение - минус).
+
+Для каждого фильма RECOMMENDATIONS_K лучших соседей хранятся в таблице SimilarMovie,
+страница фильма читает их одним запросом по индексу (movie, rank).
+
+Полный пересчет - команда rebuild_similar_movies. С NumPy/SciPy матрица сходства
+считается блоками строк через разреженные произведения, без них - по инвертированным
+индексам в чистом Python (результат тот же: баллы округляются до SCORE_DIGITS). После новых отзывов строка фильма
+пересчитывается в фоновом потоке (schedule_update(), отзывы за RECOMMENDATIONS_UPDATE_DELAY секунд
+склеиваются в один пересчет) по ограниченной окрестности фильма, а новый балл переносится
+в списки его соседей; остальные строки уточнит следующий полный пересчет.
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+
+from .models import Movie, Review, SimilarMovie
+
+# NumPy и SciPy импортируются при первом полном пересчете (_load_numpy()), а не при старте
+# процесса: модуль подключают сигналы, импорт занял бы ~0.2 с в каждом воркере
+np = sparse = None
+
+logger = logging.getLogger(__name__)
+
+# Середина шкалы оценок 1..10
+RATING_MIDPOINT = 5.5
+
+# Баллы округляются перед ранжированием, чтобы погрешность суммирования
+# не меняла порядок равных соседей в разных реализациях
+SCORE_DIGITS = 9
+
+_executor = None
+_executor_lock = threading.Lock()
+# movie_id -> time.monotonic(), не раньше которого начнется пересчет
+_pending = {}
+
+
+def _user_key(user_id, author_name):
+    # Отзывы без привязки к пользователю различаем по имени автора
+    return ('user', user_id) if user_id else ('name', author_name)
+
+
+class SimilarityData:
+    """Актеры, режиссеры и оценки фильмов (всех или movie_ids) в виде инвертированных индексов."""
+
+    def __init__(self, movie_ids=None):
+        movies = Movie.objects.order_by('pk')
+        through = Movie.actors.through.objects.all()
+        reviews = Review.objects.filter(is_active=True)
+        if movie_ids is not None:
+            movies = movies.filter(pk__in=movie_ids)
+            through = through.filter(movie_id__in=movie_ids)
+            reviews = reviews.filter(movie_id__in=movie_ids)
+
+        self.directors = dict(movies.values_list('pk', 'director_id'))
+
+        self.actors = defaultdict(set)
+        for movie_id, actor_id in through.values_list('movie_id', 'actor_id').iterator():
+            self.actors[movie_id].add(actor_id)
+
+        self.ratings = defaultdict(lambda: defaultdict(float))
+        rows = reviews.values_list('movie_id', 'user_id', 'author_name', 'rating')
+        for movie_id, user_id, author_name, rating in rows.iterator():
+            self.ratings[movie_id][_user_key(user_id, author_name)] += rating - RATING_MIDPOINT
+
+        self.by_actor = defaultdict(list)
+        for movie_id, actor_ids in self.actors.items():
+            for actor_id in actor_ids:
+                self.by_actor[actor_id].append(movie_id)
+
+        self.by_director = defaultdict(list)
+        for movie_id, director_id in self.directors.items():
+            if director_id is not None:
+                self.by_director[director_id].append(movie_id)
+
+        self.by_user = defaultdict(list)
+        self.rating_norms = {}
+        for movie_id, values in self.ratings.items():
+            self.rating_norms[movie_id] = math.sqrt(sum(value * value for value in values.values()))
+            for user, value in values.items():
+                self.by_user[user].append((movie_id, value))
+
+    @property
+    def movie_ids(self):
+        return sorted(self.directors)
+
+    def row(self, movie_id):
+        """Сходство movie_id со всеми фильмами, у которых есть хоть что-то общее."""
+        weights = settings.RECOMMENDATION_WEIGHTS
+        scores = defaultdict(float)
+
+        actor_ids = self.actors.get(movie_id)
+        if actor_ids:
+            norm = math.sqrt(len(actor_ids))
+            for actor_id in actor_ids:
+                for other in self.by_actor[actor_id]:
+                    scores[other] += weights['actors'] / (norm * math.sqrt(len(self.actors[other])))
+
+        director_id = self.directors.get(movie_id)
+        if director_id is not None:
+            for other in self.by_director[director_id]:
+                scores[other] += weights['director']
+
+        norm = self.rating_norms.get(movie_id)
+        if norm:
+            for user, value in self.ratings[movie_id].items():
+                for other, other_value in self.by_user[user]:
+                    other_norm = self.rating_norms[other]
+                    if other_norm:
+                        scores[other] += weights['ratings'] * value * other_value / (norm * other_norm)
+
+        scores.pop(movie_id, None)
+        return scores
+
+
+def top_k(scores, k):
+    """k лучших (id, балл) с положительным баллом; при равенстве выше меньший id."""
+    positive = (
+        (movie_id, round(score, SCORE_DIGITS)) for movie_id, score in scores.items() if score > 0
+    )
+    return heapq.nsmallest(k, positive, key=lambda item: (-item[1], item[0]))
+
+
+def _python_neighbours(data, k):
+    return {movie_id: top_k(data.row(movie_id), k) for movie_id in data.movie_ids}
+
+
+def _normalized(matrix):
+    """Строки матрицы, деленные на свою L2-норму (нулевые строки остаются нулевыми)."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (sparse.diags(inverse) @ matrix).tocsr()
+
+
+def _incidence(pairs, shape_rows):
+    """Разреженная матрица «фильм x признак» из троек (строка, ключ признака, значение)."""
+    columns = {}
+    rows, cols, values = [], [], []
+    for row, key, value in pairs:
+        rows.append(row)
+        cols.append(columns.setdefault(key, len(columns)))
+        values.append(value)
+    return sparse.csr_matrix((values, (rows, cols)), shape=(shape_rows, max(len(columns), 1)))
+
+
+def _numpy_neighbours(data, k, block_size):
+    _load_numpy()
+    ids = data.movie_ids
+    index = {movie_id: position for position, movie_id in enumerate(ids)}
+    size = len(ids)
+    weights = settings.RECOMMENDATION_WEIGHTS
+
+    actors = _normalized(_incidence(
+        ((index[movie_id], actor_id, 1.0) for movie_id, actor_ids in data.actors.items() for actor_id in actor_ids),
+        size,
+    ))
+    directors = _incidence(
+        ((index[movie_id], director_id, 1.0) for movie_id, director_id in data.directors.items()
+         if director_id is not None),
+        size,
+    )
+    ratings = _normalized(_incidence(
+        ((index[movie_id], user, value) for movie_id, values in data.ratings.items() for user, value in values.items()),
+        size,
+    ))
+
+    neighbours = {}
+    for start in range(0, size, block_size):
+        stop = min(start + block_size, size)
+        block = (
+            weights['actors'] * (actors[start:stop] @ actors.T)
+            + weights['director'] * (directors[start:stop] @ directors.T)
+            + weights['ratings'] * (ratings[start:stop] @ ratings.T)
+        ).tocsr()
+        for offset in range(stop - start):
+            position = start + offset
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            cols, vals = block.indices[lo:hi], np.round(block.data[lo:hi], SCORE_DIGITS)
+            keep = (cols != position) & (vals > 0)
+            cols, vals = cols[keep], vals[keep]
+            # Сначала по убыванию балла, при равенстве - по возрастанию id (как top_k)
+            order = np.lexsort((cols, -vals))[:k]
+            neighbours[ids[position]] = [(ids[col], float(val)) for col, val in zip(cols[order], vals[order])]
+    return neighbours
+
+
+def _load_numpy():
+    global np, sparse
+    if np is None:
+        try:
+            import numpy
+            from scipy import sparse as scipy_sparse
+        except ImportError:
+            return False
+        np, sparse = numpy, scipy_sparse
+    return True
+
+
+def numpy_available():
+    return _load_numpy()
+
+
+def _rows(movie_id, neighbours):
+    return [
+        SimilarMovie(movie_id=movie_id, similar_id=similar_id, score=score, rank=rank)
+        for rank, (similar_id, score) in enumerate(neighbours, start=1)
+    ]
+
+
+def save_neighbours(neighbours, batch_size=1000):
+    """Заменяет списки соседей фильмов из словаря {movie_id: [(id, балл), ...]}."""
+    movie_ids = list(neighbours)
+    for start in range(0, len(movie_ids), batch_size):
+        chunk = movie_ids[start:start + batch_size]
+        with transaction.atomic():
+            SimilarMovie.objects.filter(movie_id__in=chunk).delete()
+            SimilarMovie.objects.bulk_create(
+                [row for movie_id in chunk for row in _rows(movie_id, neighbours[movie_id])],
+                batch_size=batch_size,
+            )
+
+
+def rebuild(k=None, backend='auto', block_size=1000):
+    """Полный пересчет таблицы соседей; возвращает число обработанных фильмов."""
+    k = k or settings.RECOMMENDATIONS_K
+    data = SimilarityData()
+    if backend == 'numpy' or (backend == 'auto' and numpy_available()):
+        neighbours = _numpy_neighbours(data, k, block_size)
+    else:
+        neighbours = _python_neighbours(data, k)
+    with transaction.atomic():
+        # Фильмы, удаленные из выборки, не должны оставлять старые строки
+        SimilarMovie.objects.exclude(movie_id__in=neighbours.keys()).delete()
+    save_neighbours(neighbours)
+    return len(neighbours)
+
+
+# ИНКРЕМЕНТАЛЬНОЕ ОБНОВЛЕНИЕ
+
+def _closest(rows, limit):
+    """movie_id из rows с наибольшим числом строк (общих актеров, зрителей), не больше limit."""
+    ranked = rows.values_list('movie_id').annotate(shared=Count('pk')).order_by('-shared', 'movie_id')
+    return [movie_id for movie_id, _ in ranked[:limit]]
+
+
+def _neighbourhood(movie_id):
+    """
+    Фильм и фильмы, с которыми у него есть общие актеры, режиссер или зрители.
+    Каждая мера дает не больше RECOMMENDATIONS_NEIGHBOURHOOD_LIMIT самых близких кандидатов:
+    у фильма с тысячами зрителей почти весь каталог оказался бы «соседями».
+    """
+    limit = settings.RECOMMENDATIONS_NEIGHBOURHOOD_LIMIT
+    movie_ids = {movie_id}
+
+    actor_ids = Movie.actors.through.objects.filter(movie_id=movie_id).values('actor_id')
+    movie_ids.update(_closest(Movie.actors.through.objects.filter(actor_id__in=actor_ids), limit))
+
+    director_id = Movie.objects.filter(pk=movie_id).values_list('director_id', flat=True).first()
+    if director_id is not None:
+        same_director = Movie.objects.filter(director_id=director_id).order_by('pk')
+        movie_ids.update(same_director.values_list('pk', flat=True)[:limit])
+
+    raters = Review.objects.filter(movie_id=movie_id, is_active=True)
+    user_ids = raters.filter(user__isnull=False).values('user_id')
+    names = raters.filter(user__isnull=True).values('author_name')
+    co_rated = Review.objects.filter(is_active=True).filter(
+        Q(user_id__in=user_ids) | Q(user__isnull=True, author_name__in=names)
+    )
+    movie_ids.update(_closest(co_rated, limit))
+    return movie_ids
+
+
+def update_movie(movie_id, k=None):
+    """Пересчитывает соседей фильма и переносит его новый балл в списки соседей."""
+    k = k or settings.RECOMMENDATIONS_K
+    data = SimilarityData(_neighbourhood(movie_id))
+    if movie_id not in data.directors:
+        return
+    scores = data.row(movie_id)
+
+    with transaction.atomic():
+        listed_in = SimilarMovie.objects.filter(similar_id=movie_id).values_list('movie_id', flat=True)
+        candidates = set(scores) | set(listed_in)
+        current = defaultdict(list)
+        for other, similar_id, score in (
+            SimilarMovie.objects.filter(movie_id__in=candidates).order_by('rank')
+            .values_list('movie_id', 'similar_id', 'score')
+        ):
+            current[other].append((similar_id, score))
+
+        changed = {movie_id: top_k(scores, k)}
+        for other in candidates:
+            if other not in data.directors:
+                # Фильм не попал в ограниченную окрестность: его список уточнит полный пересчет
+                continue
+            entries = {similar_id: score for similar_id, score in current[other]}
+            # Мера симметрична: балл пары уже посчитан в строке movie_id
+            entries[movie_id] = scores.get(other, 0.0)
+            merged = top_k(entries, k)
+            if merged != current[other]:
+                changed[other] = merged
+        save_neighbours(changed)
+
+
+def _update_in_thread(movie_id):
+    # Ждем срока из schedule_update(): отзывы, пришедшие до него, попадут в этот же пересчет
+    with _executor_lock:
+        due = _pending[movie_id]
+    time.sleep(max(0.0, due - time.monotonic()))
+    with _executor_lock:
+        del _pending[movie_id]
+    try:
+        update_movie(movie_id)
+    except Exception:
+        logger.exception('Не удалось обновить похожие фильмы для фильма %s', movie_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_update(movie_id):
+    """
+    Ставит пересчет соседей фильма в фоновый пул. Пересчет начинается через
+    RECOMMENDATIONS_UPDATE_DELAY секунд, повторные запросы до его начала склеиваются.
+    """
+    global _executor
+    if not movie_id or not settings.RECOMMENDATIONS_INCREMENTAL:
+        return
+    with _executor_lock:
+        if movie_id in _pending:
+            return
+        _pending[movie_id] = time.monotonic() + settings.RECOMMENDATIONS_UPDATE_DELAY
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recommendations')
+    _executor.submit(_update_in_thread, movie_id)
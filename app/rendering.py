@@ -0,0 +1,121 @@
+"""
+Загрузка шаблонов и профилирование рендеринга.
+
+Шаблоны читаются через cached.Loader (TEMPLATE_CACHE): каждый файл разбирается один
+раз на процесс. precompile() при старте воркера загружает все шаблоны из каталогов
+DIRS, поэтому первый запрос не тратит время на разбор. Под runserver кэш загрузчика
+сбрасывается автоперезагрузкой при изменении шаблонов.
+
+profile() на время блока засекает рендеринг каждого шаблона и каждого {% for %}.
+Для записи считается полное время и собственное время (без вложенных шаблонов
+и циклов). Профиль рассчитан на последовательный рендеринг, его использует
+команда profile_templates.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.template import Engine, TemplateSyntaxError
+from django.template.base import Template
+from django.template.defaulttags import ForNode
+
+logger = logging.getLogger(__name__)
+
+
+def template_names(engine=None):
+    """Имена всех шаблонов из каталогов DIRS (шаблоны приложений Django сюда не входят)."""
+    engine = engine or Engine.get_default()
+    names = []
+    for directory in engine.dirs:
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.endswith(('.html', '.txt', '.xml')):
+                    names.append(os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def precompile():
+    """Разбирает все шаблоны DIRS в кэш загрузчика; возвращает число загруженных."""
+    engine = Engine.get_default()
+    loaded = 0
+    for name in template_names(engine):
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError:
+            logger.exception('Шаблон %s не разобран', name)
+        else:
+            loaded += 1
+    return loaded
+
+
+def warm_up():
+    """Вызывается при старте воркера (app/startup.py)."""
+    # Без кэширующего загрузчика разобранные шаблоны не сохранятся
+    if settings.TEMPLATE_PRECOMPILE and settings.TEMPLATE_CACHE:
+        logger.debug('Разобрано шаблонов: %s', precompile())
+
+
+class RenderProfile:
+    def __init__(self):
+        # (тип, имя) -> [вызовов, полное время, собственное время]
+        self.stats = {}
+        self._children = []
+
+    @contextmanager
+    def measure(self, key):
+        self._children.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._children.pop()
+            stat = self.stats.setdefault(key, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] += elapsed - children
+            if self._children:
+                self._children[-1] += elapsed
+
+    def rows(self):
+        """[(тип, имя, вызовов, полное мс, собственное мс)] по убыванию собственного времени."""
+        return sorted(
+            ((kind, name, calls, total * 1000, own * 1000) for (kind, name), (calls, total, own) in self.stats.items()),
+            key=lambda row: row[4], reverse=True,
+        )
+
+
+def _loop_name(node):
+    origin = getattr(node, 'origin', None)
+    template_name = getattr(origin, 'template_name', None) or '<string>'
+    token = getattr(node, 'token', None)
+    if token is None:
+        return f'{template_name}: {node!r}'
+    line = token.lineno
+    return f'{template_name}:{line} {{% {token.contents} %}}'
+
+
+@contextmanager
+def profile():
+    """Засекает шаблоны и циклы {% for %}, отрисованные внутри блока."""
+    result = RenderProfile()
+    template_render = Template._render
+    for_render = ForNode.render
+
+    def profiled_template_render(template, context):
+        with result.measure(('template', template.name or '<string>')):
+            return template_render(template, context)
+
+    def profiled_for_render(node, context):
+        with result.measure(('for', _loop_name(node))):
+            return for_render(node, context)
+
+    Template._render = profiled_template_render
+    ForNode.render = profiled_for_render
+    try:
+        yield result
+    finally:
+        Template._render = template_render
+        ForNode.render = for_render
@@ -0,0 +1,323 @@
+"""
+Полнотекстовый поиск по каталогу.
+
+Индексируются название, описание, имя режиссера и имена актеров фильма.
+Текст приводится к основам слов (стеммер Snowball для русского языка), поэтому
+«матрицы» находит «Матрица», а «Киану» находит фильмы с Киану Ривзом.
+
+На SQLite используется виртуальная таблица FTS5 (создается миграцией) с ранжированием
+по bm25, на остальных СУБД - инвертированный индекс в памяти процесса.
+Индекс обновляется сигналами (см. app/signals.py) и командой rebuild_search_index.
+"""
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+FTS_TABLE = 'app_movie_search'
+
+# Веса полей при ранжировании: название, описание, режиссер, актеры
+FIELDS = ('title', 'description', 'director', 'actors')
+FIELD_WEIGHTS = (10.0, 1.0, 4.0, 4.0)
+
+
+# СТЕММЕР (Snowball, русский язык)
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(ся|сь)$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_DERIVATIONAL = re.compile(r'(ост|ость)$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_CYRILLIC = re.compile(r'[а-я]')
+_TOKEN = re.compile(r'\w+')
+
+
+def _region_start(word, start=0):
+    # Начало области после первой пары «гласная + согласная»
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem(word):
+    """Основа русского слова; нерусские слова возвращаются без изменений."""
+    if not _CYRILLIC.search(word):
+        return word
+
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv_start = i + 1
+            break
+    else:
+        return word
+
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    rv, found = _PERFECTIVE_GERUND.subn('', rv)
+    if not found:
+        rv = _REFLEXIVE.sub('', rv)
+        rv, found = _ADJECTIVE.subn('', rv)
+        if found:
+            rv = _PARTICIPLE.sub('', rv)
+        else:
+            rv, found = _VERB.subn('', rv)
+            if not found:
+                rv = _NOUN.sub('', rv)
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс только в области R2
+    match = _DERIVATIONAL.search(rv)
+    if match:
+        r2_start = _region_start(word, _region_start(word))
+        if rv_start + match.start() >= r2_start:
+            rv = rv[:match.start()]
+
+    # Шаг 4
+    rv, found = _SUPERLATIVE.subn('', rv)
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif not found and rv.endswith('ь'):
+        rv = rv[:-1]
+
+    return prefix + rv
+
+
+def tokenize(text):
+    """Список основ слов текста в нижнем регистре."""
+    if not text:
+        return []
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in _TOKEN.findall(text)]
+
+
+def build_document(title, description, director_name, actor_names):
+    """Поля индексируемого документа в виде строк основ через пробел."""
+    return (
+        ' '.join(tokenize(title)),
+        ' '.join(tokenize(description)),
+        ' '.join(tokenize(director_name)),
+        ' '.join(tokenize(' '.join(actor_names))),
+    )
+
+
+def _movie_documents(movie_ids=None, chunk_size=500):
+    """Пары (id фильма, документ) с постоянным числом запросов на пачку."""
+    from .models import Movie
+
+    movies = Movie.objects.select_related('director').prefetch_related('actors').order_by('pk')
+    if movie_ids is not None:
+        movies = movies.filter(pk__in=movie_ids)
+    for movie in movies.iterator(chunk_size=chunk_size):
+        yield movie.pk, build_document(
+            movie.title,
+            movie.description,
+            movie.director.name if movie.director else '',
+            [actor.name for actor in movie.actors.all()],
+        )
+
+
+# БЭКЕНДЫ
+
+class FTS5Backend:
+    """Индекс в виртуальной таблице SQLite FTS5, ранжирование bm25()."""
+
+    def index(self, movie_ids):
+        movie_ids = list(movie_ids)
+        with connection.cursor() as cursor:
+            self._delete(cursor, movie_ids)
+            self._insert(cursor, [(movie_id, *document) for movie_id, document in _movie_documents(movie_ids)])
+
+    def remove(self, movie_ids):
+        with connection.cursor() as cursor:
+            self._delete(cursor, list(movie_ids))
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            batch = []
+            for movie_id, document in _movie_documents():
+                batch.append((movie_id, *document))
+                if len(batch) >= 1000:
+                    self._insert(cursor, batch)
+                    batch = []
+            self._insert(cursor, batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+    def search(self, tokens, limit):
+        # Каждая основа ищется как префикс, все основы обязательны (неявное AND)
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _insert(self, cursor, rows):
+        if rows:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, director, actors) VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def _delete(self, cursor, movie_ids):
+        if movie_ids:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(movie_id,) for movie_id in movie_ids])
+
+
+class MemoryBackend:
+    """
+    Инвертированный индекс в памяти процесса для СУБД без FTS5.
+
+    Строится лениво при первом поиске; каждый процесс держит свою копию
+    и обновляет ее сигналами, пришедшими в этом процессе.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = defaultdict(dict)  # основа -> {id фильма: вес}
+        self._documents = {}                # id фильма -> {основа: вес}
+        self._terms = []                    # отсортированные основы для поиска по префиксу
+        self._terms_dirty = False
+
+    def index(self, movie_ids):
+        with self._lock:
+            if not self._built:
+                return
+            movie_ids = list(movie_ids)
+            self._remove(movie_ids)
+            for movie_id, document in _movie_documents(movie_ids):
+                self._add(movie_id, document)
+
+    def remove(self, movie_ids):
+        with self._lock:
+            if self._built:
+                self._remove(movie_ids)
+
+    def rebuild(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for movie_id, document in _movie_documents():
+                self._add(movie_id, document)
+            self._built = True
+
+    def search(self, tokens, limit):
+        with self._lock:
+            if not self._built:
+                self.rebuild()
+            if self._terms_dirty:
+                self._terms = sorted(self._postings)
+                self._terms_dirty = False
+
+            total = len(self._documents) or 1
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                position = bisect.bisect_left(self._terms, token)
+                while position < len(self._terms) and self._terms[position].startswith(token):
+                    postings = self._postings[self._terms[position]]
+                    idf = math.log(1 + total / len(postings))
+                    for movie_id, weight in postings.items():
+                        token_scores[movie_id] = max(token_scores.get(movie_id, 0), weight * idf)
+                    position += 1
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {movie_id: score + token_scores[movie_id]
+                              for movie_id, score in scores.items() if movie_id in token_scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [movie_id for movie_id, score in ranked[:limit]]
+
+    def _add(self, movie_id, document):
+        weights = defaultdict(float)
+        for field_text, field_weight in zip(document, FIELD_WEIGHTS):
+            for token in field_text.split():
+                weights[token] += field_weight
+        self._documents[movie_id] = weights
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._terms_dirty = True
+            self._postings[token][movie_id] = weight
+
+    def _remove(self, movie_ids):
+        for movie_id in movie_ids:
+            for token in self._documents.pop(movie_id, ()):
+                postings = self._postings[token]
+                postings.pop(movie_id, None)
+                if not postings:
+                    del self._postings[token]
+                    self._terms_dirty = True
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def fts5_table_exists():
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'SEARCH_BACKEND', 'auto')
+                if name == 'fts5' or (name == 'auto' and fts5_table_exists()):
+                    _backend = FTS5Backend()
+                else:
+                    _backend = MemoryBackend()
+    return _backend
+
+
+# ПУБЛИЧНЫЙ ИНТЕРФЕЙС
+
+def search_movie_ids(query, limit=None):
+    """Id фильмов, подходящих под запрос, в порядке убывания релевантности."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    if limit is None:
+        limit = getattr(settings, 'SEARCH_RESULTS_LIMIT', 500)
+    return get_backend().search(tokens, limit)
+
+
+def index_movies(movie_ids):
+    movie_ids = [movie_id for movie_id in movie_ids if movie_id]
+    if movie_ids:
+        get_backend().index(movie_ids)
+
+
+def remove_movies(movie_ids):
+    movie_ids = [movie_id for movie_id in movie_ids if movie_id]
+    if movie_ids:
+        get_backend().remove(movie_ids)
+
+
+def rebuild_index():
+    get_backend().rebuild()
@@ -0,0 +1,307 @@
+from collections import Counter
+
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import auth_backends, caching, facets, images, ingest, recommendations, search, toplist, typeahead
+from .models import Actor, Director, Movie, Review
+
+
+# АГРЕГАТЫ РЕЙТИНГА ФИЛЬМА
+# Срабатывают и для формы на сайте, и для list_editable в ReviewAdmin,
+# так как оба пути сохраняют отзыв через Review.save()/delete().
+# QuerySet.update(), bulk_update() и удаление через raw SQL сигналов не отправляют:
+# после таких изменений отзывов агрегаты нужно пересчитать командой rebuild_ratings.
+
+def _adjust_rating(movie_id, sum_delta, count_delta):
+    aggregates = Movie.adjust_rating(movie_id, sum_delta, count_delta)
+    # Средняя оценка могла перейти в другой диапазон фасета «Рейтинг»
+    facets.rating_changed(movie_id, sum_delta, count_delta, aggregates)
+    # Популярность фильма в подсказках поиска
+    typeahead.rating_changed(movie_id, sum_delta, count_delta)
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    old_movie, old_sum, old_count = (None, 0, 0) if created else instance.rating_contribution(stored=True)
+    new_movie, new_sum, new_count = instance.rating_contribution()
+
+    if old_movie == new_movie:
+        _adjust_rating(new_movie, new_sum - old_sum, new_count - old_count)
+    else:
+        # Отзыв перенесли на другой фильм
+        _adjust_rating(old_movie, -old_sum, -old_count)
+        _adjust_rating(new_movie, new_sum, new_count)
+
+    instance.remember_rating_state()
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    if hasattr(instance, '_rating_state'):
+        movie_id, rating_sum, rating_count = instance.rating_contribution(stored=True)
+    else:
+        movie_id, rating_sum, rating_count = instance.rating_contribution()
+    _adjust_rating(movie_id, -rating_sum, -rating_count)
+
+
+@receiver(ingest.reviews_created)
+def reviews_bulk_created(sender, reviews, **kwargs):
+    # Пачка отзывов с сайта: один UPDATE агрегатов на фильм вместо одного на отзыв
+    sums, counts = Counter(), Counter()
+    for review in reviews:
+        movie_id, rating_sum, rating_count = review.rating_contribution()
+        sums[movie_id] += rating_sum
+        counts[movie_id] += rating_count
+        review.remember_rating_state()
+    for movie_id in counts:
+        _adjust_rating(movie_id, sums[movie_id], counts[movie_id])
+    caching.bump_version('review')
+    for movie_id in {review.movie_id for review in reviews}:
+        transaction.on_commit(lambda movie_id=movie_id: recommendations.schedule_update(movie_id))
+
+
+# ПОИСКОВЫЙ ИНДЕКС
+
+@receiver(post_save, sender=Movie)
+def movie_saved_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_movies([instance.pk])
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted_search(sender, instance, **kwargs):
+    search.remove_movies([instance.pk])
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_actors_changed_search(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        if action != 'pre_clear':
+            search.index_movies([instance.pk])
+    elif action == 'pre_clear':
+        # После очистки связи фильмов актера уже не найти
+        instance._search_movie_ids = list(instance.movie_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        search.index_movies(getattr(instance, '_search_movie_ids', []))
+    else:
+        search.index_movies(pk_set or [])
+
+
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def person_saved_search(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_movies(instance.movie_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Actor)
+@receiver(pre_delete, sender=Director)
+def person_deleting_search(sender, instance, **kwargs):
+    # Связи удаляются без сигналов m2m_changed/post_save, запоминаем фильмы заранее
+    instance._search_movie_ids = list(instance.movie_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def person_deleted_search(sender, instance, **kwargs):
+    search.index_movies(getattr(instance, '_search_movie_ids', []))
+
+
+# ВЕРСИИ КЭША КАТАЛОГА
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+@receiver(post_save, sender=Actor)
+@receiver(post_delete, sender=Actor)
+@receiver(post_save, sender=Director)
+@receiver(post_delete, sender=Director)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def catalog_changed_cache(sender, **kwargs):
+    caching.bump_version(sender._meta.model_name)
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_actors_changed_cache(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # Состав актеров виден и на страницах фильмов, и в счетчиках у актеров
+        caching.bump_version('movie')
+        caching.bump_version('actor')
+
+
+# СПИСОК ТОПА
+# Версия кэша уже увеличена catalog_changed_cache; список перестраиваем сразу,
+# чтобы top_five не ждал промаха. Прочие изменения фильмов его не затрагивают.
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+@receiver(post_save, sender=Director)
+def top_list_changed(sender, instance, raw=False, **kwargs):
+    if raw or (sender is Movie and not instance.is_top):
+        return
+    transaction.on_commit(toplist.refresh)
+
+
+# СЧЕТЧИКИ ФАСЕТОВ
+
+def _movie_facet_keys(movie, fields=None):
+    state = {
+        'year': movie.year,
+        'director_id': movie.director_id,
+        'is_top': movie.is_top,
+    }
+    if fields is not None:
+        state = {field: value for field, value in state.items() if field in fields}
+    return facets.movie_keys(**state)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved_facets(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        facets.movie_changed(instance.pk, [], _movie_facet_keys(instance))
+    else:
+        # Сравниваем только поля, загруженные из БД (у only()/defer() их меньше)
+        old_state = getattr(instance, '_facet_state', {})
+        facets.movie_changed(
+            instance.pk,
+            facets.movie_keys(**old_state),
+            _movie_facet_keys(instance, fields=old_state),
+        )
+    instance.remember_facet_state()
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_deleting_facets(sender, instance, **kwargs):
+    # Значения берем из БД: экземпляр мог устареть (топ и рейтинг меняются через update())
+    stored = Movie.objects.filter(pk=instance.pk).values(
+        'year', 'director_id', 'is_top', 'rating_avg', 'rating_count',
+    ).first()
+    instance._facet_keys = facets.movie_keys(**stored) if stored else set()
+    # Связи с актерами удаляются каскадом без m2m_changed
+    instance._facet_actor_ids = list(instance.actors.values_list('pk', flat=True))
+    # Каскадное удаление отзывов не должно двигать диапазон рейтинга: фильм уйдет из него целиком
+    facets.begin_delete(instance.pk)
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted_facets(sender, instance, **kwargs):
+    facets.end_delete(instance.pk)
+    facets.movie_changed(instance.pk, getattr(instance, '_facet_keys', set()), [])
+    facets.actor_links_changed(
+        [(instance.pk, actor_id) for actor_id in getattr(instance, '_facet_actor_ids', [])], -1,
+    )
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_actors_changed_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.movie_set if reverse else instance.actors
+        instance._facet_cleared_ids = list(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        ids, sign = getattr(instance, '_facet_cleared_ids', []), -1
+    elif action in ('post_add', 'post_remove'):
+        ids, sign = pk_set or [], 1 if action == 'post_add' else -1
+    else:
+        return
+    if reverse:
+        pairs = [(movie_id, instance.pk) for movie_id in ids]
+    else:
+        pairs = [(instance.pk, actor_id) for actor_id in ids]
+    facets.actor_links_changed(pairs, sign)
+
+
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def person_saved_facets(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        facets.relabel(sender._meta.model_name, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def person_deleted_facets(sender, instance, **kwargs):
+    # Связи и director_id фильмов обнуляются без сигналов - удаляем значение целиком
+    facets.value_deleted(sender._meta.model_name, instance.pk)
+
+
+# ПОХОЖИЕ ФИЛЬМЫ
+# Оценки и состав актеров меняют сходство: строку фильма пересчитывает фоновый поток.
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed_recommendations(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda movie_id=instance.movie_id: recommendations.schedule_update(movie_id))
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_actors_changed_recommendations(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        transaction.on_commit(lambda movie_id=instance.pk: recommendations.schedule_update(movie_id))
+
+
+# ВЕРСИИ ИЗОБРАЖЕНИЙ
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def image_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    image = getattr(instance, images.IMAGE_FIELDS[sender._meta.model_name])
+    if image:
+        # Уже готовые версии generate_renditions пропустит
+        transaction.on_commit(lambda name=image.name: images.schedule(name, [sender._meta.model_name]))
+
+
+# ПОДСКАЗКИ ПОИСКА
+
+@receiver(post_save, sender=Movie)
+def movie_saved_typeahead(sender, instance, raw=False, **kwargs):
+    # У загруженного через only()/defer() фильма названия может не быть
+    if not raw and 'title' in instance.__dict__:
+        typeahead.saved('movie', instance.pk, instance.title)
+
+
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def person_saved_typeahead(sender, instance, raw=False, **kwargs):
+    if not raw:
+        typeahead.saved(sender._meta.model_name, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def deleted_typeahead(sender, instance, **kwargs):
+    typeahead.deleted(sender._meta.model_name, instance.pk)
+
+
+@receiver(facets.facet_counts_changed)
+def facet_counts_typeahead(sender, deltas, **kwargs):
+    # Число фильмов актера или режиссера - его популярность в подсказках
+    if deltas is None:
+        typeahead.reset()
+    else:
+        typeahead.movie_counts_changed(deltas)
+
+
+# ВХОД ЧЕРЕЗ ЯНДЕКС
+
+@receiver(user_logged_in)
+def social_login_backend(sender, request, user, **kwargs):
+    # В AUTHENTICATION_BACKENDS стоит ленивая замена бэкенда social_core (app/auth_backends.py)
+    if request is not None and request.session.get(BACKEND_SESSION_KEY) == auth_backends.SOCIAL_BACKEND_PATH:
+        request.session[BACKEND_SESSION_KEY] = auth_backends.BACKEND_PATH
@@ -0,0 +1,152 @@
+"""
+Старт воркера.
+
+warm_up_on_start() вызывается точками входа веб-сервера (movie_project/wsgi.py и asgi.py)
+после загрузки приложений, поэтому команды manage.py, тесты и другие процессы, которые
+не импортируют эти модули, прогрев не запускают. Там же запускается фоновая отправка
+писем, оставшихся в очереди (outbox.resume()). warm_up() делает заранее то, что иначе
+достается первому запросу воркера:
+    db           - открывает соединения с БД (PRAGMA профиля SQLite выполняются сразу);
+    contenttypes - загружает ContentType всех моделей в кэш менеджера;
+    urls         - импортирует URLconf и views, строит разбор маршрутов;
+    templates    - разбирает шаблоны в кэш загрузчика (app/rendering.py);
+    typeahead    - строит индекс подсказок поиска (app/typeahead.py);
+    facets       - строит битовые карты фасетов (app/facets.py).
+До migrate таблиц нет: шаг с ошибкой БД пропускается и выполнится при первом запросе.
+
+С gunicorn --preload приложение импортируется в мастер-процессе до fork: соединения,
+открытые прогревом, закрываются перед каждым fork, воркеры откроют свои. Индексы
+и разобранные шаблоны воркеры получают готовыми вместе с памятью мастера.
+
+parse_importtime() разбирает вывод python -X importtime в дерево модулей,
+его использует команда importtime.
+"""
+import logging
+import os
+import re
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+
+# ПРОГРЕВ
+
+def _open_connections():
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def _load_content_types():
+    from django.contrib.contenttypes.models import ContentType
+
+    ContentType.objects.get_for_models(*apps.get_models())
+
+
+def _load_urls():
+    # Первый reverse() импортирует URLconf со всеми views и разбирает маршруты
+    reverse('index')
+
+
+def _precompile_templates():
+    from . import rendering
+
+    rendering.warm_up()
+
+
+def _build_typeahead():
+    from . import typeahead
+
+    typeahead.get_index()
+
+
+def _build_facets():
+    from . import facets
+
+    facets.get_index()
+
+
+WARM_UP_STEPS = (
+    ('db', _open_connections),
+    ('contenttypes', _load_content_types),
+    ('urls', _load_urls),
+    ('templates', _precompile_templates),
+    ('typeahead', _build_typeahead),
+    ('facets', _build_facets),
+)
+
+
+def warm_up():
+    """Выполняет шаги прогрева; возвращает {шаг: миллисекунды} для выполненных шагов."""
+    timings = {}
+    for name, step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except DatabaseError:
+            logger.warning('Прогрев: шаг %s пропущен', name, exc_info=True)
+            continue
+        timings[name] = (time.perf_counter() - start) * 1000
+    logger.info(
+        'Воркер прогрет за %.0f мс (%s)', sum(timings.values()),
+        ', '.join(f'{name} {ms:.0f}' for name, ms in timings.items()),
+    )
+    return timings
+
+
+_fork_hook_installed = False
+
+
+def warm_up_on_start():
+    """
+    Старт воркера из точки входа веб-сервера: прогрев (выключается WARM_UP_ON_START=False)
+    и разбор очереди писем, оставшихся с прошлого запуска (app/outbox.py).
+    """
+    global _fork_hook_installed
+    from . import outbox
+
+    if settings.WARM_UP_ON_START:
+        warm_up()
+        if not _fork_hook_installed:
+            # Соединение SQLite нельзя использовать в двух процессах после fork
+            os.register_at_fork(before=connections.close_all)
+            _fork_hook_installed = True
+    outbox.resume()
+
+
+# ПРОФИЛЬ ИМПОРТА
+
+# import time: <собственное, мкс> | <с вложенными, мкс> | <отступ по 2 пробела на уровень><модуль>
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+class ImportNode:
+    __slots__ = ('name', 'self_us', 'total_us', 'children')
+
+    def __init__(self, name, self_us, total_us, children):
+        self.name = name
+        self.self_us = self_us
+        self.total_us = total_us
+        self.children = children
+
+
+def parse_importtime(output):
+    """Корневые модули из вывода -X importtime; у каждого узла - импортированные им модули.
+
+    Модуль печатается после своих вложенных импортов и с отступом на уровень меньше,
+    поэтому узел забирает себе узлы следующего уровня, накопленные перед ним.
+    """
+    pending = {}  # уровень -> узлы без родителя
+    for line in output.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, total_us, indent, name = match.groups()
+        depth = len(indent) // 2
+        node = ImportNode(name, int(self_us), int(total_us), pending.pop(depth + 1, []))
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
@@ -0,0 +1,16 @@
+from django import template
+from django.utils.html import format_html_join
+
+from app import assets
+
+register = template.Library()
+
+
+@register.simple_tag
+def stylesheet(bundle):
+    """
+    <link> на собранный бандл CSS, а до сборки - на каждый его исходный файл.
+
+        {% stylesheet 'css/site.css' %}
+    """
+    return format_html_join('\n', '<link rel="stylesheet" href="{}">', ((url,) for url in assets.bundle_urls(bundle)))
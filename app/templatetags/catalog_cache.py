@@ -0,0 +1,49 @@
+from django import template
+from django.conf import settings
+
+from app import caching
+
+register = template.Library()
+
+
+class CatalogCacheNode(template.Node):
+    def __init__(self, nodelist, name, models, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.models = models
+        self.vary_on = vary_on
+
+    def render(self, context):
+        request = context.get('request')
+        # У менеджеров во фрагментах формы управления с персональным CSRF-токеном
+        if request is not None and request.user.is_staff:
+            return self.nodelist.render(context)
+        if not settings.CATALOG_CACHE_ENABLED:
+            return self.nodelist.render(context)
+
+        name = self.name.resolve(context)
+        models = [model.strip() for model in self.models.resolve(context).split(',')]
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return caching.get_fragment(name, models, vary_on, lambda: self.nodelist.render(context))
+
+
+@register.tag('catalog_cache')
+def do_catalog_cache(parser, token):
+    """
+    Кэширует фрагмент шаблона до изменения перечисленных моделей.
+
+        {% catalog_cache 'movie_grid' 'movie,director' request.get_full_path %}
+            ...
+        {% endcatalog_cache %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' требует имя фрагмента и список моделей")
+    nodelist = parser.parse(('endcatalog_cache',))
+    parser.delete_first_token()
+    return CatalogCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
@@ -0,0 +1,24 @@
+from django import template
+from django.utils.html import format_html
+
+from app import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(fieldfile, size, alt=''):
+    """
+    <picture> с WebP-версией и версией в исходном формате нужного размера.
+
+        {% picture movie.poster 'grid' movie.title %}
+    """
+    src, webp = images.rendition_urls(fieldfile, size)
+    if src is None:
+        return ''
+    if webp is None:
+        return format_html('<img src="{}" alt="{}" loading="lazy">', src, alt)
+    return format_html(
+        '<picture><source srcset="{}" type="image/webp"><img src="{}" alt="{}" loading="lazy"></picture>',
+        webp, src, alt,
+    )
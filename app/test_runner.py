@@ -0,0 +1,27 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import caching
+
+
+class CatalogTestRunner(DiscoverRunner):
+    """
+    Тесты пишут и очищают свой временный кэш, а не общий кэш сайта (CACHE_LOCATION).
+    Фоновый пересчет похожих фильмов и перестроение индексов выключены: поток пережил бы тест
+    и не видел бы его незакоммиченных данных; тесты рекомендаций вызывают update_movie() сами.
+    Статика в тестах не собрана, поэтому манифест не строгий (STATIC_MANIFEST_STRICT).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._isolated_cache = caching.isolated_cache()
+        self._isolated_cache.__enter__()
+        self._settings = override_settings(
+            RECOMMENDATIONS_INCREMENTAL=False, INDEX_REBUILD_IN_BACKGROUND=False, STATIC_MANIFEST_STRICT=False,
+        )
+        self._settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._settings.disable()
+        self._isolated_cache.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1355 @@
-from django.test import TestCase
+import json
+import logging
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.mail.backends import locmem
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import IntegrityError, connection, connections, transaction
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    assets, auth_backends, caching, catalog_io, facets, images, ingest, outbox, ratelimit, recommendations, rendering,
+    search, startup, toplist, tracing, typeahead,
+)
+from .benchmark import (
+    PAGE_SCENARIOS, SCENARIOS, compare, generate_catalog, page_clients, run_client, unknown_scenarios,
+)
+from .middleware import QueryBudgetExceeded, fingerprint
+from .models import Actor, Director, FacetCount, Movie, OutgoingEmail, Review, SimilarMovie
+from .outbox import enqueue, process_outbox
+from .pagination import encode_cursor
+
+
+def create_catalog(movies=5, actors_per_movie=4, reviews_per_movie=2):
+    """Небольшой каталог: у каждого фильма свой режиссер, актеры и отзывы."""
+    actors = [Actor.objects.create(name=f'Актер {i}') for i in range(actors_per_movie + movies)]
+    created = []
+    for i in range(movies):
+        director = Director.objects.create(name=f'Режиссер {i}')
+        movie = Movie.objects.create(
+            title=f'Фильм {i}', description='Описание', year=2000 + i,
+            director=director, is_top=i < 3,
+        )
+        movie.actors.set(actors[i:i + actors_per_movie])
+        for j in range(reviews_per_movie):
+            Review.objects.create(movie=movie, author_name=f'user{j}', rating=5 + j, text='Отзыв')
+        created.append(movie)
+    return created
+
+
+class QueryCountTests(TestCase):
+    """Число запросов страниц каталога не зависит от количества строк."""
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, url):
+        # Индекс фасетов в памяти процесса прогрет, как на работающем сервере
+        facets.get_index()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url_factory):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_catalog(movies=2)
+        small = self.count_queries(url_factory())
+        with self.captureOnCommitCallbacks(execute=True):
+            create_catalog(movies=8)
+        large = self.count_queries(url_factory())
+        self.assertEqual(small, large)
+        return large
+
+    def test_index(self):
+        self.assertConstantQueries(lambda: reverse('index'))
+
+    def test_search(self):
+        self.assertConstantQueries(lambda: reverse('index') + '?q=фильм')
+
+    def test_top_five(self):
+        self.assertConstantQueries(lambda: reverse('top_five'))
+
+    def test_actors_list(self):
+        self.assertConstantQueries(lambda: reverse('actors_list'))
+
+    def test_directors_list(self):
+        self.assertConstantQueries(lambda: reverse('directors_list'))
+
+    def test_actor_detail(self):
+        def url():
+            actor = Actor.objects.order_by('id').first()
+            actor.movie_set.set(Movie.objects.all())
+            return reverse('actor_detail', args=[actor.pk])
+        self.assertConstantQueries(url)
+
+    def test_director_detail(self):
+        def url():
+            director = Director.objects.order_by('id').first()
+            # Все фильмы у одного режиссера, чтобы рос список на странице
+            Movie.objects.update(director=director)
+            return reverse('director_detail', args=[director.pk])
+        self.assertConstantQueries(url)
+
+    def test_movie_detail(self):
+        self.assertConstantQueries(lambda: reverse('movie_detail', args=[Movie.objects.order_by('id').first().pk]))
+
+
+class SearchTests(TestCase):
+    backend_class = search.MemoryBackend
+
+    def setUp(self):
+        patcher = mock.patch.object(search, '_backend', self.backend_class())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        director = Director.objects.create(name='Лана Вачовски')
+        self.keanu = Actor.objects.create(name='Киану Ривз')
+        self.matrix = Movie.objects.create(
+            title='Матрица', description='Хакер узнает правду о мире', year=1999, director=director,
+        )
+        self.wick = Movie.objects.create(title='Джон Уик', description='Киллер против матрицы', year=2014)
+        search.rebuild_index()
+
+    def test_stemming(self):
+        self.assertEqual(search.stem('матрицы'), search.stem('матрица'))
+        self.assertEqual(search.stem('Matrix'), 'Matrix')
+        self.assertEqual(search.tokenize('Ёжики в тумане'), ['ежик', 'в', 'туман'])
+        self.assertEqual(search.tokenize('Киану Ривзом'), search.tokenize('Киану Ривз'))
+
+    def test_ranking(self):
+        # Совпадение в названии весит больше, чем в описании
+        self.assertEqual(search.search_movie_ids('матрицы'), [self.matrix.pk, self.wick.pk])
+        # Все слова запроса обязательны и ищутся как префиксы
+        self.assertEqual(search.search_movie_ids('киллер матр'), [self.wick.pk])
+        self.assertEqual(search.search_movie_ids('вачовски'), [self.matrix.pk])
+        self.assertEqual(search.search_movie_ids('терминатор'), [])
+
+    def test_signals_maintain_index(self):
+        self.matrix.actors.add(self.keanu)
+        self.assertEqual(search.search_movie_ids('ривзом'), [self.matrix.pk])
+        self.keanu.movie_set.add(self.wick)
+        self.assertEqual(set(search.search_movie_ids('киану')), {self.matrix.pk, self.wick.pk})
+
+        self.keanu.name = 'Кеану Ривз'
+        self.keanu.save()
+        self.assertEqual(search.search_movie_ids('киану'), [])
+        self.assertEqual(len(search.search_movie_ids('кеану')), 2)
+        self.keanu.movie_set.clear()
+        self.assertEqual(search.search_movie_ids('кеану'), [])
+
+        self.matrix.title = 'Матрица: Перезагрузка'
+        self.matrix.save()
+        self.assertEqual(search.search_movie_ids('перезагрузка'), [self.matrix.pk])
+        self.matrix.director.delete()
+        self.assertEqual(search.search_movie_ids('вачовски'), [])
+
+        self.wick.delete()
+        self.assertEqual(search.search_movie_ids('киллер'), [])
+
+
+class FTS5SearchTests(SearchTests):
+    backend_class = search.FTS5Backend
+
+    def setUp(self):
+        if not search.fts5_table_exists():
+            self.skipTest('SQLite собран без FTS5')
+        super().setUp()
+
+
+@override_settings(REVIEWS_PAGE_SIZE=3)
+class MovieReviewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = create_catalog(movies=1, reviews_per_movie=0)[0]
+        for i in range(7):
+            Review.objects.create(movie=self.movie, author_name=f'author{i}', rating=7, text='Отзыв')
+
+    def test_detail_inlines_first_chunk(self):
+        response = self.client.get(reverse('movie_detail', args=[self.movie.pk]))
+        self.assertEqual(response.context['reviews_count'], 7)
+        self.assertEqual([r.author_name for r in response.context['reviews']], ['author6', 'author5', 'author4'])
+        self.assertContains(response, 'reviews-more')
+
+    def test_fragment_walks_all_reviews(self):
+        url = reverse('movie_reviews', args=[self.movie.pk])
+        authors = []
+        while url:
+            response = self.client.get(url)
+            page = response.context['reviews']
+            authors.extend(review.author_name for review in page)
+            url = reverse('movie_reviews', args=[self.movie.pk]) + page.next_url if page.has_next else None
+        self.assertEqual(authors, [f'author{i}' for i in range(6, -1, -1)])
+
+
+@override_settings(QUERY_PROFILER_ENABLED=True, QUERY_BUDGET=None, QUERY_BUDGET_RAISE=True)
+class QueryProfilerMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(movies=3)
+
+    def test_server_timing_header(self):
+        with self.assertLogs('app.queries', level='INFO') as logs:
+            response = self.client.get(reverse('actors_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('view=actors_list', logs.output[0])
+
+    def test_budget_exceeded_raises(self):
+        with override_settings(QUERY_BUDGET=1):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('index'))
+
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id = 1'), fingerprint('SELECT * FROM t WHERE id = 25'))
+        self.assertEqual(fingerprint("SELECT 1 FROM t WHERE id IN (%s, %s, %s)"), 'SELECT ? FROM t WHERE id IN (...)')
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = create_catalog(movies=3)
+
+    def test_tests_use_isolated_cache(self):
+        # cache.clear() в тестах не должен очищать кэш работающего сайта
+        location = settings.CACHES['default']['LOCATION']
+        self.assertNotEqual(location, str(settings.BASE_DIR / 'cache'))
+        self.assertTrue(caching.is_shared())
+
+    def test_anonymous_page_is_served_from_cache(self):
+        url = reverse('actor_detail', args=[Actor.objects.order_by('id').first().pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_save_invalidates_dependent_pages(self):
+        url = reverse('top_five')
+        self.client.get(url)
+        movie = self.movies[0]
+        movie.title = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.save()
+            # До коммита версия прежняя: страница из старых строк не попадет под новый ключ
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Новое название')
+
+    def test_fragments_follow_m2m_changes(self):
+        url = reverse('movie_detail', args=[self.movies[0].pk])
+        self.client.get(url)
+        actor = Actor.objects.create(name='Новый актер')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies[0].actors.add(actor)
+        self.assertContains(self.client.get(url), 'Новый актер')
+
+    @override_settings(CATALOG_CACHE_NONE_TIMEOUT=0)
+    def test_uncacheable_marker_is_short_lived(self):
+        self.assertIsNone(caching.get_or_build('catalog:test:none', lambda: None))
+        self.assertEqual(cache.get('catalog:test:none', 'missing'), 'missing')
+
+    def test_deploy_check_rejects_process_local_cache(self):
+        self.assertEqual(caching.check_shared_caches(None), [])
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            errors = caching.check_shared_caches(None)
+        self.assertEqual([error.id for error in errors], ['app.E001', 'app.E001'])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('SMTP недоступен')
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    failures = 0
+
+    def send_messages(self, email_messages):
+        if FlakyEmailBackend.failures:
+            FlakyEmailBackend.failures -= 1
+            raise ConnectionRefusedError('SMTP недоступен')
+        return super().send_messages(email_messages)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(TestCase):
+    def test_register_only_enqueues_email(self):
+        response = self.client.post(reverse('register'), {
+            'username': 'newuser',
+            'email': 'newuser@example.com',
+            'password1': 'Sup3r-secret-pass',
+            'password2': 'Sup3r-secret-pass',
+        }, follow=True)
+        self.assertRedirects(response, reverse('index'))
+        # Письмо только поставлено в очередь, сообщение не обещает, что оно уже отправлено
+        self.assertContains(response, 'поставлено в очередь')
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipients, ['newuser@example.com'])
+
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].alternatives[0].mimetype, 'text/html')
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.SENT)
+
+    @override_settings(EMAIL_BACKEND='app.tests.FailingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_email_is_retried_then_dead_lettered(self):
+        email = enqueue('Тема', 'Текст', 'from@example.com', ['to@example.com'])
+
+        process_outbox()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.PENDING, 1))
+        self.assertIn('SMTP недоступен', email.last_error)
+        # До наступления next_attempt_at письмо не берется повторно
+        self.assertEqual(process_outbox(), 0)
+
+        OutgoingEmail.objects.update(next_attempt_at=email.created_at)
+        process_outbox()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.DEAD, 2))
+
+
+@override_settings(
+    EMAIL_BACKEND='app.tests.FlakyEmailBackend', EMAIL_OUTBOX_WORKER='thread', EMAIL_OUTBOX_RETRY_DELAY=1,
+)
+class EmailOutboxThreadTests(TransactionTestCase):
+    def wait_until_sent(self, *emails):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if all(email.status == OutgoingEmail.SENT for email in emails):
+                break
+            time.sleep(0.05)
+            for email in emails:
+                email.refresh_from_db()
+
+    def test_backed_off_email_is_sent_without_new_enqueue(self):
+        FlakyEmailBackend.failures = 1
+        email = enqueue('Тема', 'Текст', 'from@example.com', ['to@example.com'])
+        self.wait_until_sent(email)
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.SENT, 2))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_resume_sends_mail_left_from_previous_run(self):
+        FlakyEmailBackend.failures = 0
+        # Очередь после перезапуска: одно письмо пора отправлять, второе отложено до повтора
+        fields = {
+            'subject': 'Тема', 'body': 'Текст', 'from_email': 'from@example.com', 'recipients': ['to@example.com'],
+        }
+        due = OutgoingEmail.objects.create(**fields)
+        backed_off = OutgoingEmail.objects.create(
+            **fields, attempts=1, next_attempt_at=timezone.now() + timedelta(seconds=1),
+        )
+        outbox.resume()
+        self.wait_until_sent(due, backed_off)
+        self.assertEqual([due.status, backed_off.status], [OutgoingEmail.SENT, OutgoingEmail.SENT])
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = create_catalog(movies=4)
+
+    def test_movie_list_embeds_relations_with_constant_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api_movie_list') + '?per_page=3')
+        data = response.json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(len(data['results'][0]['actors']), 4)
+        self.assertIn('rating', data['results'][0])
+
+        next_page = self.client.get(data['next']).json()
+        self.assertEqual(len(next_page['results']), 1)
+
+    def test_bad_cursor_returns_first_page(self):
+        user = User.objects.create_user('reader')
+        self.client.force_login(user)
+        urls = [
+            reverse('index'), reverse('actors_list'), reverse('directors_list'), reverse('my_reviews'),
+            reverse('movie_reviews', args=[self.movies[0].pk]),
+            reverse('api_movie_list'), reverse('api_actor_list'), reverse('api_review_list'),
+        ]
+        for values in (['x', 'y'], [{'a': 1}, 2], [None, None], [1], [[1], 2], 'x'):
+            cursor = encode_cursor(values)
+            for url in urls:
+                for param in ('after', 'before'):
+                    with self.subTest(url=url, param=param, values=values):
+                        self.assertEqual(self.client.get(url, {param: cursor}).status_code, 200)
+
+    def test_field_selection(self):
+        response = self.client.get(reverse('api_movie_detail', args=[self.movies[0].pk]) + '?fields=id,title')
+        self.assertEqual(response.json(), {'id': self.movies[0].pk, 'title': self.movies[0].title})
+
+    def test_no_validators_without_shared_cache(self):
+        url = reverse('api_movie_list')
+        etag = self.client.get(url)['ETag']
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_search_filters_apply_before_pagination(self):
+        facets.rebuild()
+        url = reverse('api_movie_list') + '?q=фильм&top=1&per_page=2'
+        titles = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertTrue(data['results'])
+            titles += [movie['title'] for movie in data['results']]
+            url = data['next']
+        # Первые три фильма в топе: две полные страницы, без пустых и коротких посередине
+        self.assertEqual(sorted(titles), ['Фильм 0', 'Фильм 1', 'Фильм 2'])
+        director = self.movies[3].director_id
+        data = self.client.get(reverse('api_movie_list'), {'q': 'фильм', 'director': director, 'per_page': 1}).json()
+        self.assertEqual([movie['title'] for movie in data['results']], ['Фильм 3'])
+        self.assertIsNone(data['next'])
+
+    def test_change_in_same_second_is_not_modified_since(self):
+        url = reverse('api_movie_list')
+        last_modified = self.client.get(url)['Last-Modified']
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(movie=self.movies[0], author_name='user', rating=9, text='Отзыв')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_validators_change_only_after_commit(self):
+        url = reverse('api_movie_list')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(movie=self.movies[0], author_name='user', rating=9, text='Отзыв')
+            self.assertEqual(self.client.get(url)['ETag'], etag)
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_conditional_get_skips_queries(self):
+        url = reverse('api_movie_list')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(movie=self.movies[0], author_name='user', rating=9, text='Отзыв')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class UserReviewsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        self.movie = create_catalog(movies=1, reviews_per_movie=0)[0]
+        self.client.force_login(self.user)
+
+    def test_review_is_linked_to_author(self):
+        self.client.post(reverse('movie_detail', args=[self.movie.pk]), {
+            'review_submit': 'true', 'rating': 8, 'text': 'Отличный фильм',
+        })
+        review = Review.objects.get()
+        self.assertEqual(review.user, self.user)
+
+        # Профиль считает отзывы по user, а не по имени
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['user_reviews'], 1)
+
+    def test_my_reviews_listing(self):
+        for i in range(3):
+            Review.objects.create(movie=self.movie, user=self.user, author_name='viewer', rating=5, text=f'Отзыв {i}')
+        Review.objects.create(movie=self.movie, author_name='other', rating=5, text='Чужой')
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('my_reviews'))
+        self.assertEqual([r.text for r in response.context['reviews']], ['Отзыв 2', 'Отзыв 1', 'Отзыв 0'])
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first, self.second = create_catalog(movies=2, reviews_per_movie=0)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def assertRating(self, movie, rating_sum, rating_count, rating_avg):
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_sum, movie.rating_count, movie.rating_avg), (rating_sum, rating_count, rating_avg))
+
+    def admin_change(self, review, **changes):
+        review.refresh_from_db()
+        data = {
+            'movie': review.movie_id, 'user': review.user_id or '', 'author_name': review.author_name,
+            'rating': review.rating, 'text': review.text, 'is_active': 'on' if review.is_active else '',
+        }
+        data.update(changes)
+        self.client.post(reverse('admin:app_review_change', args=[review.pk]), data)
+        review.refresh_from_db()
+
+    def set_active(self, reviews):
+        # list_editable в списке отзывов админки
+        data = {'form-TOTAL_FORMS': len(reviews), 'form-INITIAL_FORMS': len(reviews), '_save': 'Сохранить'}
+        for i, (review, is_active) in enumerate(reviews.items()):
+            data[f'form-{i}-id'] = review.pk
+            if is_active:
+                data[f'form-{i}-is_active'] = 'on'
+        self.client.post(reverse('admin:app_review_changelist'), data)
+
+    def test_form_and_admin_keep_aggregates(self):
+        self.client.post(reverse('movie_detail', args=[self.first.pk]), {
+            'review_submit': 'true', 'rating': 8, 'text': 'Отзыв с сайта',
+        })
+        self.client.post(reverse('movie_detail', args=[self.first.pk]), {
+            'review_submit': 'true', 'rating': 4, 'text': 'Еще отзыв',
+        })
+        self.assertRating(self.first, 12, 2, 6.0)
+        posted, other = Review.objects.order_by('pk')
+
+        self.admin_change(posted, rating=6)
+        self.assertRating(self.first, 10, 2, 5.0)
+
+        # Перенос на другой фильм
+        self.admin_change(posted, movie=self.second.pk)
+        self.assertRating(self.first, 4, 1, 4.0)
+        self.assertRating(self.second, 6, 1, 6.0)
+
+        self.set_active({posted: True, other: False})
+        self.assertRating(self.first, 0, 0, 0.0)
+        self.assertRating(self.second, 6, 1, 6.0)
+        # Правка скрытого отзыва не трогает рейтинг
+        self.admin_change(other, rating=10)
+        self.assertRating(self.first, 0, 0, 0.0)
+        self.set_active({posted: True, other: True})
+        self.assertRating(self.first, 10, 1, 10.0)
+
+        self.client.post(reverse('admin:app_review_delete', args=[posted.pk]), {'post': 'yes'})
+        self.assertFalse(Review.objects.filter(pk=posted.pk).exists())
+        self.assertRating(self.second, 0, 0, 0.0)
+        # Действие «удалить выбранные» удаляет через QuerySet.delete(), post_delete тоже приходит
+        self.client.post(reverse('admin:app_review_changelist'), {
+            'action': 'delete_selected', '_selected_action': [other.pk], 'post': 'yes',
+        })
+        self.assertFalse(Review.objects.exists())
+        self.assertRating(self.first, 0, 0, 0.0)
+
+    def test_refreshed_instance_uses_current_rating(self):
+        review = Review.objects.create(movie=self.first, author_name='a', rating=7, text='Отзыв')
+        other_copy = Review.objects.get(pk=review.pk)
+        other_copy.rating = 3
+        other_copy.save()
+        self.assertRating(self.first, 3, 1, 3.0)
+
+        review.refresh_from_db()
+        review.delete()
+        self.assertRating(self.first, 0, 0, 0.0)
+
+    def test_saving_stale_movie_keeps_aggregates(self):
+        stale = Movie.objects.get(pk=self.first.pk)
+        Review.objects.create(movie=self.first, author_name='a', rating=7, text='Отзыв')
+        stale.title = 'Новое название'
+        stale.save()
+        self.assertRating(self.first, 7, 1, 7.0)
+        self.assertEqual(self.first.title, 'Новое название')
+
+        # С отложенными полями сохраняются только загруженные, агрегаты не трогаются
+        admin_copy = Movie.objects.only('title', 'year', 'description').get(pk=self.first.pk)
+        Review.objects.create(movie=self.first, author_name='b', rating=3, text='Отзыв')
+        admin_copy.year = 1999
+        admin_copy.save()
+        self.assertRating(self.first, 10, 2, 5.0)
+        self.assertEqual(self.first.year, 1999)
+
+    def test_rebuild_ratings_repairs_drift(self):
+        Review.objects.create(movie=self.first, author_name='a', rating=7, text='Отзыв')
+        Review.objects.create(movie=self.first, author_name='b', rating=2, text='Отзыв')
+        Review.objects.create(movie=self.second, author_name='c', rating=9, text='Отзыв')
+        # update() сигналов не отправляет: агрегаты расходятся с отзывами
+        Review.objects.filter(author_name='b').update(is_active=False)
+        Movie.objects.filter(pk=self.second.pk).update(rating_sum=100, rating_count=3, rating_avg=33.3)
+        self.assertRating(self.first, 9, 2, 4.5)
+
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertRating(self.first, 7, 1, 7.0)
+        self.assertRating(self.second, 9, 1, 9.0)
+
+
+class TopListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = create_catalog(movies=7)  # первые три уже в топе
+
+    def test_limit_is_enforced(self):
+        self.assertTrue(toplist.add(self.movies[3].pk))
+        self.assertTrue(toplist.add(self.movies[4].pk))
+        self.assertFalse(toplist.add(self.movies[5].pk))
+        self.assertFalse(toplist.add(self.movies[0].pk))
+        self.assertEqual(Movie.objects.filter(is_top=True).count(), toplist.TOP_LIMIT)
+
+        self.assertTrue(toplist.remove(self.movies[0].pk))
+        self.assertFalse(toplist.remove(self.movies[0].pk))
+        self.assertTrue(toplist.add(self.movies[5].pk))
+
+    def test_limit_follows_locked_counter(self):
+        # Серверная СБД: лимит сверяется со строкой FacetCount(top) под FOR UPDATE.
+        # SQLite не знает FOR UPDATE, поэтому сам текст блокировки здесь пустой
+        with mock.patch.object(connection.features, 'has_select_for_update', True), \
+                mock.patch.object(connection.ops, 'for_update_sql', return_value=''):
+            self.assertTrue(toplist.add(self.movies[3].pk))
+            counter = FacetCount.objects.get(facet='top', value=facets.TOP_VALUE)
+            self.assertEqual(counter.count, 4)
+            # Параллельная транзакция уже заполнила топ и закоммитила счетчик
+            FacetCount.objects.filter(pk=counter.pk).update(count=toplist.TOP_LIMIT)
+            self.assertFalse(toplist.add(self.movies[4].pk))
+        self.assertEqual(Movie.objects.filter(is_top=True).count(), 4)
+
+    def test_cached_list_is_refreshed(self):
+        self.assertEqual(len(toplist.get_top_movies()), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            toplist.add(self.movies[6].pk)
+        with self.assertNumQueries(0):
+            top = toplist.get_top_movies()
+            self.assertEqual(top[0].director.name, 'Режиссер 6')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('top_five'))
+        self.assertEqual(len(response.context['top_movies']), 4)
+
+    def test_manager_action(self):
+        manager = User.objects.create_user('manager', 'manager@example.com', 'password', is_staff=True)
+        self.client.force_login(manager)
+        self.client.post(reverse('movie_detail', args=[self.movies[3].pk]), {'action': 'add_to_top'})
+        self.assertTrue(Movie.objects.get(pk=self.movies[3].pk).is_top)
+        self.client.post(reverse('index'), {'movie_id': self.movies[3].pk, 'action': 'remove_from_top'})
+        self.assertFalse(Movie.objects.get(pk=self.movies[3].pk).is_top)
+
+    def test_admin_list_editable_respects_limit(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        movies = Movie.objects.order_by('pk')
+        data = {
+            'form-TOTAL_FORMS': len(movies), 'form-INITIAL_FORMS': len(movies), '_save': 'Сохранить',
+        }
+        for i, movie in enumerate(movies):
+            data[f'form-{i}-id'] = movie.pk
+            if movie.is_top or movie.pk in (self.movies[3].pk, self.movies[4].pk, self.movies[5].pk):
+                data[f'form-{i}-is_top'] = 'on'
+        self.client.post(reverse('admin:app_movie_changelist'), data)
+        self.assertEqual(Movie.objects.filter(is_top=True).count(), toplist.TOP_LIMIT)
+
+        del data['form-0-is_top']
+        self.client.post(reverse('admin:app_movie_changelist'), data)
+        self.assertFalse(Movie.objects.get(pk=movies[0].pk).is_top)
+        self.assertEqual(Movie.objects.filter(is_top=True).count(), toplist.TOP_LIMIT)
+
+
+class CatalogIOTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def exported(self):
+        return [{**record, 'actors': sorted(record['actors'])} for record in catalog_io.export_records()]
+
+    def clear_catalog(self):
+        Movie.objects.all().delete()
+        Actor.objects.all().delete()
+        Director.objects.all().delete()
+
+    def test_round_trip(self):
+        create_catalog(movies=4)
+        Movie.objects.filter(pk=Movie.objects.order_by('pk')[1].pk).update(director=None, poster='posters/1.jpg')
+        expected = self.exported()
+        for name in ('catalog.csv', 'catalog.jsonl'):
+            with self.subTest(name):
+                path = self.directory / name
+                call_command('export_catalog', str(path), stdout=StringIO())
+                self.clear_catalog()
+                call_command('import_catalog', str(path), stdout=StringIO())
+                self.assertEqual(self.exported(), expected)
+                self.assertEqual(Actor.objects.count(), 7)
+                self.assertEqual(search.search_movie_ids('фильм 3')[0], Movie.objects.get(title='Фильм 3').pk)
+
+    def test_resume_from_checkpoint(self):
+        path = self.directory / 'catalog.jsonl'
+        records = [{'title': f'Фильм {i}', 'year': 2000 + i, 'actors': [f'Актер {i}']} for i in range(5)]
+        broken = [*records[:3], {'title': 'Фильм 3', 'year': 'не год'}, *records[4:]]
+        path.write_text(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in broken))
+
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', str(path), '--batch-size=2', stdout=StringIO())
+        # Закоммичена только первая пачка, третья запись пропала вместе с упавшей
+        self.assertEqual(list(Movie.objects.order_by('pk').values_list('title', flat=True)), ['Фильм 0', 'Фильм 1'])
+        self.assertEqual(Path(f'{path}.checkpoint').read_text(), '2')
+
+        path.write_text(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        out = StringIO()
+        call_command('import_catalog', str(path), '--batch-size=2', stdout=out)
+        self.assertIn('Продолжаем с записи 3', out.getvalue())
+        self.assertEqual(
+            list(Movie.objects.order_by('pk').values_list('title', flat=True)), [f'Фильм {i}' for i in range(5)],
+        )
+        self.assertFalse(Path(f'{path}.checkpoint').exists())
+
+    def test_malformed_json_line_names_the_record(self):
+        lines = [json.dumps({'title': 'Фильм 0', 'year': 2000}), '', '{"title": "Фильм 1", "year":', '[1, 2]']
+        records = catalog_io.read_records(StringIO('\n'.join(lines) + '\n'), 'jsonl')
+        self.assertEqual(next(records)['title'], 'Фильм 0')
+        with self.assertRaisesRegex(catalog_io.CatalogFormatError, r'^Запись 2: некорректный JSON'):
+            next(records)
+        records = catalog_io.read_records(StringIO(lines[3]), 'jsonl')
+        with self.assertRaisesRegex(catalog_io.CatalogFormatError, r'^Запись 1: ожидался объект JSON'):
+            next(records)
+
+    def test_import_respects_top_limit(self):
+        create_catalog(movies=3)  # все три в топе
+        path = self.directory / 'catalog.csv'
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            catalog_io.write_records(stream, 'csv', (
+                {'title': f'Новый {i}', 'description': '', 'year': 2020, 'director': '', 'actors': [],
+                 'is_top': True, 'poster': ''}
+                for i in range(4)
+            ))
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_catalog', str(path), stdout=out)
+        self.assertEqual(Movie.objects.filter(is_top=True).count(), toplist.TOP_LIMIT)
+        self.assertIn('2 фильмов импортированы без отметки is_top', out.getvalue())
+        self.assertEqual(len(toplist.get_top_movies()), toplist.TOP_LIMIT)
+
+
+class RenditionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 1500), 'red').save(buffer, 'PNG')
+        self.name = default_storage.save('posters/poster.png', ContentFile(buffer.getvalue()))
+        with mock.patch.object(images, 'schedule'):
+            self.movie = Movie.objects.create(title='Фильм', description='Описание', year=2000, poster=self.name)
+
+    def test_generate_renditions(self):
+        versions = caching.get_versions(['movie'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(images.generate_renditions(self.name, models=['movie']), 4)
+        for size, (width, height) in settings.IMAGE_RENDITIONS.items():
+            for webp in (False, True):
+                with default_storage.open(images.rendition_name(self.name, size, webp)) as stream:
+                    image = Image.open(stream)
+                    self.assertEqual(image.format, 'WEBP' if webp else 'PNG')
+                    self.assertLessEqual(image.size, (width, height))
+        # Фрагменты с адресом оригинала больше не действительны
+        self.assertNotEqual(caching.get_versions(['movie']), versions)
+        # Готовые версии повторно не строятся
+        self.assertEqual(images.generate_renditions(self.name), 0)
+
+    def test_picture_falls_back_to_original(self):
+        template = Template("{% load renditions %}{% picture movie.poster size 'Фильм' %}")
+        html = template.render(Context({'movie': self.movie, 'size': 'grid'}))
+        self.assertEqual(html, f'<img src="/media/{self.name}" alt="Фильм" loading="lazy">')
+
+        images.generate_renditions(self.name)
+        html = template.render(Context({'movie': self.movie, 'size': 'grid'}))
+        self.assertIn('<source srcset="/media/posters/poster.grid.webp" type="image/webp">', html)
+        self.assertIn('<img src="/media/posters/poster.grid.png"', html)
+        # Неизвестный размер и пустое поле
+        self.assertIn(f'src="/media/{self.name}"', template.render(Context({'movie': self.movie, 'size': 'huge'})))
+        self.assertEqual(template.render(Context({'movie': Movie(), 'size': 'grid'})), '')
+
+    def test_saving_schedules_renditions_after_commit(self):
+        with mock.patch.object(images, 'schedule') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.movie.save()
+        schedule.assert_called_once_with(self.name, ['movie'])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        facets.rebuild()
+        self.movies = create_catalog(movies=6)  # годы 2000-2005, первые три в топе
+
+    def stored(self):
+        return {(row.facet, row.value): row.count for row in FacetCount.objects.filter(count__gt=0)}
+
+    def test_signals_keep_counts_equal_to_rebuild(self):
+        movie = Movie.objects.get(pk=self.movies[0].pk)
+        movie.year = 1995
+        movie.director = self.movies[1].director
+        movie.save()
+        movie.actors.remove(movie.actors.first())
+        self.movies[1].actors.clear()
+        Actor.objects.first().movie_set.add(self.movies[2])
+        Review.objects.create(movie=self.movies[3], author_name='critic', rating=1, text='Плохо')
+        Review.objects.filter(movie=self.movies[4]).first().delete()
+        toplist.remove(self.movies[2].pk)
+        self.movies[5].delete()
+        Director.objects.get(pk=self.movies[4].director_id).delete()
+
+        incremental = self.stored()
+        facets.rebuild()
+        self.assertEqual(incremental, self.stored())
+        self.assertEqual(incremental[('decade', '1990')], 1)
+
+    def test_review_touches_rating_band_only_when_it_changes(self):
+        cache.set(facets._GENERATION_KEY, 1, None)
+        cache.set(typeahead._GENERATION_KEY, 1, None)
+        counts = self.stored()
+        # Оценки 5 и 6, с новой 5 средняя остается в диапазоне 4–6
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(movie=self.movies[0], author_name='critic', rating=5, text='Отзыв')
+        self.assertEqual(self.stored(), counts)
+        self.assertEqual(cache.get(facets._GENERATION_KEY), 1)
+        self.assertEqual(cache.get(typeahead._GENERATION_KEY), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(movie=self.movies[0], author_name='fan', rating=10, text='Отзыв')
+        self.assertEqual(self.stored()[('rating', '4')], counts[('rating', '4')] - 1)
+        self.assertEqual(self.stored()[('rating', '6')], 1)
+        self.assertNotEqual(cache.get(facets._GENERATION_KEY), 1)
+
+    def test_counts_respect_other_filters(self):
+        Movie.objects.filter(pk=self.movies[4].pk).update(year=2011)
+        facets.rebuild()
+        filters = facets.parse_filters({'top': '1', 'decade': '2000', 'director': 'oops'})
+        self.assertEqual(filters, {'top': 'yes', 'decade': '2000'})
+
+        groups = {group['name']: group for group in facets.build_groups(QueryDict('top=1&decade=2000'), filters)}
+        decades = {value['label']: value['count'] for value in groups['decade']['values']}
+        self.assertEqual(decades, {'2000-е': 3})
+        years = [value['label'] for value in groups['year']['values']]
+        self.assertEqual(years, ['2002', '2001', '2000'])
+        self.assertEqual(groups['top']['values'][0]['count'], 3)
+        self.assertEqual(
+            facets.filter_queryset(Movie.objects.all(), filters).count(),
+            groups['top']['values'][0]['count'],
+        )
+
+    def test_index_applies_committed_changes_only(self):
+        index = facets.get_index()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            movie = Movie.objects.get(pk=self.movies[0].pk)
+            movie.year = 1995
+            movie.save()
+            raise IntegrityError
+        self.assertEqual(index.bitmap(('year', '1995')), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            movie = Movie.objects.get(pk=self.movies[0].pk)
+            movie.year = 1995
+            movie.save()
+        self.assertEqual(index.bitmap(('year', '1995')), 1 << movie.pk)
+        # Свое изменение индекс применил сам и не перестраивается
+        self.assertIs(facets.get_index(), index)
+
+    @override_settings(FACET_INDEX_TTL=0)
+    def test_index_rebuilds_after_foreign_change(self):
+        index = facets.get_index()
+        self.assertIs(facets.get_index(), index)
+        cache.set(facets._GENERATION_KEY, 1, None)  # изменение из другого процесса
+        self.assertIsNot(facets.get_index(), index)
+
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            index = facets.get_index()
+            self.assertIsNot(facets.get_index(), index)
+
+    def test_index_page_filters_movies(self):
+        response = self.client.get(reverse('index'), {'year': 2004})
+        self.assertEqual([movie.pk for movie in response.context['movies']], [self.movies[4].pk])
+        self.assertContains(response, 'Сбросить фильтры')
+        response = self.client.get(reverse('index'), {'q': 'Фильм', 'top': '1'})
+        self.assertEqual(len(response.context['movies']), 3)
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        typeahead.reset()
+        self.movies = create_catalog(movies=3)
+        Review.objects.create(movie=self.movies[1], author_name='critic', rating=9, text='Отзыв')
+
+    def suggest(self, query):
+        return self.client.get(reverse('api_suggest'), {'q': query}).json()['results']
+
+    def test_ranked_by_popularity_without_queries(self):
+        typeahead.get_index()
+        with self.assertNumQueries(0):
+            results = self.suggest('фил')
+        self.assertEqual(results[0]['id'], self.movies[1].pk)
+        self.assertEqual(results[0]['url'], reverse('movie_detail', args=[self.movies[1].pk]))
+        self.assertEqual(self.suggest('ф'), [])
+        self.assertEqual([item['name'] for item in self.suggest('реж 2')], ['Режиссер 2'])
+
+    def test_signals_update_index(self):
+        typeahead.get_index()
+        movie = Movie.objects.get(pk=self.movies[0].pk)
+        movie.title = 'Ёжик в тумане'
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.save()
+        self.assertEqual([item['id'] for item in self.suggest('ежик')], [movie.pk])
+        self.assertEqual(self.suggest('фильм 0'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            actor = Actor.objects.create(name='Юрий Норштейн')
+            self.movies[2].actors.add(actor)
+        self.assertEqual([item['type'] for item in self.suggest('норш')], ['actor'])
+        with self.captureOnCommitCallbacks(execute=True):
+            actor.delete()
+        self.assertEqual(self.suggest('норш'), [])
+
+    def test_rolled_back_save_leaves_no_suggestion(self):
+        typeahead.get_index()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Actor.objects.create(name='Юрий Норштейн')
+            raise IntegrityError
+        self.assertEqual(self.suggest('норш'), [])
+
+    @override_settings(TYPEAHEAD_INDEX_TTL=0)
+    def test_index_picks_up_other_processes(self):
+        index = typeahead.get_index()
+        self.assertIs(typeahead.get_index(), index)
+        # Команда или другой воркер добавили актера и сдвинули метку поколения
+        Actor.objects.bulk_create([Actor(name='Юрий Норштейн')])
+        cache.set(typeahead._GENERATION_KEY, 1, None)
+        self.assertEqual([item['type'] for item in self.suggest('норш')], ['actor'])
+
+
+@override_settings(INDEX_REBUILD_IN_BACKGROUND=True, FACET_INDEX_TTL=0, TYPEAHEAD_INDEX_TTL=0)
+class IndexBackgroundRebuildTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(setattr, facets, '_index', None)
+        self.addCleanup(setattr, typeahead, '_index', None)
+        facets._index = typeahead._index = None
+
+    def test_stale_index_is_served_while_rebuilding(self):
+        indexes = {module: module.get_index() for module in (facets, typeahead)}
+        # Другой процесс добавил фильм и актера и сдвинул метки поколения
+        movie = Movie.objects.bulk_create([Movie(title='Сталкер', description='', year=1979)])[0]
+        Actor.objects.bulk_create([Actor(name='Юрий Норштейн')])
+        for module, index in indexes.items():
+            cache.set(module._GENERATION_KEY, 1, None)
+            with self.subTest(module.__name__):
+                # Запрос не ждет перестроения и получает прежний индекс
+                self.assertIs(module.get_index(), index)
+                module._rebuild_thread.join(10)
+                self.assertIsNot(module.get_index(), index)
+        self.assertEqual(facets.get_index().bitmap(('year', '1979')), 1 << movie.pk)
+        self.assertEqual(list(typeahead.suggest('норш')), ['actor'])
+
+
+class RecommendationsTests(TestCase):
+    def setUp(self):
+        generate_catalog(movies=60, actors=80, cast_mean=4, reviews_mean=4)
+
+    def neighbours(self):
+        rows = SimilarMovie.objects.order_by('movie_id', 'rank').values_list('movie_id', 'similar_id', 'score')
+        return [(movie_id, similar_id, round(score, 6)) for movie_id, similar_id, score in rows]
+
+    def test_rebuild_ranks_shared_cast_first(self):
+        first, second, third = Movie.objects.order_by('pk')[:3]
+        actors = list(Actor.objects.order_by('-pk')[:2])
+        first.actors.set(actors)
+        second.actors.set(actors)
+        recommendations.rebuild(backend='python')
+
+        top = SimilarMovie.objects.filter(movie=first).order_by('rank').first()
+        self.assertEqual(top.similar, second)
+        self.assertFalse(SimilarMovie.objects.filter(movie=first, similar=first).exists())
+
+    @skipUnless(recommendations.numpy_available(), 'NumPy/SciPy не установлены')
+    def test_numpy_matches_python(self):
+        recommendations.rebuild(backend='python')
+        expected = self.neighbours()
+        recommendations.rebuild(backend='numpy', block_size=7)
+        self.assertEqual(self.neighbours(), expected)
+
+    def test_incremental_update_matches_rebuild(self):
+        recommendations.rebuild(backend='python')
+        movie = Movie.objects.order_by('pk')[10]
+        for i in range(3):
+            Review.objects.create(movie=movie, author_name=f'user{i + 1}', rating=10, text='Отзыв')
+        recommendations.update_movie(movie.pk)
+        incremental = [row for row in self.neighbours() if row[0] == movie.pk]
+
+        recommendations.rebuild(backend='python')
+        self.assertEqual(incremental, [row for row in self.neighbours() if row[0] == movie.pk])
+
+    @override_settings(RECOMMENDATIONS_NEIGHBOURHOOD_LIMIT=3)
+    def test_neighbourhood_is_capped(self):
+        recommendations.rebuild(backend='python')
+        movie = Movie.objects.order_by('pk')[10]
+        for i in range(20):
+            Review.objects.create(movie=movie, author_name=f'user{i + 1}', rating=10, text='Отзыв')
+        neighbourhood = recommendations._neighbourhood(movie.pk)
+        self.assertIn(movie.pk, neighbourhood)
+        self.assertLessEqual(len(neighbourhood), 1 + 3 * 3)
+
+        # Списки фильмов вне окрестности пересчет не трогает
+        outside = SimilarMovie.objects.filter(similar=movie).exclude(movie_id__in=neighbourhood)
+        kept = list(outside.values_list('movie_id', 'rank'))
+        recommendations.update_movie(movie.pk)
+        self.assertEqual(list(outside.values_list('movie_id', 'rank')), kept)
+        self.assertTrue(SimilarMovie.objects.filter(movie=movie).exists())
+
+    def test_schedule_update_coalesces_reviews(self):
+        # Тестовый раннер выключает фоновый пересчет
+        self.assertFalse(settings.RECOMMENDATIONS_INCREMENTAL)
+        movie = Movie.objects.order_by('pk').first()
+        executor = mock.Mock()
+        with override_settings(RECOMMENDATIONS_INCREMENTAL=True), \
+                mock.patch.object(recommendations, '_executor', executor), \
+                mock.patch.dict(recommendations._pending, clear=True):
+            recommendations.schedule_update(movie.pk)
+            recommendations.schedule_update(movie.pk)
+            self.assertEqual(executor.submit.call_count, 1)
+            self.assertIn(movie.pk, recommendations._pending)
+
+    def test_movie_detail_lists_similar_movies(self):
+        recommendations.rebuild(backend='python')
+        item = SimilarMovie.objects.order_by('movie_id', 'rank').first()
+        response = self.client.get(reverse('movie_detail', args=[item.movie_id]))
+        self.assertContains(response, reverse('movie_detail', args=[item.similar_id]))
+
+
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = create_catalog(movies=3)
+
+    async def test_read_views_under_asgi(self):
+        movie = self.movies[0]
+        urls = [
+            reverse('index'), reverse('index') + '?year=2001', reverse('movie_detail', args=[movie.pk]),
+            reverse('top_five'), reverse('actors_list'), reverse('directors_list'),
+            reverse('actor_detail', args=[(await movie.actors.afirst()).pk]),
+            reverse('director_detail', args=[movie.director_id]),
+        ]
+        for url in urls:
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+        response = await self.async_client.get(urls[0])
+        self.assertEqual(response['X-Cache'], 'HIT')
+        response = await self.async_client.get(reverse('movie_detail', args=[10 ** 6]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_review_post_still_works(self):
+        user = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        self.client.force_login(user)
+        url = reverse('movie_detail', args=[self.movies[1].pk])
+        response = self.client.post(url, {'review_submit': '1', 'rating': 7, 'text': 'Хорошо'})
+        self.assertRedirects(response, url)
+        self.assertEqual(Movie.objects.get(pk=self.movies[1].pk).rating_count, 3)
+
+
+class ReviewIngestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = create_catalog(movies=2, reviews_per_movie=0)
+        self.user = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+
+    def test_batch_updates_aggregates_once_per_movie(self):
+        reviews = [
+            Review(movie=self.movies[0], author_name='a', rating=4, text='Отзыв'),
+            Review(movie=self.movies[0], author_name='b', rating=8, text='Отзыв'),
+            Review(movie=self.movies[1], author_name='c', rating=10, text='Отзыв'),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            ingest.write_batch(reviews)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "app_review"')]
+        movie_updates = [q for q in queries if q['sql'].startswith('UPDATE "app_movie"')]
+        self.assertEqual((len(inserts), len(movie_updates)), (1, 2))
+
+        first, second = Movie.objects.order_by('pk')
+        self.assertEqual((first.rating_count, first.rating_sum, first.rating_avg), (2, 12, 6.0))
+        self.assertEqual((second.rating_count, second.rating_avg), (1, 10.0))
+        self.assertTrue(all(review.pk for review in reviews))
+        self.assertEqual(FacetCount.objects.get(facet='rating', value='8').count, 1)
+
+    def test_bad_review_fails_alone(self):
+        tickets = [
+            ingest._Ticket(Review(movie=self.movies[0], author_name='a', rating=4, text='Отзыв')),
+            # NOT NULL: пачка целиком падает с IntegrityError
+            ingest._Ticket(Review(movie=self.movies[0], author_name='b', rating=8, text=None)),
+            ingest._Ticket(Review(movie=self.movies[1], author_name='c', rating=10, text='Отзыв')),
+        ]
+        ingest.BatchWriter()._write(tickets)
+
+        self.assertTrue(all(ticket.done for ticket in tickets))
+        self.assertEqual([type(ticket.error) for ticket in tickets], [type(None), IntegrityError, type(None)])
+        self.assertEqual(sorted(Review.objects.values_list('author_name', flat=True)), ['a', 'c'])
+        first, second = Movie.objects.order_by('pk')
+        self.assertEqual((first.rating_count, first.rating_sum), (1, 4))
+        self.assertEqual((second.rating_count, second.rating_sum), (1, 10))
+
+    def test_sliding_window(self):
+        hit = lambda now: ratelimit.hit('test', 'window', 2, 60, now=now)
+        self.assertEqual((hit(0), hit(1)), (0, 0))
+        self.assertEqual(hit(2), 88)
+        # Предыдущее окно еще учитывается целиком, затем наполовину
+        self.assertEqual(hit(60), 30)
+        self.assertEqual(hit(90), 0)
+
+    @override_settings(REVIEW_RATE_USER_LIMIT=2)
+    def test_review_posts_are_rate_limited(self):
+        self.client.force_login(self.user)
+        url = reverse('movie_detail', args=[self.movies[0].pk])
+        for i in range(3):
+            response = self.client.post(url, {'review_submit': '1', 'rating': 7, 'text': f'Отзыв {i}'}, follow=True)
+        self.assertEqual(Review.objects.filter(user=self.user).count(), 2)
+        self.assertContains(response, 'Слишком много отзывов')
+        # Свой отзыв виден сразу после редиректа
+        self.assertContains(response, 'Отзыв 1')
+
+
+@override_settings(TRACING_SAMPLE_RATE=1, TRACING_METRICS_ENABLED=True)
+class TracingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tracing.metrics.reset()
+        self.movies = create_catalog(movies=2)
+
+    def test_sampled_request_is_broken_down_by_phase(self):
+        with self.assertLogs('app.tracing', 'INFO') as logs:
+            self.client.get(reverse('index'))
+            self.client.get(reverse('index'))
+        first, second = (record.trace for record in logs.records)
+        self.assertEqual((first['view'], first['status']), ('index', 200))
+        self.assertGreater(first['queries'], 0)
+        for phase in ('view_ms', 'db_ms', 'template_ms'):
+            self.assertLessEqual(first[phase], first['total_ms'])
+        # Второй раз страница целиком берется из кэша
+        self.assertGreater(first['cache_miss'], 0)
+        self.assertEqual((second['cache_hit'], second['queries']), (1, 0))
+
+        # Запись лога - одна JSON-строка с полями трассы
+        line = json.loads(tracing.JSONFormatter().format(logs.records[0]))
+        self.assertEqual((line['logger'], line['trace']['view']), ('app.tracing', 'index'))
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('movie_catalog_request_duration_seconds_count{view="index"} 2', text)
+        self.assertIn('movie_catalog_request_phase_seconds_bucket{phase="template",view="index",le="+Inf"} 1', text)
+        self.assertIn('movie_catalog_cache_requests_total{result="hit"} 1', text)
+
+    @override_settings(TRACING_SAMPLE_RATE=0, TRACING_METRICS_ENABLED=False)
+    def test_unsampled_requests_only_feed_histograms(self):
+        logger = logging.getLogger('app.tracing')
+        with self.assertNoLogs(logger, 'INFO'):
+            self.client.get(reverse('top_five'))
+        self.assertIn('view="top_five"', tracing.metrics.render())
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class StaticAssetsTests(TestCase):
+    def test_minify_css_keeps_strings(self):
+        source = '/* шапка */\n.a > .b ,  .c:hover {\n  content: "a  ;  b";\n  margin : 0 auto;\n}\n'
+        self.assertEqual(assets.minify_css(source), '.a>.b,.c:hover{content:"a  ;  b";margin :0 auto}')
+
+    def test_missing_manifest_entry_fails_only_in_strict_mode(self):
+        storage = assets.StaticFilesStorage()
+        self.assertEqual(storage.stored_name('css/missing.css'), 'css/missing.css')
+        with override_settings(STATIC_MANIFEST_STRICT=True), self.assertRaisesRegex(ValueError, 'manifest entry'):
+            storage.stored_name('css/missing.css')
+
+    def test_build_and_serve_precompressed_files(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root, DEBUG=False):
+            call_command('build_static', stdout=StringIO())
+            url, = assets.bundle_urls('css/site.css')
+            self.assertRegex(url, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+
+            app = assets.StaticFilesMiddleware(lambda environ, start_response: [b'django'])
+            responses = []
+
+            def get(path, **headers):
+                environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', **headers}
+                body = b''.join(app(environ, lambda status, headers: responses.append((status, dict(headers)))))
+                return (*responses[-1], body) if responses else (None, None, body)
+
+            status, headers, body = get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual((status, headers['Content-Encoding']), ('200 OK', 'gzip'))
+            self.assertIn('immutable', headers['Cache-Control'])
+            self.assertEqual(int(headers['Content-Length']), len(body))
+
+            status, headers, body = get(url, HTTP_IF_NONE_MATCH=headers['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual((status, body), ('304 Not Modified', b''))
+
+            status, headers, body = get(url)
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertEqual(assets.minify_css(body.decode()), body.decode())
+
+            # Все, что не статика, уходит в Django
+            self.assertEqual(get('/movie/1/')[2], b'django')
+
+
+class RenderingTests(TestCase):
+    def test_precompile_loads_every_template(self):
+        names = rendering.template_names()
+        self.assertIn('emails/welcome_email.html', names)
+        self.assertEqual(rendering.precompile(), len(names))
+
+    @override_settings(CATALOG_CACHE_ENABLED=False)
+    def test_profile_reports_templates_and_loops(self):
+        create_catalog(movies=3)
+        with rendering.profile() as result:
+            self.client.get(reverse('index'))
+        rows = {(kind, name): (calls, total, own) for kind, name, calls, total, own in result.rows()}
+        self.assertIn(('template', 'index.html'), rows)
+        loop = next(name for kind, name in rows if kind == 'for' and 'for movie in movies' in name)
+        self.assertTrue(loop.startswith('index.html:'))
+        # Цикл вложен в index.html: его время входит в полное время шаблона, но не в собственное
+        calls, total, own = rows[('template', 'index.html')]
+        self.assertGreaterEqual(total - own, rows[('for', loop)][1])
+
+
+class StartupTests(TestCase):
+    def tearDown(self):
+        # Индекс подсказок построен по данным теста, которые откатятся
+        typeahead.reset()
+
+    def test_warm_up_runs_every_step(self):
+        create_catalog(movies=3)
+        with self.assertLogs('app.startup', 'INFO'):
+            timings = startup.warm_up()
+        self.assertEqual(list(timings), [name for name, _ in startup.WARM_UP_STEPS])
+        self.assertTrue(typeahead.suggest('Фильм'))
+
+    @mock.patch.object(startup, '_fork_hook_installed', False)
+    @mock.patch.object(startup.os, 'register_at_fork')
+    @mock.patch.object(outbox, 'resume')
+    @mock.patch.object(startup, 'warm_up')
+    def test_warm_up_on_start(self, warm_up, resume, register_at_fork):
+        with override_settings(WARM_UP_ON_START=False):
+            startup.warm_up_on_start()
+        warm_up.assert_not_called()
+        # Очередь писем разбирается и без прогрева
+        resume.assert_called_once_with()
+        startup.warm_up_on_start()
+        startup.warm_up_on_start()
+        self.assertEqual(warm_up.call_count, 2)
+        # Соединения прогрева не должны достаться процессам после fork (gunicorn --preload)
+        register_at_fork.assert_called_once_with(before=connections.close_all)
+
+    def test_parse_importtime_builds_tree(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |     c',
+            'import time:       200 |        300 |   b',
+            'import time:        50 |         50 |   d',
+            'import time:        10 |        360 | a',
+            'import time:        70 |         70 | e',
+        ])
+        roots = startup.parse_importtime(output)
+        self.assertEqual([node.name for node in roots], ['a', 'e'])
+        self.assertEqual([(node.name, node.total_us) for node in roots[0].children], [('b', 300), ('d', 50)])
+        self.assertEqual(roots[0].children[0].children[0].name, 'c')
+
+    def test_password_login_skips_yandex_backend(self):
+        User.objects.create_user('reader', password='secret')
+        self.assertIsNone(auth_backends.YandexOAuth2().authenticate(None, username='reader', password='secret'))
+        self.assertTrue(self.client.login(username='reader', password='secret'))
+
+    def test_yandex_login_session_uses_lazy_backend(self):
+        user = User.objects.create_user('reader')
+        self.client.force_login(user, backend=auth_backends.SOCIAL_BACKEND_PATH)
+        self.assertEqual(self.client.session['_auth_user_backend'], auth_backends.BACKEND_PATH)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    def test_session_with_old_yandex_backend_stays_logged_in(self):
+        self.client.force_login(User.objects.create_user('reader'))
+        session = self.client.session
+        session['_auth_user_backend'] = auth_backends.SOCIAL_BACKEND_PATH
+        session.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+
+class ExplainTests(TestCase):
+    # Окружение тестов уже настроено раннером, команда не должна настраивать его повторно
+    @mock.patch('app.management.commands.explain.teardown_test_environment')
+    @mock.patch('app.management.commands.explain.setup_test_environment')
+    def test_plans_use_indexes(self, setup, teardown):
+        cache.clear()
+        create_catalog(movies=5)
+        user = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        Review.objects.filter(author_name='user0').update(user=user)
+        out = StringIO()
+        call_command(
+            'explain', '--scenario=top_five', '--scenario=director_detail', '--scenario=movie_detail',
+            '--scenario=profile', stdout=out, no_color=True,
+        )
+        output = out.getvalue()
+        for index in ('movie_top_year_idx', 'movie_director_year_idx', 'review_active_movie_idx',
+                      'review_user_created_idx'):
+            self.assertRegex(output, rf'USING (COVERING )?INDEX {index}\b')
+        self.assertIn('top_five: GET /top-five/ -> 200', output)
+
+
+class SQLiteProfileTests(TestCase):
+    def test_connection_init_applies_pragmas(self):
+        if connection.vendor != 'sqlite' or not connection.settings_dict['OPTIONS']:
+            self.skipTest('Профиль performance для SQLite не включен')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(connection.transaction_mode, settings.SQLITE_TRANSACTION_MODE)
+
+
+class BenchmarkTests(TestCase):
+    def test_generated_catalog_runs_all_scenarios(self):
+        versions = caching.get_versions(('movie', 'actor', 'director', 'review'))
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_catalog(movies=30, actors=60, cast_mean=4, reviews_mean=2, top=8)
+        self.assertEqual(Movie.objects.count(), 30)
+        self.assertEqual(Movie.objects.filter(is_top=True).count(), toplist.TOP_LIMIT)
+        self.assertNotEqual(caching.get_versions(('movie', 'actor', 'director', 'review')), versions)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(toplist.get_top_movies()), toplist.TOP_LIMIT)
+
+        results = run_client(requests=3, warmup=1)
+        self.assertEqual(set(results), set(SCENARIOS))
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50'], result['p99'])
+
+    def test_page_clients_log_in_for_profile(self):
+        self.assertEqual(unknown_scenarios(['index', 'profile', 'nope']), ['nope', 'profile'])
+        self.assertEqual(unknown_scenarios(['index', 'profile'], PAGE_SCENARIOS), [])
+        create_catalog(movies=1)
+        (name, client, next_url), = page_clients(['profile'])
+        self.assertEqual((name, client, next_url), ('profile', None, None))
+
+        User.objects.create_user('reader')
+        clients = list(page_clients(['top_five', 'profile']))
+        self.assertEqual([name for name, _, _ in clients], ['top_five', 'profile'])
+        for name, client, next_url in clients:
+            self.assertEqual(client.get(next_url()).status_code, 200)
+
+    def test_compare_reports_regressions(self):
+        baseline = {'client': {'index': {'p95': 10.0, 'queries': {'max': 3}}}}
+        current = {'client': {'index': {'p95': 11.0, 'queries': {'max': 3}}}}
+        self.assertEqual(compare(baseline, current, threshold=0.2), [])
+
+        current['client']['index'] = {'p95': 13.0, 'queries': {'max': 4}}
+        self.assertEqual(len(compare(baseline, current, threshold=0.2)), 2)
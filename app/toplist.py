@@ -0,0 +1,93 @@
+"""
+Топ фильмов.
+
+Флаг Movie.is_top меняется только условным UPDATE одной инструкцией:
+    UPDATE app_movie SET is_top = 1
+    WHERE id = %s AND NOT is_top AND (SELECT COUNT(*) FROM app_movie WHERE is_top) < TOP_LIMIT
+Проверка лимита и запись - одна инструкция, остальные колонки строки не переписываются.
+Двое менеджеров, одновременно добавляющих фильмы, не превысят TOP_LIMIT, потому что SQLite
+выполняет пишущие транзакции по одной. На серверной СБД (PostgreSQL, MySQL) подзапрос двух
+параллельных UPDATE может увидеть один и тот же счетчик, поэтому там add() сначала берет
+SELECT ... FOR UPDATE строки FacetCount(top) и сверяет лимит с ее счетчиком: вторая
+транзакция ждет коммита первой и видит уже увеличенное число.
+Админка меняет флаг тоже через add()/remove() (MovieAdmin.save_model).
+
+Список топа хранится в кэше и перестраивается сразу после каждого изменения,
+так что top_five и счетчик на главной читают его без запросов к БД.
+"""
+from django.db import connection, transaction
+from django.db.models import Count, Subquery
+from django.db.models.functions import Coalesce
+
+from . import caching, facets
+from .models import Movie
+
+TOP_LIMIT = 5
+
+# Модели, от которых зависит закэшированный список (название, год, постер, режиссер)
+DEPENDENCIES = ('movie', 'director')
+
+
+def _cache_key():
+    return caching.make_key('toplist', 'movies', DEPENDENCIES)
+
+
+def _queryset():
+    return Movie.objects.filter(is_top=True).select_related('director').order_by('-year', '-id')
+
+
+def _load():
+    return list(_queryset())
+
+
+async def _aload():
+    return [movie async for movie in _queryset()]
+
+
+def get_top_movies():
+    """Фильмы топа, отсортированные по году; при холодном кэше - один запрос."""
+    return caching.get_or_build(_cache_key(), _load)
+
+
+async def aget_top_movies():
+    return await caching.aget_or_build(_cache_key(), _aload)
+
+
+def refresh():
+    caching.get_cache().set(_cache_key(), _load(), None)
+
+
+def _changed():
+    # update() не отправляет post_save: версию кэша и список обновляем сами
+    caching.bump_version('movie')
+    transaction.on_commit(refresh)
+
+
+def add(movie_id):
+    """Добавляет фильм в топ; False, если фильм уже в топе или топ заполнен."""
+    # Пустой топ дает подзапросу ноль строк (NULL), отсюда Coalesce
+    top_count = Coalesce(Subquery(
+        Movie.objects.filter(is_top=True).order_by().values('is_top').annotate(total=Count('pk')).values('total')
+    ), 0)
+    with transaction.atomic():
+        if connection.features.has_select_for_update and facets.lock_count('top', facets.TOP_VALUE) >= TOP_LIMIT:
+            return False
+        updated = (
+            Movie.objects.filter(pk=movie_id, is_top=False)
+            .alias(top_count=top_count)
+            .filter(top_count__lt=TOP_LIMIT)
+            .update(is_top=True)
+        )
+        if updated:
+            facets.movie_changed(movie_id, [], [('top', facets.TOP_VALUE)])
+            _changed()
+    return bool(updated)
+
+
+def remove(movie_id):
+    """Убирает фильм из топа; False, если его там не было."""
+    updated = Movie.objects.filter(pk=movie_id, is_top=True).update(is_top=False)
+    if updated:
+        facets.movie_changed(movie_id, [('top', facets.TOP_VALUE)], [])
+        _changed()
+    return bool(updated)
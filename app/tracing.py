@@ -0,0 +1,305 @@
+"""
+Трассировка запросов и метрики.
+
+TracingMiddleware измеряет каждый запрос. Для всех запросов в гистограмму view
+попадает полное время ответа. Для доли TRACING_SAMPLE_RATE запросов (выборка)
+время раскладывается по фазам:
+    view           - от вызова view до ответа;
+    db             - SQL (execute_wrapper на каждом соединении, в том числе в потоках
+                     async ORM);
+    template       - рендеринг шаблонов (бэкенд DjangoTemplates из этого модуля);
+    email_enqueue  - постановка письма в очередь (app/outbox.py);
+а также считаются запросы к БД и попадания и промахи кэша каталога (app/caching.py).
+Запись выборки уходит в логгер app.tracing одной JSON-строкой (JSONFormatter).
+
+Вне выборки span() и count() ничего не делают, поэтому трассировку можно держать
+включенной в продакшене. Метрики хранятся в памяти процесса и отдаются в текстовом
+формате Prometheus на /metrics/ при TRACING_METRICS_ENABLED; у каждого воркера свои.
+"""
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'movie_catalog'
+
+# Трасса текущего запроса; None - запрос вне выборки
+_current = ContextVar('trace', default=None)
+
+
+class Trace:
+    __slots__ = ('timings', 'counts', 'view_start', '_active')
+
+    def __init__(self):
+        self.timings = defaultdict(float)  # фаза -> секунды
+        self.counts = Counter()
+        self.view_start = None
+        self._active = set()
+
+
+@contextmanager
+def span(name):
+    """Засчитывает время блока в фазу name; вложенные блоки той же фазы не считаются дважды."""
+    trace = _current.get()
+    if trace is None or name in trace._active:
+        yield
+        return
+    trace._active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.timings[name] += time.perf_counter() - start
+        trace._active.discard(name)
+
+
+def count(name, amount=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.counts[name] += amount
+
+
+# ВРЕМЯ SQL
+
+def _db_wrapper(execute, sql, params, many, context):
+    trace = _current.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.timings['db'] += time.perf_counter() - start
+        trace.counts['queries'] += 1
+
+
+def _connection_created(sender, connection, **kwargs):
+    # В начало списка: connection.execute_wrapper() снимает свою обертку с конца
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _db_wrapper)
+
+
+def install():
+    if settings.TRACING_ENABLED:
+        connection_created.connect(_connection_created, dispatch_uid='app.tracing')
+
+
+# ВРЕМЯ РЕНДЕРИНГА ШАБЛОНОВ
+
+class _TracedTemplate:
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with span('template'):
+            return self._template.render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Стандартный бэкенд шаблонов, засчитывающий рендеринг в фазу template."""
+
+    def from_string(self, template_code):
+        return _TracedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TracedTemplate(super().get_template(template_name))
+
+
+# МЕТРИКИ
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def _labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(dict)  # имя -> {метки: Histogram}
+        self._counters = defaultdict(Counter)  # имя -> {метки: значение}
+        self._help = {}
+
+    def observe(self, name, help_text, labels, value):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms[name].get(labels)
+            if histogram is None:
+                histogram = self._histograms[name][labels] = Histogram(settings.TRACING_HISTOGRAM_BUCKETS)
+                self._help[name] = help_text
+            histogram.observe(value)
+
+    def inc(self, name, help_text, labels, amount=1):
+        with self._lock:
+            self._counters[name][tuple(sorted(labels.items()))] += amount
+            self._help[name] = help_text
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Текстовый формат Prometheus 0.0.4."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                full_name = f'{METRICS_PREFIX}_{name}'
+                lines += [f'# HELP {full_name} {self._help[name]}', f'# TYPE {full_name} histogram']
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{full_name}_bucket{{{_labels((*labels, ("le", bound)))}}} {cumulative}')
+                    lines.append(f'{full_name}_sum{{{_labels(labels)}}} {histogram.sum:.6f}')
+                    lines.append(f'{full_name}_count{{{_labels(labels)}}} {cumulative}')
+            for name, series in sorted(self._counters.items()):
+                full_name = f'{METRICS_PREFIX}_{name}'
+                lines += [f'# HELP {full_name} {self._help[name]}', f'# TYPE {full_name} counter']
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{full_name}{{{_labels(labels)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def metrics_view(request):
+    if not settings.TRACING_METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# MIDDLEWARE
+
+class TracingMiddleware:
+    """Время запросов по view и разбивка по фазам для выборки запросов (см. модуль)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.TRACING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, trace, start)
+        return response
+
+    async def __acall__(self, request):
+        trace, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, trace, start)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_name = getattr(request.resolver_match, 'view_name', None) or view_func.__name__
+        trace = _current.get()
+        if trace is not None:
+            trace.view_start = time.perf_counter()
+
+    def _start(self):
+        sampled = random.random() < settings.TRACING_SAMPLE_RATE
+        trace = Trace() if sampled else None
+        return trace, _current.set(trace), time.perf_counter()
+
+    def _finish(self, request, response, trace, start):
+        end = time.perf_counter()
+        view = getattr(request, 'view_name', None) or 'unmatched'
+        metrics.observe(
+            'request_duration_seconds', 'Время ответа по view', {'view': view}, end - start,
+        )
+        if trace is None:
+            return
+
+        timings = dict(trace.timings)
+        if trace.view_start is not None:
+            timings['view'] = end - trace.view_start
+        for phase, seconds in timings.items():
+            metrics.observe(
+                'request_phase_seconds', 'Время фаз запроса по view (выборка)',
+                {'view': view, 'phase': phase}, seconds,
+            )
+        for name in ('cache_hit', 'cache_miss'):
+            if trace.counts[name]:
+                metrics.inc(
+                    'cache_requests_total', 'Обращения к кэшу каталога (выборка)',
+                    {'result': name.removeprefix('cache_')}, trace.counts[name],
+                )
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'total_ms': round((end - start) * 1000, 2),
+            **{f'{phase}_ms': round(seconds * 1000, 2) for phase, seconds in timings.items()},
+            'queries': trace.counts['queries'],
+            **trace.counts,
+        }
+        logger.info(
+            'view=%s status=%s total_ms=%.2f', view, response.status_code, record['total_ms'],
+            extra={'trace': record},
+        )
+
+
+# ЛОГИ В JSON
+
+# Атрибуты, которые есть у любой записи лога; остальные пришли через extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
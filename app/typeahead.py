@@ -0,0 +1,272 @@
+"""
+Подсказки поиска (typeahead): названия фильмов, имена актеров и режиссеров.
+
+Индекс в памяти процесса - отсортированный список (слово, тип, id) для всех слов
+каждого названия. Префикс ищется двоичным поиском (bisect), кандидаты ранжируются
+по популярности: фильмы - по числу отзывов, затем по средней оценке; актеры и
+режиссеры - по числу фильмов. Запрос к подсказкам не обращается к БД.
+
+Индекс строится при старте воркера (app/startup.py) или лениво
+при первом запросе и дальше обновляется сигналами этого процесса после коммита,
+как битовые карты фасетов. Популярность актеров и режиссеров приходит из счетчиков
+фасетов (сигнал facets.facet_counts_changed), массовые операции сбрасывают индекс.
+Изменения из других процессов и команд manage.py индекс подхватывает, как фасеты:
+по метке поколения в общем кэше, перестроением в фоне не чаще раза в TYPEAHEAD_INDEX_TTL секунд.
+Изменение популярности фильма метку не сдвигает: оно влияет только на порядок подсказок.
+"""
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+
+from . import caching
+from .models import Actor, Director, Movie
+
+logger = logging.getLogger(__name__)
+
+# Порядок групп в ответе
+KINDS = ('movie', 'director', 'actor')
+
+_WORD = re.compile(r'\w+')
+
+# Метка последнего изменения индекса: по ней процессы замечают чужие изменения
+_GENERATION_KEY = 'typeahead:generation'
+
+
+def normalize(text):
+    """Слова текста в нижнем регистре (ё = е)."""
+    return _WORD.findall(text.lower().replace('ё', 'е'))
+
+
+class _Entry:
+    __slots__ = ('name', 'words', 'count', 'total')
+
+    def __init__(self, name, count=0, total=0):
+        self.name = name
+        self.words = tuple(normalize(name))
+        # Фильм: число отзывов и сумма оценок; актер и режиссер: число фильмов
+        self.count = count
+        self.total = total
+
+    def popularity(self):
+        return self.count, self.total / self.count if self.count else 0
+
+
+class PrefixIndex:
+    def __init__(self, generation=None):
+        self._lock = threading.RLock()
+        self._keys = []      # отсортированные (слово, тип, id)
+        self._entries = {}   # (тип, id) -> _Entry
+        self.generation = generation
+        self.built_at = time.monotonic()
+
+    def build(self):
+        entries = {}
+        rows = Movie.objects.order_by().values_list('pk', 'title', 'rating_count', 'rating_sum')
+        for pk, title, rating_count, rating_sum in rows.iterator(chunk_size=10000):
+            entries[('movie', pk)] = _Entry(title, rating_count, rating_sum)
+        for kind, model in (('director', Director), ('actor', Actor)):
+            rows = model.objects.order_by().annotate(movies=Count('movie')).values_list('pk', 'name', 'movies')
+            for pk, name, movies in rows.iterator(chunk_size=10000):
+                entries[(kind, pk)] = _Entry(name, movies)
+        keys = [(word, kind, pk) for (kind, pk), entry in entries.items() for word in set(entry.words)]
+        keys.sort()
+        with self._lock:
+            self._entries, self._keys = entries, keys
+
+    def _unlink(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        kind, pk = key
+        for word in set(entry.words):
+            position = bisect.bisect_left(self._keys, (word, kind, pk))
+            if position < len(self._keys) and self._keys[position] == (word, kind, pk):
+                del self._keys[position]
+        return entry
+
+    def put(self, kind, pk, name):
+        """Добавляет значение или меняет его название, сохраняя популярность."""
+        with self._lock:
+            old = self._unlink((kind, pk))
+            entry = _Entry(name)
+            if old is not None:
+                entry.count, entry.total = old.count, old.total
+            self._entries[(kind, pk)] = entry
+            for word in set(entry.words):
+                bisect.insort(self._keys, (word, kind, pk))
+
+    def remove(self, kind, pk):
+        with self._lock:
+            self._unlink((kind, pk))
+
+    def add_popularity(self, kind, pk, count_delta, total_delta=0):
+        with self._lock:
+            entry = self._entries.get((kind, pk))
+            if entry is not None:
+                entry.count += count_delta
+                entry.total += total_delta
+
+    def suggest(self, query, limit):
+        """До limit лучших совпадений каждого типа: {тип: [(id, название), ...]}."""
+        tokens = normalize(query)
+        if not tokens:
+            return {}
+        # Диапазон ищем по самому длинному слову запроса, остальные проверяем у кандидатов
+        probe = max(tokens, key=len)
+        others = [token for token in tokens if token is not probe]
+        candidates = {kind: [] for kind in KINDS}
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (probe,))
+            seen = set()
+            while position < len(self._keys) and self._keys[position][0].startswith(probe):
+                _, kind, pk = self._keys[position]
+                position += 1
+                if (kind, pk) in seen:
+                    continue
+                seen.add((kind, pk))
+                entry = self._entries[(kind, pk)]
+                if all(any(word.startswith(token) for word in entry.words) for token in others):
+                    candidates[kind].append((entry.popularity(), pk, entry.name))
+        return {
+            kind: [(pk, name) for _, pk, name in heapq.nlargest(limit, items, key=lambda item: (item[0], -item[1]))]
+            for kind, items in candidates.items() if items
+        }
+
+    def is_stale(self, generation):
+        # Как BitmapIndex.is_stale(): без общего кэша индекс живет не дольше TYPEAHEAD_INDEX_TTL
+        if generation == self.generation and caching.is_shared():
+            return False
+        return generation is None or time.monotonic() - self.built_at >= settings.TYPEAHEAD_INDEX_TTL
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuild_thread = None
+
+
+def _rebuild(stale):
+    """Как facets._rebuild(): новый индекс подменяет stale, если индекс процесса не сбросили."""
+    global _index
+    generation = caching.get_cache().get(_GENERATION_KEY)
+    built = PrefixIndex(generation)
+    built.build()
+    if caching.get_cache().get(_GENERATION_KEY) != generation:
+        # Изменения во время построения могли не попасть в индекс: следующий запрос перестроит его еще раз
+        built.built_at = float('-inf')
+    with _index_lock:
+        if _index is stale:
+            _index = built
+        return _index
+
+
+def _rebuild_in_thread(stale):
+    try:
+        _rebuild(stale)
+    except Exception:
+        logger.exception('Не удалось перестроить индекс подсказок')
+    finally:
+        connections.close_all()
+
+
+def get_index():
+    """Как facets.get_index(): устаревший индекс перестраивается в фоне, запросы читают прежний."""
+    global _index, _rebuild_thread
+    generation = caching.get_cache().get(_GENERATION_KEY)
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                built = PrefixIndex(generation)
+                built.build()
+                _index = built
+            return _index
+    if not index.is_stale(generation):
+        return index
+    if not settings.INDEX_REBUILD_IN_BACKGROUND:
+        return _rebuild(index)
+    with _index_lock:
+        if _index is index and (_rebuild_thread is None or not _rebuild_thread.is_alive()):
+            _rebuild_thread = threading.Thread(
+                target=_rebuild_in_thread, args=(index,), name='typeahead-rebuild', daemon=True,
+            )
+            _rebuild_thread.start()
+    return index
+
+
+def reset():
+    """Сбрасывает индекс после массовых изменений в обход сигналов (и в других процессах)."""
+    global _index
+    _index = None
+    transaction.on_commit(_changed)
+
+
+def _changed():
+    generation = time.time_ns()
+    caching.get_cache().set(_GENERATION_KEY, generation, None)
+    index = _index
+    if index is not None:
+        # Изменение этого процесса индекс применяет сам, перестраивать его не нужно
+        index.generation = generation
+
+
+def _after_commit(apply):
+    """Изменение попадает в индекс и метку поколения только после коммита: откат не оставит лишних подсказок."""
+    def callback():
+        index = _index
+        if index is not None:
+            apply(index)
+        _changed()
+    transaction.on_commit(callback)
+
+
+def suggest(query, limit=None):
+    query = query.strip()
+    if len(query) < settings.TYPEAHEAD_MIN_LENGTH:
+        return {}
+    return get_index().suggest(query, limit or settings.TYPEAHEAD_LIMIT)
+
+
+# ОБНОВЛЕНИЕ СИГНАЛАМИ
+
+def saved(kind, pk, name):
+    _after_commit(lambda index: index.put(kind, pk, name))
+
+
+def deleted(kind, pk):
+    _after_commit(lambda index: index.remove(kind, pk))
+
+
+def rating_changed(movie_id, sum_delta, count_delta):
+    # Популярность меняет только порядок подсказок: метку поколения не сдвигаем, иначе
+    # каждый отзыв заставлял бы другие процессы перестраивать индекс. Они получат новые
+    # счетчики при следующем перестроении
+    if not movie_id:
+        return
+
+    def callback():
+        index = _index
+        if index is not None:
+            index.add_popularity('movie', movie_id, count_delta, sum_delta)
+    transaction.on_commit(callback)
+
+
+def movie_counts_changed(deltas):
+    """Число фильмов актеров и режиссеров изменилось: {(фасет, значение): приращение}."""
+    changes = [
+        (facet, int(value), delta) for (facet, value), delta in deltas.items()
+        if facet in ('director', 'actor') and delta
+    ]
+    if not changes:
+        return
+
+    def apply(index):
+        for facet, pk, delta in changes:
+            index.add_popularity(facet, pk, delta)
+    _after_commit(apply)
@@ -1,11 +1,12 @@
 from django.urls import path
 from django.conf.urls.static import static
 from django.conf import settings
-from . import views
+from . import api, tracing, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('movie/<int:movie_id>/', views.movie_detail, name='movie_detail'),
+    path('movie/<int:movie_id>/reviews/', views.movie_reviews, name='movie_reviews'),
     path('top-five/', views.top_five, name='top_five'),
     path('directors/', views.directors_list, name='directors_list'),
     path('actors/', views.actors_list, name='actors_list'),
@@ -17,12 +18,26 @@ urlpatterns = [
     path('accounts/login/', views.login_view, name='login'),
     path('accounts/logout/', views.logout_view, name='logout'),
     path('accounts/profile/', views.profile_view, name='profile'),
+    path('accounts/profile/reviews/', views.my_reviews, name='my_reviews'),
 
     # Добавление контента (только для менеджеров)
     path('add/movie/', views.add_movie, name='add_movie'),
     path('add/director/', views.add_director, name='add_director'),
     path('add/actor/', views.add_actor, name='add_actor'),
 
+    # JSON API (только чтение)
+    path('api/v1/movies/', api.movie_list, name='api_movie_list'),
+    path('api/v1/movies/<int:movie_id>/', api.movie_detail, name='api_movie_detail'),
+    path('api/v1/actors/', api.actor_list, name='api_actor_list'),
+    path('api/v1/actors/<int:person_id>/', api.actor_detail, name='api_actor_detail'),
+    path('api/v1/directors/', api.director_list, name='api_director_list'),
+    path('api/v1/directors/<int:person_id>/', api.director_detail, name='api_director_detail'),
+    path('api/v1/reviews/', api.review_list, name='api_review_list'),
+    path('api/v1/reviews/<int:review_id>/', api.review_detail, name='api_review_detail'),
+    path('api/v1/suggest/', api.suggest, name='api_suggest'),
+
+    # Метрики для Prometheus (только при TRACING_METRICS_ENABLED)
+    path('metrics/', tracing.metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,123 +1,193 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Q
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
+from django.db.models import Count, Prefetch
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import login, authenticate, logout as auth_logout
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
-from .models import Movie, Actor, Director, Review
+from . import facets, ingest, outbox, search, toplist
+from .caching import arequest_user, cache_public_page
+from .pagination import apaginate_keyset, apaginate_ranked, paginate_keyset
+from .models import Movie, Actor, Director, Review, SimilarMovie
 from .forms import ReviewForm, MovieForm, DirectorForm, ActorForm, CustomUserCreationForm, CustomAuthenticationForm
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
+# Ключи сортировки списков; каждому соответствует составной индекс в Meta.indexes
+MOVIE_ORDERING = ('-year', '-id')
+PERSON_ORDERING = ('name', 'id')
+REVIEW_ORDERING = ('-created_at', '-id')
+
+# Сколько актеров показывать в карточке фильма
+CAST_PREVIEW_SIZE = 3
+
 
 # Проверка является ли пользователь менеджером/администратором
 def is_manager(user):
     return user.is_authenticated and user.is_staff
 
 
-# Главная страница - доступна всем
-def index(request):
-    movies = Movie.objects.all().order_by('-year')
+# Добавление в топ и удаление из топа (общий обработчик для главной и страницы фильма)
+def manage_top(request, movie_id, action):
+    if not is_manager(request.user):
+        messages.error(request, 'Только менеджеры могут управлять топом фильмов!')
+        return
+    movie = get_object_or_404(Movie.objects.only('title', 'is_top'), id=movie_id)
+    if action == 'add_to_top':
+        if toplist.add(movie.pk):
+            messages.success(request, f'"{movie.title}" добавлен в топ!')
+        elif not movie.is_top:
+            messages.error(request, f'В топе может быть не более {toplist.TOP_LIMIT} фильмов!')
+    elif toplist.remove(movie.pk):
+        messages.success(request, f'"{movie.title}" удален из топа!')
 
-    query = request.GET.get('q')
-    if query:
-        movies = movies.filter(
-            Q(title__icontains=query) |
-            Q(actors__name__icontains=query) |
-            Q(director__name__icontains=query)
-        ).distinct()
 
-    top_count = Movie.objects.filter(is_top=True).count()
+async def arender(request, template_name, context):
+    # Шаблоны читают request.user, сообщения из сессии и ленивые связи - это синхронный код
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def alist(queryset):
+    return [obj async for obj in queryset]
+
 
+# Главная страница - доступна всем
+def _index_post(request):
     # Управление топом - только для менеджеров
+    movie_id = request.POST.get('movie_id')
+    action = request.POST.get('action')
+    if movie_id and action in ('add_to_top', 'remove_from_top'):
+        manage_top(request, movie_id, action)
+        return redirect('index')
+    return None
+
+
+@cache_public_page(*facets.DEPENDENCIES)
+async def index(request):
     if request.method == 'POST':
-        movie_id = request.POST.get('movie_id')
-        action = request.POST.get('action')
-
-        if movie_id and action and is_manager(request.user):
-            movie = get_object_or_404(Movie, id=movie_id)
-
-            if action == 'add_to_top':
-                if top_count >= 5:
-                    messages.error(request, 'В топе может быть не более 5 фильмов!')
-                else:
-                    movie.is_top = True
-                    movie.save()
-                    messages.success(request, f'"{movie.title}" добавлен в топ!')
-            elif action == 'remove_from_top':
-                movie.is_top = False
-                movie.save()
-                messages.success(request, f'"{movie.title}" удален из топа!')
-            return redirect('index')
+        response = await sync_to_async(_index_post)(request)
+        if response is not None:
+            return response
 
+    query = request.GET.get('q')
+    filters = facets.parse_filters(request.GET)
+    queryset = facets.filter_queryset(Movie.objects.all(), filters)
+    search_ids = None
+    if query:
+        # Полнотекстовый индекс, результаты по релевантности
+        search_ids = await sync_to_async(search.search_movie_ids)(query)
+        # Фильтры применяются к списку id до нарезки на страницы, иначе страницы были бы неполными
+        ranked_ids = await sync_to_async(facets.filter_ids)(search_ids, filters)
+        page = apaginate_ranked(request, queryset, ranked_ids)
+    else:
+        page = apaginate_keyset(request, queryset, MOVIE_ORDERING)
+
+    # Страница фильмов, топ и счетчики фасетов друг от друга не зависят. gather() их не
+    # распараллеливает: асинхронный ORM и sync_to_async потокочувствительны (thread_sensitive=True),
+    # все три идут по очереди в одном потоке запроса (см. DEPLOYMENT.md, «Как устроены async view»)
+    movies, top_movies, facet_groups = await asyncio.gather(
+        page,
+        toplist.aget_top_movies(),
+        sync_to_async(facets.build_groups)(request.GET, filters, search_ids),
+    )
     context = {
         'movies': movies,
+        'page': movies,
         'query': query,
-        'top_count': top_count
+        'facet_groups': facet_groups,
+        'has_filters': bool(filters),
+        'top_count': len(top_movies),
+        'top_limit': toplist.TOP_LIMIT,
     }
-    return render(request, 'index.html', context)
+    return await arender(request, 'index.html', context)
 
 
 # Детальная страница фильма - доступна всем
-def movie_detail(request, movie_id):
-    movie = get_object_or_404(Movie, id=movie_id)
-    reviews = movie.reviews.filter(is_active=True).order_by('-created_at')
+def _movie_detail_post(request, movie):
+    """Управление топом и отзыв: (редирект или None, форма отзыва для страницы)."""
     form = ReviewForm() if request.user.is_authenticated else None
 
-    if request.method == 'POST':
-        # Управление топом - только для менеджеров
-        action = request.POST.get('action')
-
-        if action in ['add_to_top', 'remove_from_top']:
-            if is_manager(request.user):
-                if action == 'add_to_top':
-                    top_count = Movie.objects.filter(is_top=True).count()
-                    if top_count >= 5:
-                        messages.error(request, 'В топе может быть не более 5 фильмов!')
-                    else:
-                        movie.is_top = True
-                        movie.save()
-                        messages.success(request, f'"{movie.title}" добавлен в топ!')
-                elif action == 'remove_from_top':
-                    movie.is_top = False
-                    movie.save()
-                    messages.success(request, f'"{movie.title}" удален из топа!')
-            else:
-                messages.error(request, 'Только менеджеры могут управлять топом фильмов!')
-
-            return redirect('movie_detail', movie_id=movie_id)
-
-        # Добавление отзыва - только для зарегистрированных пользователей
-        elif 'review_submit' in request.POST:
-            if request.user.is_authenticated:
-                form = ReviewForm(request.POST)
-                if form.is_valid():
-                    review = form.save(commit=False)
-                    review.movie = movie
-                    review.author_name = request.user.username
-                    review.save()
-                    messages.success(request, 'Ваш отзыв успешно добавлен!')
-                    return redirect('movie_detail', movie_id=movie_id)
-                else:
-                    for field, errors in form.errors.items():
-                        for error in errors:
-                            messages.error(request, f'{field}: {error}')
+    # Управление топом - только для менеджеров
+    action = request.POST.get('action')
+
+    if action in ('add_to_top', 'remove_from_top'):
+        manage_top(request, movie.pk, action)
+        return redirect('movie_detail', movie_id=movie.pk), form
+
+    # Добавление отзыва - только для зарегистрированных пользователей
+    if 'review_submit' in request.POST:
+        if request.user.is_authenticated:
+            form = ReviewForm(request.POST)
+            if form.is_valid():
+                retry_after = ingest.check_rate_limit(request)
+                if retry_after:
+                    messages.error(request, f'Слишком много отзывов. Попробуйте снова через {retry_after} с.')
+                    return redirect('movie_detail', movie_id=movie.pk), form
+                review = form.save(commit=False)
+                review.movie = movie
+                review.user = request.user
+                review.author_name = request.user.username
+                ingest.submit(review)
+                messages.success(request, 'Ваш отзыв успешно добавлен!')
+                return redirect('movie_detail', movie_id=movie.pk), form
             else:
-                messages.error(request, 'Для добавления отзыва необходимо войти в систему!')
-                return redirect('movie_detail', movie_id=movie_id)
+                for field, errors in form.errors.items():
+                    for error in errors:
+                        messages.error(request, f'{field}: {error}')
+        else:
+            messages.error(request, 'Для добавления отзыва необходимо войти в систему!')
+            return redirect('movie_detail', movie_id=movie.pk), form
+    return None, form
+
+
+async def movie_detail(request, movie_id):
+    movie = await aget_object_or_404(Movie.objects.select_related('director'), id=movie_id)
 
+    if request.method == 'POST':
+        response, form = await sync_to_async(_movie_detail_post)(request, movie)
+        if response is not None:
+            return response
+    else:
+        user = await arequest_user(request)
+        form = ReviewForm() if user.is_authenticated else None
+
+    # Как на главной: запросы независимы, но выполняются по очереди в потоке запроса
+    reviews, similar_movies = await asyncio.gather(
+        # Первая порция отзывов встраивается в страницу, остальные подгружает movie_reviews
+        apaginate_keyset(
+            request, movie.reviews.filter(is_active=True), REVIEW_ORDERING, page_size=settings.REVIEWS_PAGE_SIZE,
+        ),
+        # Предрасчитанные соседи: один запрос по индексу (movie, rank)
+        alist(SimilarMovie.objects.filter(movie=movie).select_related('similar').order_by('rank')),
+    )
     context = {
         'movie': movie,
         'reviews': reviews,
         'form': form,
         'average_rating': movie.average_rating(),
-        'reviews_count': reviews.count(),
+        # Число активных отзывов хранится в агрегате фильма
+        'reviews_count': movie.rating_count,
+        'similar_movies': similar_movies,
     }
-    return render(request, 'movie_detail.html', context)
+    return await arender(request, 'movie_detail.html', context)
+
+
+# Следующая порция отзывов фильма (HTML-фрагмент для подгрузки на странице фильма)
+@cache_public_page('review')
+async def movie_reviews(request, movie_id):
+    reviews = await apaginate_keyset(
+        request, Review.objects.filter(movie_id=movie_id, is_active=True), REVIEW_ORDERING,
+        page_size=settings.REVIEWS_PAGE_SIZE,
+    )
+    return await arender(request, 'reviews_chunk.html', {'reviews': reviews, 'movie_id': movie_id})
 
 
 # ФУНКЦИИ ДОБАВЛЕНИЯ КОНТЕНТА (ТОЛЬКО ДЛЯ МЕНЕДЖЕРОВ)
@@ -188,13 +258,7 @@ def register_view(request):
             # Сохраняем пользователя
             user = form.save()
 
-            # Отправляем email СРАЗУ ЖЕ в этом же процессе
-            print("\n" + "=" * 50)
-            print("РЕГИСТРАЦИЯ: Пытаюсь отправить welcome email")
-            print(f"Пользователь: {user.username}")
-            print(f"Email: {user.email}")
-            print("=" * 50 + "\n")
-
+            # Ставим welcome email в очередь, отправит фоновый обработчик (app/outbox.py)
             try:
                 subject = f'Добро пожаловать в {settings.SITE_NAME}!'
 
@@ -210,34 +274,30 @@ def register_view(request):
                 html_message = render_to_string('emails/welcome_email.html', context)
                 plain_message = strip_tags(html_message)
 
-                # Показываем в консоли что отправляем
-                print(f"Отправляю письмо с темой: {subject}")
-                print(f"От: {settings.DEFAULT_FROM_EMAIL}")
-                print(f"Кому: {user.email}")
-                print(f"Бэкенд email: {settings.EMAIL_BACKEND}")
-
-                send_mail(
+                email = outbox.enqueue(
                     subject,
                     plain_message,
                     settings.DEFAULT_FROM_EMAIL,
                     [user.email],
                     html_message=html_message,
-                    fail_silently=False,
+                )
+                logger.info(
+                    'Приветственное письмо #%s для пользователя %s поставлено в очередь', email.pk, user.pk,
+                    extra={'email_id': email.pk, 'user_id': user.pk},
                 )
 
-                print(" Письмо отправлено успешно!")
-
-            except Exception as e:
-                print(f"Ошибка при отправке письма: {e}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                logger.exception(
+                    'Не удалось поставить приветственное письмо в очередь для пользователя %s', user.pk,
+                    extra={'user_id': user.pk},
+                )
 
             # Автоматический вход после регистрации (УКАЗЫВАЕМ БЭКЕНД)
             login(request, user, backend='django.contrib.auth.backends.ModelBackend')
 
             messages.success(request,
                              f'Регистрация успешна! Добро пожаловать, {user.username}! '
-                             f'На ваш email ({user.email}) отправлено приветственное письмо.'
+                             f'Приветственное письмо поставлено в очередь и скоро придет на ваш email ({user.email}).'
                              )
             return redirect('index')
         else:
@@ -286,7 +346,7 @@ def logout_view(request):
 def profile_view(request):
     user = request.user
     user_movies = Movie.objects.all().count()  # Просто общее количество для демонстрации
-    user_reviews = Review.objects.filter(author_name=user.username).count()
+    user_reviews = user.reviews.count()
 
     context = {
         'user': user,
@@ -296,46 +356,77 @@ def profile_view(request):
     return render(request, 'profile.html', context)
 
 
+@login_required
+def my_reviews(request):
+    reviews = paginate_keyset(
+        request, request.user.reviews.select_related('movie'), REVIEW_ORDERING,
+    )
+    return render(request, 'my_reviews.html', {'reviews': reviews, 'page': reviews})
 
-def top_five(request):
-    top_movies = Movie.objects.filter(is_top=True).order_by('-year')
+
+
+@cache_public_page('movie', 'director')
+async def top_five(request):
     context = {
-        'top_movies': top_movies
+        'top_movies': await toplist.aget_top_movies(),
+        'top_limit': toplist.TOP_LIMIT,
     }
-    return render(request, 'top_five.html', context)
+    return await arender(request, 'top_five.html', context)
 
 
-def directors_list(request):
-    directors = Director.objects.all().order_by('name')
+@cache_public_page('director', 'movie')
+async def directors_list(request):
+    directors = await apaginate_keyset(
+        request, Director.objects.annotate(movie_count=Count('movie')), PERSON_ORDERING,
+    )
     context = {
-        'directors': directors
+        'directors': directors,
+        'page': directors,
     }
-    return render(request, 'directors_list.html', context)
+    return await arender(request, 'directors_list.html', context)
 
 
-def actors_list(request):
-    actors = Actor.objects.all().order_by('name')
+@cache_public_page('actor', 'movie')
+async def actors_list(request):
+    actors = await apaginate_keyset(request, Actor.objects.annotate(movie_count=Count('movie')), PERSON_ORDERING)
     context = {
-        'actors': actors
+        'actors': actors,
+        'page': actors,
     }
-    return render(request, 'actors_list.html', context)
+    return await arender(request, 'actors_list.html', context)
 
 
-def actor_detail(request, actor_id):
-    actor = get_object_or_404(Actor, id=actor_id)
-    movies = Movie.objects.filter(actors=actor).order_by('-year')
+@cache_public_page('actor', 'movie', 'director')
+async def actor_detail(request, actor_id):
+    # Два запроса по очереди в потоке запроса (асинхронный ORM потокочувствителен)
+    actor, movies = await asyncio.gather(
+        aget_object_or_404(Actor, id=actor_id),
+        alist(Movie.objects.filter(actors=actor_id).select_related('director').order_by('-year')),
+    )
     context = {
         'actor': actor,
         'movies': movies
     }
-    return render(request, 'actor_detail.html', context)
-
-
-def director_detail(request, director_id):
-    director = get_object_or_404(Director, id=director_id)
-    movies = Movie.objects.filter(director=director).order_by('-year')
+    return await arender(request, 'actor_detail.html', context)
+
+
+@cache_public_page('director', 'movie', 'actor')
+async def director_detail(request, director_id):
+    # Первые актеры каждого фильма одним запросом (оконная функция внутри Prefetch)
+    movies = (
+        Movie.objects.filter(director=director_id)
+        .annotate(actor_count=Count('actors'))
+        .prefetch_related(Prefetch(
+            'actors',
+            queryset=Actor.objects.order_by('name', 'id')[:CAST_PREVIEW_SIZE],
+            to_attr='cast_preview',
+        ))
+        .order_by('-year')
+    )
+    # Два запроса по очереди в потоке запроса (асинхронный ORM потокочувствителен)
+    director, movies = await asyncio.gather(aget_object_or_404(Director, id=director_id), alist(movies))
     context = {
         'director': director,
         'movies': movies
     }
-    return render(request, 'director_detail.html', context)
\ No newline at end of file
+    return await arender(request, 'director_detail.html', context)
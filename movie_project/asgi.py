@@ -14,3 +14,13 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movie_project.settings')
 
 application = get_asgi_application()
+
+# Собранная статика (manage.py build_static) отдается до Django: сжатые копии и долгий Cache-Control
+from app.assets import ASGIStaticFilesMiddleware  # noqa: E402
+
+application = ASGIStaticFilesMiddleware(application)
+
+# Воркер готовит соединения, шаблоны и индексы до первого запроса (app/startup.py)
+from app import startup  # noqa: E402
+
+startup.warm_up_on_start()
@@ -47,7 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.tracing.TracingMiddleware',  # первым: время ответа включает остальные middleware
     'django.middleware.security.SecurityMiddleware',
+    'app.middleware.QueryProfilerMiddleware',  # работает только при QUERY_PROFILER_ENABLED
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -59,12 +61,23 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'movie_project.urls'
 
 # НАСТРОЙКИ ШАБЛОНОВ
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+# Кэш разобранных шаблонов в памяти процесса (app/rendering.py); под runserver сбрасывается при правке шаблона
+TEMPLATE_CACHE = config('TEMPLATE_CACHE', default=True, cast=bool)
+# Разбирать все шаблоны templates/ при старте воркера
+TEMPLATE_PRECOMPILE = config('TEMPLATE_PRECOMPILE', default=True, cast=bool)
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Стандартный DjangoTemplates, засчитывающий время рендеринга в трассировку
+        'BACKEND': 'app.tracing.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+            if TEMPLATE_CACHE else TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -81,11 +94,45 @@ WSGI_APPLICATION = 'movie_project.wsgi.application'
 # НАСТРОЙКИ БАЗЫ ДАННЫХ
 DB_ENGINE = config('DB_ENGINE', default='django.db.backends.sqlite3')
 
+# Постоянные соединения: секунды жизни соединения между запросами (0 - закрывать после каждого запроса)
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+# Проверять соединение перед повторным использованием (после рестарта БД, обрыва сети)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+
+# Профиль SQLite: performance - PRAGMA ниже выполняются при открытии каждого соединения,
+# default - настройки SQLite по умолчанию (журнал отката, транзакции DEFERRED)
+SQLITE_PROFILE = config('SQLITE_PROFILE', default='performance')
+SQLITE_PRAGMAS = {
+    # Читатели не блокируются писателем, запись - последовательная в журнал
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='WAL'),
+    # В режиме WAL NORMAL не теряет целостность, fsync только на контрольных точках
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    # Отображение файла БД в память, байты
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    # Кэш страниц на соединение: отрицательное значение - в КиБ
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-64 * 1024, cast=int),
+    # Сколько миллисекунд ждать блокировку, прежде чем вернуть «database is locked»
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+    'temp_store': 'MEMORY',
+}
+# IMMEDIATE берет блокировку записи в начале транзакции: нет взаимоблокировки
+# при повышении уровня блокировки, busy_timeout работает для писателей
+SQLITE_TRANSACTION_MODE = config('SQLITE_TRANSACTION_MODE', default='IMMEDIATE')
+# OPTIONS бэкенда sqlite3 профиля performance: init_command выполняется при открытии соединения
+SQLITE_PERFORMANCE_OPTIONS = {
+    'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+    'transaction_mode': SQLITE_TRANSACTION_MODE,
+}
+
+
 if DB_ENGINE == 'django.db.backends.sqlite3':
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / config('DB_NAME', default='db.sqlite3'),
+            'OPTIONS': SQLITE_PERFORMANCE_OPTIONS if SQLITE_PROFILE == 'performance' else {},
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
         }
     }
 else:
@@ -97,6 +144,8 @@ else:
             'PASSWORD': config('DB_PASSWORD', default=''),
             'HOST': config('DB_HOST', default=''),
             'PORT': config('DB_PORT', default=''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
         }
     }
 
@@ -127,6 +176,24 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Сборка статики (app/assets.py, manage.py build_static): хэши в именах, бандлы CSS, копии .gz/.br
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'app.assets.StaticFilesStorage'},
+}
+# Ссылка на файл, которого нет в манифесте сборки, - ошибка. Без строгой проверки (по умолчанию
+# в DEBUG, в тестах - app/test_runner.py) статика может быть не собрана, файлы идут под исходными именами
+STATIC_MANIFEST_STRICT = config('STATIC_MANIFEST_STRICT', default=not DEBUG, cast=bool)
+# Бандл -> исходные файлы. Бандл лежит в каталоге исходников: относительные url() не переписываются
+STATIC_BUNDLES = {
+    'css/site.css': ['css/style.css'],
+}
+# Раздавать STATIC_ROOT из обертки WSGI/ASGI-приложения (без отдельного веб-сервера для статики)
+STATIC_SERVE = config('STATIC_SERVE', default=True, cast=bool)
+# Cache-Control для файлов с хэшем в имени и для остальных, секунды
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STATIC_MAX_AGE = config('STATIC_MAX_AGE', default=60, cast=int)
+
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
@@ -148,6 +215,19 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL',
                            default='noreply@moviecatalog.com')
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=30, cast=int)
+
+# ОЧЕРЕДЬ ПИСЕМ (app/outbox.py)
+# thread - отправка фоновым потоком после коммита; external - только manage.py send_queued_mail --loop
+EMAIL_OUTBOX_WORKER = config('EMAIL_OUTBOX_WORKER', default='thread')
+EMAIL_OUTBOX_THREADS = config('EMAIL_OUTBOX_THREADS', default=1, cast=int)
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=50, cast=int)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+# Задержка перед повтором удваивается с каждой попыткой, секунды
+EMAIL_OUTBOX_RETRY_DELAY = config('EMAIL_OUTBOX_RETRY_DELAY', default=60, cast=int)
+EMAIL_OUTBOX_MAX_RETRY_DELAY = config('EMAIL_OUTBOX_MAX_RETRY_DELAY', default=3600, cast=int)
+# Через сколько секунд письмо, захваченное упавшим обработчиком, вернется в очередь
+EMAIL_OUTBOX_LOCK_TIMEOUT = config('EMAIL_OUTBOX_LOCK_TIMEOUT', default=300, cast=int)
 
 # БЕЗОПАСНОСТЬ
 CSRF_TRUSTED_ORIGINS = config('CSRF_TRUSTED_ORIGINS',
@@ -159,8 +239,125 @@ SITE_NAME = config('SITE_NAME', default='MovieCatalog')
 SITE_DOMAIN = config('SITE_DOMAIN', default='localhost:8000')
 ADMIN_EMAIL = config('ADMIN_EMAIL', default='admin@moviecatalog.com')
 
+# КЭШ
+# file - каталог CACHE_LOCATION, redis - сервер по адресу CACHE_LOCATION (оба общие для процессов),
+# locmem - LRU в памяти процесса: только для одного процесса, версии каталога другим воркерам не видны
+CACHE_BACKEND = config('CACHE_BACKEND', default='file')
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_LOCATIONS = {
+    'locmem': 'movie-catalog',
+    'file': str(BASE_DIR / 'cache'),
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_LOCATIONS[CACHE_BACKEND]),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=5000, cast=int)}
+        if CACHE_BACKEND != 'redis' else {},
+    }
+}
+# manage.py test подменяет CACHES временным файловым кэшем (app/test_runner.py)
+TEST_RUNNER = 'app.test_runner.CatalogTestRunner'
+
+# Кэш страниц и фрагментов каталога (app/caching.py)
+CATALOG_CACHE_ENABLED = config('CATALOG_CACHE_ENABLED', default=True, cast=bool)
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=600, cast=int)
+# Сколько секунд помнить, что страницу кэшировать нельзя (ответ с cookie, не 200)
+CATALOG_CACHE_NONE_TIMEOUT = config('CATALOG_CACHE_NONE_TIMEOUT', default=30, cast=int)
+# Сколько секунд ключ может пересчитываться, пока остальные ждут результат
+CATALOG_CACHE_LOCK_TIMEOUT = config('CATALOG_CACHE_LOCK_TIMEOUT', default=10, cast=int)
+
+# ВЕРСИИ ИЗОБРАЖЕНИЙ (app/images.py): имя -> максимальные ширина и высота
+IMAGE_RENDITIONS = {
+    'grid': (300, 450),
+    'detail': (600, 900),
+}
+IMAGE_RENDITION_QUALITY = config('IMAGE_RENDITION_QUALITY', default=82, cast=int)
+# Потоки для построения версий после загрузки
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+
+# ПАГИНАЦИЯ СПИСКОВ (?per_page= ограничен MAX_PAGE_SIZE)
+PAGE_SIZE = config('PAGE_SIZE', default=24, cast=int)
+MAX_PAGE_SIZE = config('MAX_PAGE_SIZE', default=100, cast=int)
+# Отзывов в одной порции на странице фильма
+REVIEWS_PAGE_SIZE = config('REVIEWS_PAGE_SIZE', default=10, cast=int)
+
+# ПРИЕМ ОТЗЫВОВ (app/ingest.py)
+# Не больше стольких отзывов от пользователя и с одного адреса за REVIEW_RATE_WINDOW секунд
+REVIEW_RATE_USER_LIMIT = config('REVIEW_RATE_USER_LIMIT', default=5, cast=int)
+REVIEW_RATE_IP_LIMIT = config('REVIEW_RATE_IP_LIMIT', default=30, cast=int)
+REVIEW_RATE_WINDOW = config('REVIEW_RATE_WINDOW', default=60, cast=int)
+# Наибольшая пачка отзывов в одном bulk_create
+REVIEW_BATCH_SIZE = config('REVIEW_BATCH_SIZE', default=500, cast=int)
+# Счетчики лимитов (app/ratelimit.py) и заголовок с адресом клиента за прокси, например HTTP_X_REAL_IP
+RATELIMIT_CACHE_ALIAS = 'default'
+RATELIMIT_IP_HEADER = config('RATELIMIT_IP_HEADER', default='REMOTE_ADDR')
+
+# ПРОФИЛИРОВАНИЕ ЗАПРОСОВ К БД
+# Server-Timing и лог app.queries: число запросов, время SQL, самые медленные и повторяющиеся запросы
+QUERY_PROFILER_ENABLED = config('QUERY_PROFILER_ENABLED', default=False, cast=bool)
+# Лимит запросов на один HTTP-запрос (None - без лимита); при QUERY_BUDGET_RAISE превышение - исключение
+QUERY_BUDGET = config('QUERY_BUDGET', default=None, cast=int)
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=DEBUG, cast=bool)
+QUERY_PROFILER_SLOWEST = config('QUERY_PROFILER_SLOWEST', default=3, cast=int)
+QUERY_PROFILER_DUPLICATE_THRESHOLD = config('QUERY_PROFILER_DUPLICATE_THRESHOLD', default=3, cast=int)
+
+# ПОИСК
+# auto - FTS5 на SQLite, иначе индекс в памяти процесса; fts5 / memory - принудительно
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='auto')
+SEARCH_RESULTS_LIMIT = config('SEARCH_RESULTS_LIMIT', default=500, cast=int)
+# Подсказки поиска (app/typeahead.py): минимальная длина запроса и число вариантов каждого типа
+TYPEAHEAD_MIN_LENGTH = config('TYPEAHEAD_MIN_LENGTH', default=2, cast=int)
+TYPEAHEAD_LIMIT = config('TYPEAHEAD_LIMIT', default=5, cast=int)
+# Не чаще чем раз в столько секунд процесс перестраивает индекс после изменений других процессов
+TYPEAHEAD_INDEX_TTL = config('TYPEAHEAD_INDEX_TTL', default=300, cast=int)
+
+# ПОХОЖИЕ ФИЛЬМЫ
+# Соседей на фильм и веса мер сходства (общие актеры, режиссер, оценки зрителей)
+RECOMMENDATIONS_K = config('RECOMMENDATIONS_K', default=6, cast=int)
+RECOMMENDATION_WEIGHTS = {'actors': 0.5, 'director': 0.2, 'ratings': 0.3}
+# Пересчитывать соседей фильма в фоне после новых отзывов (в тестах выключено, см. app/test_runner.py)
+RECOMMENDATIONS_INCREMENTAL = config('RECOMMENDATIONS_INCREMENTAL', default=True, cast=bool)
+# Задержка пересчета, сек: отзывы к фильму за это время склеиваются в один пересчет
+RECOMMENDATIONS_UPDATE_DELAY = config('RECOMMENDATIONS_UPDATE_DELAY', default=30, cast=float)
+# Кандидатов в соседи на каждую меру при инкрементальном пересчете
+RECOMMENDATIONS_NEIGHBOURHOOD_LIMIT = config('RECOMMENDATIONS_NEIGHBOURHOOD_LIMIT', default=500, cast=int)
+
+# ФАСЕТЫ (app/facets.py)
+# Сколько самых частых режиссеров и актеров показывать в фильтрах
+FACET_VALUES_SHOWN = config('FACET_VALUES_SHOWN', default=10, cast=int)
+# Сколько битовых карт режиссеров и актеров держать в памяти процесса
+FACET_BITMAP_CACHE_SIZE = config('FACET_BITMAP_CACHE_SIZE', default=64, cast=int)
+# Не чаще чем раз в столько секунд процесс сверяет свой индекс с изменениями других процессов
+FACET_INDEX_TTL = config('FACET_INDEX_TTL', default=300, cast=int)
+# Устаревшие индексы фасетов и подсказок перестраиваются в фоновом потоке, запросы тем временем
+# читают прежние (в тестах выключено, см. app/test_runner.py)
+INDEX_REBUILD_IN_BACKGROUND = config('INDEX_REBUILD_IN_BACKGROUND', default=True, cast=bool)
+
+# ТРАССИРОВКА И МЕТРИКИ (app/tracing.py)
+TRACING_ENABLED = config('TRACING_ENABLED', default=True, cast=bool)
+# Доля запросов с разбивкой времени по фазам и записью в лог app.tracing
+TRACING_SAMPLE_RATE = config('TRACING_SAMPLE_RATE', default=0.05, cast=float)
+# Метрики в формате Prometheus на /metrics/
+TRACING_METRICS_ENABLED = config('TRACING_METRICS_ENABLED', default=False, cast=bool)
+# Границы корзин гистограмм, секунды
+TRACING_HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# СТАРТ ВОРКЕРА (app/startup.py)
+# Прогревать воркер при импорте movie_project.wsgi/asgi: соединения с БД, шаблоны, индексы поиска и фасетов
+WARM_UP_ON_START = config('WARM_UP_ON_START', default=True, cast=bool)
+
 # ЛОГИРОВАНИЕ
 LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+# text или json (одна JSON-строка на запись, для сборщиков логов)
+LOG_FORMAT = config('LOG_FORMAT', default='text')
 
 LOGGING = {
     'version': 1,
@@ -174,24 +371,52 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'app.tracing.JSONFormatter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'simple',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'simple',
+        },
+        'console_verbose': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
+        },
+        'console_json': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
         },
     },
     'root': {
         'handlers': ['console'],
         'level': LOG_LEVEL,
     },
+    'loggers': {
+        'app.queries': {
+            'handlers': ['console_verbose'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'app.tracing': {
+            'handlers': ['console_json'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
 }
 
 # Яндекс OAuth настройки
 AUTHENTICATION_BACKENDS = (
-    'social_core.backends.yandex.YandexOAuth2',     # Яндекс вход
+    'app.auth_backends.YandexOAuth2',               # Яндекс вход (social_core импортируется при входе через Яндекс)
     'django.contrib.auth.backends.ModelBackend',    # обычный вход
+    # Переходный период: сессии, выданные до ленивого бэкенда, хранят этот путь. Убрать, когда
+    # они истекут (SESSION_COOKIE_AGE, по умолчанию две недели)
+    'social_core.backends.yandex.YandexOAuth2',
 )
+# Бэкенды, которые social_django загружает на /oauth/
+SOCIAL_AUTH_AUTHENTICATION_BACKENDS = ('social_core.backends.yandex.YandexOAuth2',)
 
 # Ключи Яндекс OAuth
 SOCIAL_AUTH_YANDEX_OAUTH2_KEY = config('YANDEX_OAUTH2_KEY', default='')